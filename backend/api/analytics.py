@@ -0,0 +1,63 @@
+"""
+Cross-upload trend aggregates, computed with GROUP BY in the database.
+
+Grouping is always (upload_id, <field>) so the (upload_id, eq_type) and
+(name) indexes on Equipment drive the scan; only the aggregated rows reach
+Python, never the Equipment rows themselves. Uploads kept in columnar
+storage are grouped with Arrow over their memory-mapped Parquet parts.
+"""
+from django.db.models import Avg, Count, Max, Min
+
+from .columnar import group_aggregates
+from .models import Equipment, FileUpload
+
+METRICS = ['flowrate', 'pressure', 'temperature']
+
+
+def _aggregates():
+    aggs = {'count': Count('id')}
+    for field in METRICS:
+        aggs[f'avg_{field}'] = Avg(field)
+        aggs[f'min_{field}'] = Min(field)
+        aggs[f'max_{field}'] = Max(field)
+    return aggs
+
+
+def equipment_trends(user, group_field, names=None, types=None):
+    """
+    Aggregates of `user`'s Equipment per upload and per `group_field`
+    ('eq_type' or 'name'), oldest upload first.
+    """
+    user_uploads = list(
+        FileUpload.objects.filter(user=user).only('id', 'uploaded_at', 'columnar_path', 'source_id')
+    )
+    # Deduplicated uploads share rows, so aggregate once per data id and fan out
+    by_data_id = {}
+    for upload in user_uploads:
+        by_data_id.setdefault(upload.data_id, []).append(upload)
+
+    qs = Equipment.objects.filter(upload_id__in=[u.data_id for u in user_uploads if not u.columnar_path])
+    if names:
+        qs = qs.filter(name__in=names)
+    if types:
+        qs = qs.filter(eq_type__in=types)
+
+    rows = list(qs.values('upload_id', group_field).annotate(**_aggregates()).order_by())
+    # Columnar uploads are aggregated from their Parquet parts with Arrow
+    for data_id, uploads in by_data_id.items():
+        if uploads[0].columnar_path:
+            rows += group_aggregates(uploads[0], group_field, names=names, types=types, upload_id=data_id)
+
+    data = []
+    for row in rows:
+        for upload in by_data_id[row['upload_id']]:
+            data.append(dict(
+                row,
+                upload_id=upload.id,
+                date=upload.uploaded_at.strftime("%Y-%m-%d"),
+                uploaded_at=upload.uploaded_at
+            ))
+    data.sort(key=lambda r: (r['uploaded_at'], r[group_field]))
+    for row in data:
+        row['uploaded_at'] = row['uploaded_at'].isoformat()
+    return data
@@ -0,0 +1,162 @@
+"""
+Per-type outlier flags for equipment rows.
+
+Each type gets a robust centre and spread per measurement at ingest: the
+median and the median absolute deviation (MAD), from one vectorized
+groupby/transform over the stats sample (exact for files up to
+STATS_SAMPLE_ROWS rows). A value is an outlier when its modified z-score,
+0.6745 * |x - median| / MAD, is above ANOMALY_THRESHOLD (Iglewicz and
+Hoaglin), so the bounds are median +/- ANOMALY_THRESHOLD * MAD / 0.6745.
+Where more than half the values are equal (MAD = 0) the mean absolute
+deviation stands in, scaled by 1.2533.
+
+Flags are a bitmask on Equipment.anomaly, set after the rows are inserted by
+one UPDATE per type that only writes the rows outside the bounds. The
+partial index over flagged rows keeps the anomaly listing an index range
+scan, however large the upload. Parquet uploads store no flags; they are
+computed from the same bounds, a batch at a time, when rows are read.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Case, Q, Value, When
+
+from .columnar import iter_batches, schema
+from .models import CSV_COLUMNS, Equipment
+from .stats import NUMERIC_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # only Parquet uploads need it, as in api.columnar
+    pa = pc = None
+
+FLAG_BITS = {'flowrate': 1, 'pressure': 2, 'temperature': 4}
+# Types with fewer sampled rows than this get no bounds
+MIN_TYPE_ROWS = 5
+
+
+def robust_bounds(sample, threshold=None):
+    """{type: {column: {median, mad, low, high}}} from a frame with Type and NUMERIC_COLUMNS."""
+    threshold = settings.ANOMALY_THRESHOLD if threshold is None else threshold
+    if sample is None or not len(sample):
+        return {}
+    values = sample[NUMERIC_COLUMNS]
+    groups = values.groupby(sample['Type'], observed=True)
+    deviation = (values - groups.transform('median')).abs().groupby(sample['Type'], observed=True)
+    median, mad, mean_ad = groups.median(), deviation.median(), deviation.mean()
+    spread = (mad / 0.6745).where(mad > 0, mean_ad * 1.2533)
+    counts = groups.size()
+
+    bounds = {}
+    for eq_type in median.index[counts >= MIN_TYPE_ROWS]:
+        for col in NUMERIC_COLUMNS:
+            width = spread.at[eq_type, col]
+            if not width > 0:  # every sampled value is the same
+                continue
+            centre = float(median.at[eq_type, col])
+            bounds.setdefault(str(eq_type), {})[col.lower()] = {
+                "median": centre,
+                "mad": float(mad.at[eq_type, col]),
+                "low": centre - threshold * float(width),
+                "high": centre + threshold * float(width),
+            }
+    return bounds
+
+
+def flag_codes(codes, types, columns, bounds):
+    """
+    Anomaly bitmask per row, without a loop over rows: the bounds of the
+    `types` are gathered by each row's index into them (`codes`; -1 for a
+    type without bounds) and compared column by column. `columns` is
+    {field: values}.
+    """
+    codes = np.asarray(codes)
+    flags = np.zeros(len(codes), dtype=np.int16)
+    for field, bit in FLAG_BITS.items():
+        # One slot per type plus a trailing NaN for code -1; comparisons with NaN are false
+        low, high = (np.array([bounds.get(t, {}).get(field, {}).get(key, np.nan) for t in types] + [np.nan])
+                     for key in ('low', 'high'))
+        values = np.asarray(columns[field], dtype=float)
+        flags[(values < low[codes]) | (values > high[codes])] |= bit
+    return flags
+
+
+def flag_array(types, columns, bounds):
+    # Same, for one type per row
+    codes, uniques = pd.factorize(np.asarray(types, dtype=object))
+    return flag_codes(codes, list(uniques), columns, bounds)
+
+
+def flag_chunk(chunk, bounds):
+    # Same, for a parsed CSV chunk, whose Type is already categorical
+    types = chunk['Type'].cat
+    columns = {CSV_COLUMNS[c]: chunk[c].to_numpy() for c in NUMERIC_COLUMNS}
+    return flag_codes(types.codes.to_numpy(), list(types.categories), columns, bounds)
+
+
+def flag_batch(batch, bounds):
+    # Same, for an Arrow RecordBatch of a Parquet upload
+    types = pc.dictionary_encode(batch.column('eq_type'))
+    columns = {f: batch.column(f).to_numpy(zero_copy_only=False) for f in FLAG_BITS}
+    return flag_codes(types.indices.to_numpy(zero_copy_only=False), types.dictionary.to_pylist(), columns, bounds)
+
+
+def outside(field, limits):
+    return Q(**{f'{field}__lt': limits['low']}) | Q(**{f'{field}__gt': limits['high']})
+
+
+def flag_rows(upload, bounds, after_id=None):
+    """
+    Set Equipment.anomaly for the rows of `upload` (those after `after_id`
+    only, for appends). Returns how many rows were flagged.
+    """
+    flagged = 0
+    for eq_type, cols in bounds.items():
+        fields = [(f, cols[f]) for f in FLAG_BITS if f in cols]
+        if not fields:
+            continue
+        rows = Equipment.objects.filter(upload_id=upload.data_id, eq_type=eq_type)
+        if after_id is not None:
+            rows = rows.filter(id__gt=after_id)
+        any_outside = Q()
+        flags = Value(0)
+        for field, limits in fields:
+            any_outside |= outside(field, limits)
+            flags = flags + Case(When(outside(field, limits), then=Value(FLAG_BITS[field])), default=Value(0))
+        flagged += rows.filter(any_outside).update(anomaly=flags)
+    return flagged
+
+
+def count_columnar(upload, bounds):
+    """Flagged rows of a Parquet upload, one batch at a time."""
+    flagged = 0
+    for batch in iter_batches(upload, ['eq_type'] + list(FLAG_BITS)):
+        flagged += int(np.count_nonzero(flag_batch(batch, bounds)))
+    return flagged
+
+
+def columnar_anomaly_page(upload, bounds, cursor=None, limit=500):
+    """
+    Flagged rows of a Parquet upload after row number `cursor` (1-based), as
+    ({field: [values]}, next_cursor, flags). Batches are scanned in order
+    until the page is full, so later pages cost more than the first.
+    """
+    start = cursor or 0
+    tables, flags, positions = [], [], []
+    offset = 0
+    for batch in iter_batches(upload, list(CSV_COLUMNS.values())):
+        if offset + batch.num_rows > start:
+            batch_flags = flag_batch(batch, bounds)
+            hits = np.flatnonzero(batch_flags)
+            hits = hits[hits + offset >= start][:limit + 1 - len(flags)]
+            tables.append(batch.take(pa.array(hits)))
+            flags.extend(batch_flags[hits].tolist())
+            positions.extend((hits + offset + 1).tolist())
+        offset += batch.num_rows
+        if len(flags) > limit:
+            break
+
+    found = pa.Table.from_batches(tables) if tables else schema().empty_table()
+    next_cursor = positions[limit - 1] if len(flags) > limit else None
+    return found.slice(0, limit).to_pydict(), next_cursor, flags[:limit]
@@ -0,0 +1,445 @@
+"""
+Reproducible end-to-end benchmarks for ingest, history and PDF reports.
+
+`python manage.py benchmark` generates equipment CSVs of the requested sizes
+(seeded, so every run sends the same bytes) and drives UploadCSVView,
+HistoryView, AnomaliesView (first page) and GeneratePDFView through the
+Django test client against a throwaway database, MEDIA_ROOT and report cache. Each stage records wall
+time, rows/s, the queries run by this process and its peak RSS. With
+clients > 0 each size is also uploaded by that many parallel clients, each
+reading its history after every upload, to show latency under contention.
+Results are written as JSON, and compare() flags the stages of a run that
+regressed against an earlier one.
+
+Queries are counted in this process only: PDF rendering runs in the
+REPORT_WORKERS processes and, on SQLite, ingest in the writer process
+(api.writer), whose memory is included in the RSS figures (as
+PSS on Linux, so the pages they share with this process are counted once).
+"""
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import threading
+import time
+from collections import Counter
+
+import django
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .authentication import issue_token
+from .models import Equipment, FileUpload
+
+RESULTS_VERSION = 1
+# Bump when generate_csv() changes, so cached CSVs from an older generator aren't reused
+GENERATOR_VERSION = 1
+GENERATE_CHUNK_ROWS = 500000
+# Unmeasured pass before the first size: starts the report workers and fills lazy caches
+WARMUP_ROWS = 100
+
+# (type, tag prefix, share of units, flowrate m3/h, pressure bar, temperature C)
+EQUIPMENT_TYPES = [
+    ('Pump', 'P', 0.22, 120.0, 6.0, 45.0),
+    ('Valve', 'V', 0.20, 90.0, 5.0, 40.0),
+    ('Heat Exchanger', 'E', 0.12, 150.0, 8.0, 110.0),
+    ('Compressor', 'K', 0.08, 300.0, 12.0, 80.0),
+    ('Reactor', 'R', 0.07, 200.0, 15.0, 180.0),
+    ('Column', 'T', 0.06, 250.0, 3.0, 95.0),
+    ('Condenser', 'C', 0.06, 140.0, 2.5, 35.0),
+    ('Tank', 'TK', 0.06, 60.0, 1.2, 25.0),
+    ('Separator', 'S', 0.05, 110.0, 4.0, 60.0),
+    ('Mixer', 'M', 0.04, 80.0, 2.0, 50.0),
+    ('Filter', 'F', 0.03, 70.0, 3.5, 30.0),
+    ('Boiler', 'B', 0.01, 400.0, 20.0, 220.0),
+]
+
+# Changes smaller than these never count as regressions, whatever the ratio
+MIN_WALL_DELTA = 0.005  # seconds
+MIN_RSS_DELTA = 32.0  # MB
+
+
+def parse_count(text):
+    """'1k' -> 1000, '2.5m' -> 2500000."""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+
+def generate_csv(path, rows, seed=0):
+    """
+    Write `rows` synthetic readings to `path`, the same bytes for the same seed.
+
+    Readings come from a fixed plant of about one unit per 40 rows (at least
+    one per type, at most 20,000), so names repeat like periodic exports do.
+    Units are spread over EQUIPMENT_TYPES by their share; each unit has its
+    own operating point around its type's means and readings scatter around it.
+    """
+    rng = np.random.default_rng(seed)
+    shares = np.array([t[2] for t in EQUIPMENT_TYPES])
+    n_units = min(max(rows // 40, len(EQUIPMENT_TYPES)), 20000)
+    unit_types = np.concatenate([np.arange(len(EQUIPMENT_TYPES)),
+                                 rng.choice(len(EQUIPMENT_TYPES), n_units - len(EQUIPMENT_TYPES), p=shares / shares.sum())])
+    names = np.array([f'{EQUIPMENT_TYPES[t][1]}-{i + 1:05d}' for i, t in enumerate(unit_types)], dtype=object)
+    types = np.array([EQUIPMENT_TYPES[t][0] for t in unit_types], dtype=object)
+    means = np.array([t[3:] for t in EQUIPMENT_TYPES])[unit_types]
+    flowrate = means[:, 0] * rng.lognormal(0, 0.3, n_units)
+    pressure = means[:, 1] * rng.lognormal(0, 0.2, n_units)
+    temperature = means[:, 2] + rng.normal(0, 10, n_units)
+
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'w', newline='') as f:
+        for start in range(0, rows, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, rows - start)
+            unit = rng.integers(0, n_units, n)
+            pd.DataFrame({
+                'Equipment Name': names[unit],
+                'Type': types[unit],
+                'Flowrate': (flowrate[unit] * rng.normal(1, 0.05, n)).round(1),
+                'Pressure': (pressure[unit] * rng.normal(1, 0.03, n)).round(2),
+                'Temperature': (temperature[unit] + rng.normal(0, 2, n)).round(1),
+            }).to_csv(f, header=start == 0, index=False)
+        if not rows:
+            f.write('Equipment Name,Type,Flowrate,Pressure,Temperature\n')
+    os.replace(tmp_path, path)
+
+
+def dataset_path(data_dir, rows, seed):
+    """Path of the generated CSV for (rows, seed), generating it on first use."""
+    path = os.path.join(data_dir, f'equipment-{rows}-s{seed}-v{GENERATOR_VERSION}.csv')
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        generate_csv(path, rows, seed)
+    return path
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_memory(pid):
+    # PSS where the kernel reports it: pages a forked worker still shares with us count once
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def current_rss():
+    """Resident bytes of this process and its worker processes."""
+    try:
+        total = process_memory('self')
+    except OSError:
+        # No /proc: the high-water mark of this process alone (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == 'Darwin' else peak * 1024
+    try:
+        children = multiprocessing.active_children()
+    except RuntimeError:  # the pool started a process while we were looking
+        children = []
+    for child in children:
+        try:
+            total += process_memory(child.pid)
+        except OSError:
+            pass
+    return total
+
+
+class MemorySampler:
+    """Peak of current_rss() while the block runs, sampled every `interval` seconds."""
+
+    def __init__(self, interval=0.25):
+        # Reading smaps_rollup walks the page tables of each process, which slows
+        # a busy worker down measurably when done every few milliseconds
+        self.interval = interval
+        self.start = self.peak = 0
+        self.done = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def measure(request):
+    """Run request() once and return (response, measurements)."""
+    with MemorySampler() as memory, CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = request()
+        wall = time.perf_counter() - started
+    return response, {
+        "status": response.status_code,
+        "wall_s": wall,
+        "queries": len(queries),
+        "peak_rss_mb": memory.peak / 1e6,
+        "rss_growth_mb": (memory.peak - memory.start) / 1e6,
+    }
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(stage, rows, runs):
+    """One result per (rows, stage): medians over the repeats, and the highest peak."""
+    wall = statistics.median(r['wall_s'] for r in runs)
+    return {
+        "rows": rows,
+        "stage": stage,
+        "status": runs[-1]['status'],
+        "wall_s": round(wall, 4),
+        "rows_per_s": round(rows / wall) if wall else None,
+        "queries": runs[-1]['queries'],
+        "peak_rss_mb": round(max(r['peak_rss_mb'] for r in runs), 1),
+        "rss_growth_mb": round(statistics.median(r['rss_growth_mb'] for r in runs), 1),
+        "wall_s_runs": [round(r['wall_s'], 4) for r in runs],
+    }
+
+
+class Benchmark:
+    """
+    Runs the stages for each size against the current (throwaway) database.
+
+    Stages per size: ingest (sync POST /api/upload/), history and
+    history_304 (GET /api/history/, then revalidated with its ETag), pdf and
+    pdf_cached (first render, then served from the report cache; only up to
+    pdf_max_rows). A small unmeasured pass runs first, and the user's
+    uploads are deleted before each repeat, so the ingest is never answered
+    by deduplication.
+    """
+
+    def __init__(self, user, data_dir, seed=0, repeat=3, pdf_max_rows=100000, clients=0, rounds=3, log=None):
+        self.user = user
+        self.data_dir = data_dir
+        self.seed = seed
+        self.repeat = repeat
+        self.pdf_max_rows = pdf_max_rows
+        self.clients = clients
+        self.rounds = rounds
+        self.log = log or (lambda line: None)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {issue_token(user)}')
+        self.datasets = {}
+
+    def reset(self):
+        # Everything in the throwaway database, including the parallel clients' uploads
+        Equipment.objects.all().delete()
+        FileUpload.objects.filter(source__isnull=False).delete()
+        FileUpload.objects.all().delete()
+
+    def run(self, sizes):
+        self.reset()
+        for _ in self.run_once(WARMUP_ROWS, dataset_path(self.data_dir, WARMUP_ROWS, self.seed)):
+            pass
+        results = []
+        for rows in sizes:
+            path = dataset_path(self.data_dir, rows, self.seed)
+            self.datasets[rows] = {"path": os.path.basename(path), "bytes": os.path.getsize(path)}
+            runs = {}
+            for _ in range(self.repeat):
+                self.reset()
+                for stage, measured in self.run_once(rows, path):
+                    runs.setdefault(stage, []).append(measured)
+            for stage, stage_runs in runs.items():
+                result = summarize(stage, rows, stage_runs)
+                self.log(result)
+                results.append(result)
+            if self.clients:
+                self.reset()
+                for result in self.run_concurrent(rows, path):
+                    self.log(result)
+                    results.append(result)
+        self.reset()
+        return results
+
+    def run_concurrent(self, rows, path):
+        """
+        `clients` threads, each its own user on its own connection, upload the
+        dataset `rounds` times (one extra row per copy keeps deduplication out)
+        and GET their history after every upload, all starting together.
+        Returns ingest@N and history@N results with median/p95/max latency.
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+        users = [User.objects.get_or_create(username=f'benchmark-client-{i}')[0] for i in range(self.clients)]
+        latencies = {'ingest': [], 'history': []}
+        statuses = {'ingest': Counter(), 'history': Counter()}
+        lock = threading.Lock()
+        start = threading.Barrier(self.clients)
+
+        def timed(kind, request):
+            started = time.perf_counter()
+            try:
+                status = request().status_code
+            except Exception as e:
+                status = type(e).__name__
+            with lock:
+                latencies[kind].append(time.perf_counter() - started)
+                statuses[kind][status] += 1
+
+        def client(i):
+            try:
+                c = Client(HTTP_AUTHORIZATION=f'Token {issue_token(users[i])}', raise_request_exception=False)
+                bodies = [encode_multipart(BOUNDARY, {'file': SimpleUploadedFile(
+                    'benchmark.csv', content + f'BENCH-{i}-{r},Pump,1,1,1\n'.encode())}) for r in range(self.rounds)]
+                start.wait()
+                for body in bodies:
+                    timed('ingest', lambda: c.generic('POST', reverse('upload'), body, content_type=MULTIPART_CONTENT))
+                    timed('history', lambda: c.get(reverse('history')))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(self.clients)]
+        with MemorySampler() as memory:
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - started
+
+        results = []
+        for kind in ('ingest', 'history'):
+            ok = statuses[kind][200]
+            results.append({
+                "rows": rows,
+                "stage": f'{kind}@{self.clients}',
+                "clients": self.clients,
+                "requests": len(latencies[kind]),
+                "errors": len(latencies[kind]) - ok,
+                "statuses": {str(k): v for k, v in statuses[kind].items()},
+                "wall_s": round(statistics.median(latencies[kind]), 4),
+                "p95_s": round(percentile(latencies[kind], 0.95), 4),
+                "max_s": round(max(latencies[kind]), 4),
+                # Rows stored per second across all clients, over the whole phase
+                "rows_per_s": round(ok * (rows + 1) / wall) if kind == 'ingest' else None,
+                "queries": None,
+                "peak_rss_mb": round(memory.peak / 1e6, 1),
+                "rss_growth_mb": round((memory.peak - memory.start) / 1e6, 1),
+                "status": statuses[kind].most_common(1)[0][0],
+            })
+        return results
+
+    def run_once(self, rows, path):
+        # The multipart body is built before the clock starts: it's the client's cost, not the server's
+        with open(path, 'rb') as f:
+            body = encode_multipart(BOUNDARY, {'file': f})
+        response, measured = measure(lambda: self.client.generic(
+            'POST', reverse('upload'), body, content_type=MULTIPART_CONTENT))
+        del body
+        yield 'ingest', measured
+        if response.status_code != 200:
+            raise RuntimeError(f'Upload of {rows} rows failed: {response.status_code} {response.content[:200]!r}')
+        upload_id = response.json()['id']
+
+        response, measured = measure(lambda: self.client.get(reverse('history')))
+        yield 'history', measured
+        etag = response['ETag']
+        _, measured = measure(lambda: self.client.get(reverse('history'), HTTP_IF_NONE_MATCH=etag))
+        yield 'history_304', measured
+
+        response, measured = measure(lambda: self.client.get(reverse('anomalies', args=[upload_id])))
+        yield 'anomalies', measured
+
+        if rows <= self.pdf_max_rows:
+            url = reverse('generate_pdf', args=[upload_id])
+            for stage in ('pdf', 'pdf_cached'):
+                response, measured = measure(lambda: self.client.get(url))
+                response.close()
+                yield stage, measured
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata(benchmark):
+    return {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "database": connection.vendor,
+        "seed": benchmark.seed,
+        "repeat": benchmark.repeat,
+        "clients": benchmark.clients,
+        "rounds": benchmark.rounds,
+        "datasets": {str(rows): info for rows, info in benchmark.datasets.items()},
+        "settings": {name: getattr(settings, name) for name in (
+            'CSV_ENGINE', 'CSV_CHUNK_SIZE', 'CSV_BLOCK_SIZE', 'EQUIPMENT_BATCH_SIZE', 'COLUMNAR_STORAGE',
+            'SQLITE_WRITER_QUEUE', 'ANOMALY_THRESHOLD', 'REPORT_WORKERS', 'REPORT_FETCH_SIZE')},
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    (rows, stage, metric, old, new, regressed) for each stage in both runs.
+
+    Wall time (or median latency) and memory growth regress when they rise
+    by more than `threshold` (a fraction) and by more than MIN_WALL_DELTA /
+    MIN_RSS_DELTA; any increase in the query or error count is a regression.
+    """
+    old = {(r['rows'], r['stage']): r for r in baseline['results']}
+    changes = []
+    for r in current['results']:
+        before = old.get((r['rows'], r['stage']))
+        if before is None:
+            continue
+        for metric, min_delta in (('wall_s', MIN_WALL_DELTA), ('p95_s', MIN_WALL_DELTA),
+                                  ('rss_growth_mb', MIN_RSS_DELTA), ('queries', 0), ('errors', 0)):
+            a, b = before.get(metric), r.get(metric)
+            if a is None or b is None:
+                continue
+            if metric in ('queries', 'errors'):
+                regressed = b > a
+            else:
+                regressed = b - a > max(a * threshold, min_delta)
+            changes.append((r['rows'], r['stage'], metric, a, b, regressed))
+    return changes
+
+
+def metadata_differences(baseline, current):
+    """Descriptions of setup differences that make two runs hard to compare."""
+    a, b = baseline['meta'], current['meta']
+    notes = []
+    for key in ('seed', 'database', 'python', 'cpus', 'rounds'):
+        if a.get(key) != b.get(key):
+            notes.append(f'{key}: {a.get(key)} -> {b.get(key)}')
+    for name in sorted(set(a.get('settings', {})) | set(b.get('settings', {}))):
+        if a.get('settings', {}).get(name) != b.get('settings', {}).get(name):
+            notes.append(f'{name}: {a["settings"].get(name)} -> {b["settings"].get(name)}')
+    for rows in sorted(set(a.get('datasets', {})) & set(b.get('datasets', {})), key=int):
+        if a['datasets'][rows]['bytes'] != b['datasets'][rows]['bytes']:
+            notes.append(f'the {rows}-row CSV differs ({a["datasets"][rows]["bytes"]} -> '
+                         f'{b["datasets"][rows]["bytes"]} bytes)')
+    return notes
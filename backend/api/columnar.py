@@ -0,0 +1,183 @@
+"""
+Optional columnar storage of an upload's measurements.
+
+With COLUMNAR_STORAGE on, the ingest writes each upload as a Parquet dataset
+directory next to the stored CSV (MEDIA_ROOT/uploads/<file>.parquet/), one
+zstd-compressed part per write, instead of one Equipment row per CSV row.
+Readers memory-map the parts and only touch the row groups they need.
+FileUpload.columnar_path is set for uploads stored this way; uploads without
+it keep using the Equipment table, so both kinds can live side by side.
+"""
+import os
+import shutil
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import CSV_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # only needed when COLUMNAR_STORAGE is enabled
+    pa = pc = pq = None
+
+METRICS = ['flowrate', 'pressure', 'temperature']
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImproperlyConfigured("COLUMNAR_STORAGE needs pyarrow (pip install pyarrow)")
+
+
+def schema():
+    return pa.schema([
+        ('name', pa.string()),
+        ('eq_type', pa.string()),
+        ('flowrate', pa.float64()),
+        ('pressure', pa.float64()),
+        ('temperature', pa.float64()),
+    ])
+
+
+def dataset_dir(upload):
+    return os.path.join(settings.MEDIA_ROOT, upload.columnar_path)
+
+
+def new_dataset_path(upload):
+    return f"{upload.file.name}.parquet"
+
+
+def part_paths(upload):
+    path = dataset_dir(upload)
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.parquet')]
+
+
+def delete_dataset(upload):
+    # Deduplicated uploads share one dataset; only remove it with its last user
+    if upload.columnar_path and not type(upload).objects.filter(columnar_path=upload.columnar_path).exists():
+        shutil.rmtree(dataset_dir(upload), ignore_errors=True)
+
+
+def discard_parts(upload):
+    # Parts written by an ingest that never finished, before columnar_path was saved
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, new_dataset_path(upload)), ignore_errors=True)
+
+
+class ColumnarWriter:
+    """Appends ingest chunks to a new part file of the upload's dataset."""
+
+    def __init__(self, upload):
+        require_pyarrow()
+        if not upload.columnar_path:
+            upload.columnar_path = new_dataset_path(upload)
+        directory = dataset_dir(upload)
+        os.makedirs(directory, exist_ok=True)
+        part = len([n for n in os.listdir(directory) if n.endswith('.parquet')])
+        self.path = os.path.join(directory, f"part-{part:05d}.parquet")
+        self.writer = pq.ParquetWriter(self.path, schema(), compression='zstd')
+
+    def write(self, chunk):
+        frame = chunk[list(CSV_COLUMNS)].rename(columns=CSV_COLUMNS)
+        frame['name'] = frame['name'].astype(str)
+        frame['eq_type'] = frame['eq_type'].astype(str)
+        table = pa.Table.from_pandas(frame, schema=schema(), preserve_index=False)
+        # One row group per chunk, so page reads can skip whole chunks
+        self.writer.write_table(table, row_group_size=len(frame) or None)
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def iter_row_groups(upload):
+    """Yield (first_row_number, ParquetFile, row_group_index) in storage order."""
+    offset = 0
+    for path in part_paths(upload):
+        parquet = pq.ParquetFile(path, memory_map=True)
+        for i in range(parquet.num_row_groups):
+            yield offset, parquet, i
+            offset += parquet.metadata.row_group(i).num_rows
+
+
+def read_page(upload, cursor=None, limit=500):
+    """
+    Rows after row number `cursor` (1-based), mirroring the keyset pages of
+    the Equipment table. Row groups before the cursor are skipped using
+    metadata only. Returns ({field: [values]}, next_cursor).
+    """
+    start = cursor or 0
+    tables = []
+    wanted = limit + 1
+    for offset, parquet, i in iter_row_groups(upload):
+        num_rows = parquet.metadata.row_group(i).num_rows
+        if offset + num_rows <= start:
+            continue
+        group = parquet.read_row_group(i)
+        group = group.slice(max(start - offset, 0), wanted)
+        tables.append(group)
+        wanted -= group.num_rows
+        if wanted <= 0:
+            break
+
+    found = pa.concat_tables(tables) if tables else schema().empty_table()
+    next_cursor = start + limit if found.num_rows > limit else None
+    return found.slice(0, limit).to_pydict(), next_cursor
+
+
+def iter_rows_by_type(upload, types, batch_size=2000):
+    """
+    (name, eq_type, flowrate, pressure, temperature) tuples ordered by type,
+    then storage order. One pass over the memory-mapped parts per type, a
+    batch at a time, so memory stays bounded.
+    """
+    columns = list(CSV_COLUMNS.values())
+    for eq_type in types:
+        for path in part_paths(upload):
+            parquet = pq.ParquetFile(path, memory_map=True)
+            for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+                batch = batch.filter(pc.equal(batch.column('eq_type'), eq_type))
+                if batch.num_rows:
+                    yield from zip(*(batch.column(c).to_pylist() for c in columns))
+
+
+def iter_batches(upload, columns, batch_size=65536):
+    """RecordBatches of `columns` across the memory-mapped parts, for single-pass scans."""
+    for path in part_paths(upload):
+        parquet = pq.ParquetFile(path, memory_map=True)
+        yield from parquet.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def read_table(upload, columns, names=None, types=None):
+    table = pa.concat_tables([
+        pq.read_table(path, columns=columns, memory_map=True) for path in part_paths(upload)
+    ])
+    if names:
+        table = table.filter(pc.is_in(table.column('name'), value_set=pa.array(names)))
+    if types:
+        table = table.filter(pc.is_in(table.column('eq_type'), value_set=pa.array(types)))
+    return table
+
+
+def group_aggregates(upload, group_field, names=None, types=None, upload_id=None):
+    """Same aggregates as the SQL path in api.analytics, computed with Arrow."""
+    table = read_table(upload, ['name', 'eq_type'] + METRICS, names=names, types=types)
+    aggs = [(group_field, 'count')]
+    for field in METRICS:
+        aggs += [(field, 'mean'), (field, 'min'), (field, 'max')]
+    result = table.group_by(group_field).aggregate(aggs).to_pylist()
+
+    rows = []
+    for r in result:
+        row = {'upload_id': upload_id or upload.id, group_field: r[group_field], 'count': r[f'{group_field}_count']}
+        for field in METRICS:
+            row[f'avg_{field}'] = r[f'{field}_mean']
+            row[f'min_{field}'] = r[f'{field}_min']
+            row[f'max_{field}'] = r[f'{field}_max']
+        rows.append(row)
+    return rows
@@ -0,0 +1,321 @@
+import hashlib
+import io
+from contextlib import nullcontext
+from itertools import islice, repeat
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .anomalies import count_columnar, flag_chunk, flag_rows, robust_bounds
+from .columnar import ColumnarWriter
+from .instrumentation import stage, timed_iter
+from .models import CSV_COLUMNS, Equipment, FileUpload, UploadSummary
+from .pagination import equipment_page
+from .parsing import CSVError, RowErrors, iter_csv_chunks
+from .reports import evict_reports
+from .stats import RunningStats
+
+
+def insert_equipment(upload, chunk):
+    """
+    Insert a chunk as Equipment rows straight from its column arrays.
+
+    Skips Series-per-row iteration and model instantiation: the columns are
+    zipped into parameter tuples and sent with cursor.executemany(), one
+    EQUIPMENT_BATCH_SIZE batch at a time. PostgreSQL streams them with COPY
+    instead (see copy_equipment()).
+    """
+    opts = Equipment._meta
+    qn = connection.ops.quote_name
+    fields = ['upload'] + list(CSV_COLUMNS.values())
+    table = qn(opts.db_table)
+    columns = ', '.join(qn(opts.get_field(f).column) for f in fields)
+
+    if connection.vendor == 'postgresql' and settings.POSTGRES_COPY:
+        return copy_equipment(upload, chunk, table, columns)
+
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+
+    rows = zip(
+        repeat(upload.pk, len(chunk)),
+        *(chunk[col].tolist() for col in CSV_COLUMNS)
+    )
+    batch_size = settings.EQUIPMENT_BATCH_SIZE
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+
+
+def copy_field(value):
+    # COPY text format: \N is NULL; backslash, tab and line breaks are escaped
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+def copy_equipment(upload, chunk, table, columns):
+    """
+    PostgreSQL bulk load: one COPY ... FROM STDIN per chunk, no per-row
+    statements. Works with psycopg 3 (write_row) and psycopg2 (copy_expert).
+    """
+    # NaN becomes NULL, so a missing value fails the NOT NULL columns as it does with INSERT
+    values = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist() for col in CSV_COLUMNS]
+    rows = zip(repeat(upload.pk, len(chunk)), *values)
+    sql = f"COPY {table} ({columns}) FROM STDIN"
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, 'copy'):
+            with raw.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write('\t'.join(map(copy_field, row)) + '\n')
+            buffer.seek(0)
+            raw.copy_expert(sql, buffer)
+
+
+def open_upload(upload):
+    # Read back from storage rather than the request's UploadedFile, which the
+    # storage backend may already have moved into MEDIA_ROOT.
+    return upload.file.storage.open(upload.file.name, 'rb')
+
+
+def ingest_csv(upload, atomic=True, progress=None):
+    """
+    Stream the stored CSV of `upload` into Equipment rows.
+
+    The file is read CSV_CHUNK_SIZE rows at a time and only one chunk is held
+    in memory. Returns (stats, distribution); stats are also saved on `upload`
+    and the detailed per-type figures in its UploadSummary, with the report
+    of rows left out (see api.parsing) and the anomaly bounds once the rows
+    outside them are flagged (see api.anomalies). Raises CSVError if no row
+    was valid.
+
+    With atomic=False every chunk commits on its own, so `progress(rows)`
+    calls made after each chunk are visible to other connections.
+    """
+    stats = RunningStats(seed=upload.pk)
+    errors = RowErrors()
+    # COLUMNAR_STORAGE: measurements go to a Parquet dataset instead of Equipment rows
+    writer = ColumnarWriter(upload) if settings.COLUMNAR_STORAGE else None
+
+    try:
+        with open_upload(upload) as file_obj, (transaction.atomic() if atomic else nullcontext()):
+            for chunk in timed_iter('parse', iter_csv_chunks(file_obj, errors)):
+                with transaction.atomic(savepoint=False):
+                    with stage('stats'):
+                        stats.update(chunk)
+                    with stage('insert'):
+                        if writer:
+                            writer.write(chunk)
+                        else:
+                            insert_equipment(upload, chunk)
+                if progress:
+                    progress(stats.total_count)
+            if writer:
+                with stage('insert'):
+                    writer.close()
+            if errors.rows and not stats.total_count:
+                raise CSVError("No valid rows", errors.as_dict())
+
+            with stage('anomalies'):
+                bounds = robust_bounds(stats.sample)
+                with transaction.atomic(savepoint=False):
+                    flagged = count_columnar(upload, bounds) if writer else flag_rows(upload, bounds)
+                anomalies = {"threshold": settings.ANOMALY_THRESHOLD, "count": flagged, "by_type": bounds}
+
+            with stage('summary'):
+                for field, value in stats.as_dict().items():
+                    setattr(upload, field, value)
+                upload.save(update_fields=list(stats.as_dict()) + ['columnar_path'])
+                UploadSummary.objects.update_or_create(
+                    upload=upload,
+                    defaults={"distribution": dict(stats.distribution), "stats": stats.summary(),
+                              "moments": stats.moments(), "row_errors": errors.as_dict(),
+                              "anomalies": anomalies}
+                )
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+
+    return stats.as_dict(), dict(stats.distribution)
+
+
+def append_csv(upload, file_obj):
+    """
+    Add the rows of another CSV to an existing upload.
+
+    The stored moments are merged with those of the new rows (Chan et al.),
+    so count, means, std, min and max stay exact and only the appended rows
+    are read. Percentiles keep describing the first `percentile_rows` rows,
+    and the new rows are flagged against the anomaly bounds set at ingest.
+    Returns (stats, distribution, appended_rows, row_errors); row_errors
+    describes the appended file only.
+    """
+    writer = None
+    try:
+        with transaction.atomic():
+            # Lock the upload so concurrent appends to it merge one after another
+            upload = FileUpload.objects.select_for_update().get(pk=upload.pk)
+            summary = UploadSummary.objects.get(upload=upload)
+            stats = RunningStats.from_summary(upload, summary)
+            # Same storage as the original rows: Parquet uploads get a new part file
+            writer = ColumnarWriter(upload) if upload.columnar_path else None
+
+            anomalies = dict(summary.anomalies)
+            bounds = anomalies.get('by_type', {})
+            last_id = None
+            if not writer:
+                # Rows after this id are the appended ones
+                last_id = Equipment.objects.filter(upload_id=upload.pk).aggregate(last=Max('id'))['last']
+
+            appended = 0
+            flagged = 0
+            errors = RowErrors()
+            for chunk in timed_iter('parse', iter_csv_chunks(file_obj, errors)):
+                with stage('stats'):
+                    stats.update(chunk)
+                appended += len(chunk)
+                if writer:
+                    with stage('anomalies'):
+                        flagged += int((flag_chunk(chunk, bounds) > 0).sum())
+                with stage('insert'):
+                    if writer:
+                        writer.write(chunk)
+                    else:
+                        insert_equipment(upload, chunk)
+            if writer:
+                with stage('insert'):
+                    writer.close()
+            if errors.rows and not appended:
+                raise CSVError("No valid rows", errors.as_dict())
+            if not writer:
+                with stage('anomalies'):
+                    flagged = flag_rows(upload, bounds, after_id=last_id)
+            if anomalies:
+                anomalies['count'] = anomalies.get('count', 0) + flagged
+
+            for field, value in stats.as_dict().items():
+                setattr(upload, field, value)
+            # The stored file no longer describes the rows, so it can't be deduplicated against
+            upload.content_hash = ''
+            upload.save(update_fields=list(stats.as_dict()) + ['content_hash'])
+
+            details = stats.summary()
+            for key in ('percentile_sample', 'percentile_rows'):
+                details[key] = summary.stats.get(key, details[key])
+            keep_percentiles(details, summary.stats)
+            summary.distribution = dict(stats.distribution)
+            summary.stats = details
+            summary.moments = stats.moments()
+            summary.anomalies = anomalies
+            summary.save()
+            transaction.on_commit(lambda: evict_reports(upload.id))
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+
+    return stats.as_dict(), dict(stats.distribution), appended, errors.as_dict()
+
+
+def keep_percentiles(details, previous):
+    # Carry the percentiles computed at ingest over into the merged stats
+    sections = [(details['overall'], previous.get('overall', {}))]
+    for eq_type, cols in details['by_type'].items():
+        sections.append((cols, previous.get('by_type', {}).get(eq_type, {})))
+    for cols, old_cols in sections:
+        for key, described in cols.items():
+            for name in described:
+                if name.startswith('p'):
+                    described[name] = old_cols.get(key, {}).get(name)
+
+
+def content_digest(file_obj, known=None):
+    """SHA-256 of an uploaded file; `known` is the digest taken while it streamed in."""
+    if known:
+        return known
+    sha256 = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        sha256.update(chunk)
+    file_obj.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate(digest, user):
+    # Only `user`'s own finished uploads (owned and summarised) are reused: sharing rows
+    # with another user's upload would tie their appends and deletes to this one
+    return (FileUpload.objects.filter(content_hash=digest, user=user, summary__isnull=False)
+            .select_related('summary').order_by('-uploaded_at').first())
+
+
+def clone_upload(existing, user, filename=''):
+    """
+    A new FileUpload for `user` with the same content as `existing`, uploaded as `filename`.
+
+    Reuses the stored file, the Equipment rows (through `source`) and the
+    statistics, so nothing is parsed or inserted again.
+    """
+    with transaction.atomic():
+        upload = FileUpload.objects.create(
+            user=user,
+            file=existing.file.name,
+            filename=filename,
+            content_hash=existing.content_hash,
+            source_id=existing.data_id,
+            columnar_path=existing.columnar_path,
+            total_count=existing.total_count,
+            avg_flowrate=existing.avg_flowrate,
+            avg_pressure=existing.avg_pressure,
+            avg_temperature=existing.avg_temperature,
+        )
+        UploadSummary.objects.create(
+            upload=upload,
+            distribution=existing.summary.distribution,
+            stats=existing.summary.stats,
+            moments=existing.summary.moments,
+            row_errors=existing.summary.row_errors,
+            anomalies=existing.summary.anomalies
+        )
+    return upload
+
+
+def upload_stats(upload):
+    return {
+        "total_count": upload.total_count,
+        "avg_flowrate": upload.avg_flowrate,
+        "avg_pressure": upload.avg_pressure,
+        "avg_temperature": upload.avg_temperature,
+    }
+
+
+def upload_result(upload, stats, distribution, columns=False):
+    # Response body for a finished upload: stats + distribution + first page of rows
+    rows, next_cursor, flags = equipment_page(upload, columns=columns)
+    return {
+        "id": upload.id,
+        "stats": stats,
+        "distribution": distribution,
+        "details": upload.summary.stats,
+        "row_errors": upload.summary.row_errors,
+        "anomalies": anomaly_summary(upload.summary.anomalies),
+        "data": rows,
+        "anomaly_flags": flags,
+        "next_cursor": next_cursor
+    }
+
+
+
+def anomaly_summary(anomalies):
+    # Flagged row count per upload; the bounds themselves come with /api/uploads/<id>/anomalies/
+    return {"threshold": anomalies.get('threshold'), "count": anomalies.get('count', 0)}
@@ -0,0 +1,224 @@
+"""
+Per-request stage timings, query counts and latency histograms.
+
+api.middleware.TimingMiddleware opens a RequestTimings for every request;
+code on the request path marks named stages with `with stage('parse'):` (or
+timed_iter() for loops that pull from an iterator), and every query on the
+default connection is counted and timed. The totals go out as a
+Server-Timing header and into the histograms in REGISTRY, which /metrics
+serves in the Prometheus text format.
+
+With PROFILE_SLOW_MS set, a PROFILE_SAMPLE_RATE share of requests also run
+under cProfile, and the profiles of those slower than the threshold are saved
+to PROFILE_DIR.
+
+Outside a request (ingest jobs, report workers) stage() does nothing. The
+histograms live in the process that served the request, so with several
+server processes each one reports its own share.
+"""
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'chemvis'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.stages = {}  # name -> seconds, summed over repeats (e.g. one per chunk)
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook: one call per execute()/executemany()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def merge(self, other):
+        for name, seconds in other['stages'].items():
+            self.add(name, seconds)
+        self.queries += other['queries']
+        self.db_seconds += other['db_seconds']
+
+    def server_timing(self, total):
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        parts.append(f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} queries"')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+@contextmanager
+def request_timings():
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Add the time spent in the block to stage `name` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def add_stage(name, seconds):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def timed_call(fn, *args):
+    """
+    (fn(*args), timings) for request work run in another process; pass the
+    timings to merge_timings() in the request. The wait before the call
+    started is reported as the 'queue' stage.
+    """
+    started = time.time()
+    with request_timings() as timings, connection.execute_wrapper(timings.execute_wrapper):
+        result = fn(*args)
+    return result, {"started": started, "stages": timings.stages,
+                    "queries": timings.queries, "db_seconds": timings.db_seconds}
+
+
+def merge_timings(data, submitted):
+    timings = _current.get()
+    if timings is not None:
+        timings.add('queue', max(data['started'] - submitted, 0.0))
+        timings.merge(data)
+
+
+def timed_iter(name, iterable):
+    """Yield from `iterable`, counting the time spent producing each item as stage `name`."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((k, list(v)) for k, v in self.series.items())
+        for label_values, values in series:
+            labels = ','.join(f'{k}="{escape(v)}"' for k, v in zip(self.labels, label_values))
+            sep = ',' if labels else ''
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {values[-2]!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {values[-1]}')
+        return '\n'.join(lines)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REQUEST_SECONDS = Histogram(f'{PREFIX}_request_duration_seconds', 'Time to handle a request, until the body starts',
+                            ('view', 'method', 'status'), SECONDS_BUCKETS)
+STAGE_SECONDS = Histogram(f'{PREFIX}_stage_duration_seconds', 'Time spent in a named stage of a request',
+                          ('view', 'stage'), SECONDS_BUCKETS)
+DB_SECONDS = Histogram(f'{PREFIX}_db_duration_seconds', 'Time spent in database queries per request',
+                       ('view',), SECONDS_BUCKETS)
+DB_QUERIES = Histogram(f'{PREFIX}_db_queries', 'Database queries per request', ('view',), QUERY_BUCKETS)
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, DB_SECONDS, DB_QUERIES]
+
+
+def record(view, method, status, total, timings):
+    REQUEST_SECONDS.observe(total, view, method, str(status))
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, view, name)
+    DB_SECONDS.observe(timings.db_seconds, view)
+    DB_QUERIES.observe(timings.queries, view)
+
+
+def exposition():
+    return '\n'.join(h.exposition() for h in REGISTRY) + '\n'
+
+
+def start_profiler():
+    """A running profiler if this request is sampled, else None."""
+    if settings.PROFILE_SLOW_MS is None or random.random() >= settings.PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Python 3.12+: another thread's request is being profiled
+        return None
+    return profiler
+
+
+def save_profile(profiler, view, total):
+    """Dump a stopped profiler if the request was slow; returns the file name."""
+    if total * 1000 < settings.PROFILE_SLOW_MS:
+        return None
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view.replace(':', '_')}-{total * 1000:.0f}ms-{os.getpid()}.prof"
+    try:
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(settings.PROFILE_DIR, name))
+        # Keep the newest PROFILE_KEEP dumps
+        dumps = [e for e in os.scandir(settings.PROFILE_DIR) if e.name.endswith('.prof')]
+        dumps.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in dumps[settings.PROFILE_KEEP:]:
+            os.remove(entry.path)
+    except OSError:
+        # Profiling must never fail the request it describes
+        logger.exception("Could not save profile %s", name)
+    return name
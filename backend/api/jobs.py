@@ -0,0 +1,153 @@
+"""
+Background ingestion jobs.
+
+The IngestJob table is the queue: the view creates a QUEUED row and hands its
+id to a local ProcessPoolExecutor (on SQLite the single writer process, see
+api/writer.py). Workers claim a job with a conditional
+UPDATE, so a job is never run twice even if it is also picked up by the
+`ingest_worker` management command (e.g. after the web process restarted).
+
+A job whose worker process dies is failed by the future's done callback. If
+the whole web process went with it, the job is left RUNNING with no progress;
+`ingest_worker` puts such jobs back in the queue after INGEST_JOB_TIMEOUT.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .columnar import discard_parts
+from .ingest import ingest_csv, upload_result, upload_stats
+from .retention import apply_retention
+from .models import Equipment, IngestJob
+from .parsing import CSVError
+from .workers import submit
+from .writer import submit_write, use_writer_queue
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_ingest(user, upload):
+    job = IngestJob.objects.create(user=user, upload=upload)
+    transaction.on_commit(lambda: start_job(job.id))
+    return job
+
+
+def start_job(job_id):
+    if use_writer_queue():
+        future = submit_write(run_job, job_id)
+    else:
+        future = submit('ingest', settings.INGEST_WORKERS, run_job, job_id)
+    caller = threading.get_ident()
+
+    def finished(future):
+        # run_job records its own failures; an exception here means the worker died (or the bookkeeping failed)
+        if future.cancelled() or future.exception() is None:
+            return
+        try:
+            abandon_job(job_id, future.exception())
+        finally:
+            if threading.get_ident() != caller:
+                connection.close()  # the pool's result thread, which no request cleans up after
+
+    future.add_done_callback(finished)
+    return future
+
+
+def abandon_job(job_id, error):
+    """Fail a job that did not finish, deleting its upload unless the ingest got to attach it to the user."""
+    logger.error("Ingest job %s did not finish: %r", job_id, error)
+    failed = IngestJob.objects.filter(id=job_id, state__in=[IngestJob.QUEUED, IngestJob.RUNNING]).update(
+        state=IngestJob.FAILED, error="Upload could not be processed, try again", updated_at=timezone.now()
+    )
+    if not failed:
+        return
+    upload = IngestJob.objects.select_related('upload').get(id=job_id).upload
+    if upload is not None and upload.user_id is None:
+        upload.file.delete(save=False)
+        upload.delete()
+
+
+def requeue_stale_jobs(timeout):
+    """
+    Put RUNNING jobs that reported no progress for `timeout` seconds back in
+    the queue, without the rows their first attempt wrote. Returns their ids.
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    requeued = []
+    for job in IngestJob.objects.filter(state=IngestJob.RUNNING, updated_at__lt=cutoff).select_related('upload'):
+        with transaction.atomic():
+            # Conditional, like claim_job(), in case the worker reported in meanwhile
+            if not IngestJob.objects.filter(id=job.id, state=IngestJob.RUNNING, updated_at__lt=cutoff).update(
+                    state=IngestJob.QUEUED, rows_processed=0, updated_at=timezone.now()):
+                continue
+            if job.upload is None:
+                update_job(job.id, state=IngestJob.FAILED, error="Upload no longer exists")
+                continue
+            Equipment.objects.filter(upload=job.upload).delete()
+        discard_parts(job.upload)
+        requeued.append(job.id)
+    return requeued
+
+
+def finished_job(user, upload):
+    # Nothing left to do (e.g. a deduplicated upload): record the job as already DONE
+    return IngestJob.objects.create(
+        user=user,
+        upload=upload,
+        state=IngestJob.DONE,
+        rows_processed=upload.total_count,
+        result=upload_result(upload, upload_stats(upload), upload.summary.distribution)
+    )
+
+
+def update_job(job_id, **fields):
+    # QuerySet.update() skips auto_now, so bump updated_at by hand
+    return IngestJob.objects.filter(id=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def claim_job(job_id):
+    claimed = IngestJob.objects.filter(id=job_id, state=IngestJob.QUEUED).update(
+        state=IngestJob.RUNNING, updated_at=timezone.now()
+    )
+    return claimed == 1
+
+
+def run_job(job_id):
+    if not claim_job(job_id):
+        return
+    job = IngestJob.objects.select_related('upload').get(id=job_id)
+    upload = job.upload
+
+    def report(rows):
+        update_job(job_id, rows_processed=rows)
+
+    try:
+        stats, type_distribution = ingest_csv(upload, atomic=False, progress=report)
+    except Exception as e:
+        logger.exception("Ingest job %s failed", job_id)
+        upload.file.delete(save=False)
+        upload.delete()
+        if isinstance(e, OperationalError):
+            update_job(job_id, state=IngestJob.FAILED, error="Database busy, upload the file again")
+        elif isinstance(e, CSVError):
+            # The row error report goes where a finished job keeps its result
+            update_job(job_id, state=IngestJob.FAILED, error=e.message, result={"row_errors": e.report})
+        else:
+            update_job(job_id, state=IngestJob.FAILED, error="Invalid CSV file")
+        return
+
+    # Attach the finished upload to its owner, then apply the history limit
+    upload.user = job.user
+    upload.save(update_fields=['user'])
+    apply_retention(job.user)
+
+    update_job(
+        job_id,
+        state=IngestJob.DONE,
+        rows_processed=stats["total_count"],
+        result=upload_result(upload, stats, type_distribution)
+    )
@@ -0,0 +1,136 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from api.benchmark import RESULTS_VERSION, Benchmark, compare, metadata_differences, parse_count, run_metadata
+from api.workers import shutdown_pools
+from api.writer import use_writer_queue
+
+DEFAULT_ROWS = '1k,10k,100k,1m'
+
+
+class Command(BaseCommand):
+    help = ("Benchmark upload, history and PDF requests on generated CSVs in a throwaway database, "
+            "write the results as JSON and optionally compare them with an earlier run")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default=DEFAULT_ROWS,
+                            help=f"Comma-separated dataset sizes, k/m suffixes allowed (default {DEFAULT_ROWS}, up to e.g. 10m)")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per size; medians are kept")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated CSVs")
+        parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'chemvis-benchmark'),
+                            help="Where generated CSVs are kept and reused between runs")
+        parser.add_argument('--pdf-max-rows', type=parse_count, default=100000,
+                            help="Skip the PDF stages above this many rows (0 skips them)")
+        parser.add_argument('--clients', type=int, default=0,
+                            help="Also upload each size from this many parallel clients and report latencies")
+        parser.add_argument('--rounds', type=int, default=3, help="Uploads per parallel client")
+        parser.add_argument('-o', '--output', help="Results file (default benchmark-<timestamp>.json)")
+        parser.add_argument('--compare', nargs='+', metavar='RESULTS',
+                            help="BASELINE to compare this run with, or BASELINE CURRENT to compare two "
+                                 "result files without running anything")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative increase in wall time or memory flagged as a regression")
+
+    def handle(self, *args, **options):
+        compare_with = options['compare'] or []
+        if len(compare_with) > 2:
+            raise CommandError("--compare takes a baseline and at most one other results file")
+        if len(compare_with) == 2:
+            return self.report(load(compare_with[0]), load(compare_with[1]), options['threshold'])
+        baseline = load(compare_with[0]) if compare_with else None
+
+        sizes = [parse_count(n) for n in options['rows'].split(',') if n.strip()]
+        # Worker processes started other than by fork would set Django up against the real
+        # database and MEDIA_ROOT instead of this run's
+        overrides = {}
+        if multiprocessing.get_start_method() != 'fork':
+            if options['pdf_max_rows']:
+                raise CommandError("The PDF stages need the 'fork' start method; pass --pdf-max-rows 0")
+            if use_writer_queue():
+                self.stderr.write("No 'fork' start method: ingest runs in this process, "
+                                  "without the SQLite writer queue")
+                overrides['SQLITE_WRITER_QUEUE'] = False
+        current = self.run(sizes, options, overrides)
+
+        output = options['output'] or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(output, 'w') as f:
+            json.dump(current, f, indent=1)
+        self.stdout.write(f"Wrote {output}")
+
+        if baseline:
+            self.report(baseline, current, options['threshold'])
+
+    def run(self, sizes, options, overrides=None):
+        # Test database (a file for SQLite, so report workers see it), media and report cache of our own
+        scratch = tempfile.mkdtemp(prefix='chemvis-benchmark-')
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'db.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(DEBUG=False, MEDIA_ROOT=os.path.join(scratch, 'media'),
+                                   REPORT_CACHE_DIR=os.path.join(scratch, 'report_cache'),
+                                   **(overrides or {})):
+                user = User.objects.create_user('benchmark', password='benchmark')
+                benchmark = Benchmark(user, options['data_dir'], seed=options['seed'], repeat=options['repeat'],
+                                      pdf_max_rows=options['pdf_max_rows'], clients=options['clients'],
+                                      rounds=options['rounds'], log=self.log)
+                self.stdout.write(f"{'rows':>10} {'stage':12} {'status':>6} {'seconds':>9} {'rows/s':>11} "
+                                  f"{'queries':>8} {'peak MB':>8} {'+MB':>7}")
+                results = benchmark.run(sizes)
+                shutdown_pools()
+                return {"version": RESULTS_VERSION, "meta": run_metadata(benchmark), "results": results}
+        finally:
+            shutdown_pools()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def log(self, r):
+        rate = f"{r['rows_per_s']:,}" if r['rows_per_s'] is not None else '-'
+        queries = r['queries'] if r['queries'] is not None else '-'
+        line = (f"{r['rows']:>10,} {r['stage']:12} {r['status']:>6} {r['wall_s']:>9.3f} {rate:>11} "
+                f"{queries:>8} {r['peak_rss_mb']:>8.1f} {r['rss_growth_mb']:>7.1f}")
+        if 'clients' in r:
+            # Parallel clients: wall time is the median latency
+            line += f"  p95 {r['p95_s']:.3f}  max {r['max_s']:.3f}  errors {r['errors']}/{r['requests']}"
+        self.stdout.write(line)
+
+    def report(self, baseline, current, threshold):
+        for note in metadata_differences(baseline, current):
+            self.stdout.write(self.style.WARNING(f"Setup differs, {note}"))
+        changes = compare(baseline, current, threshold)
+        if not changes:
+            raise CommandError("The two runs have no (rows, stage) in common")
+        self.stdout.write(f"{'rows':>10} {'stage':12} {'metric':14} {'baseline':>10} {'current':>10} {'change':>8}")
+        regressions = 0
+        for rows, stage, metric, old, new, regressed in changes:
+            change = f"{(new - old) / old:+.0%}" if old else '-'
+            line = f"{rows:>10,} {stage:12} {metric:14} {old:>10g} {new:>10g} {change:>8}"
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(f"{line}  REGRESSION")
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"{regressions} regression(s) beyond {threshold:.0%}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
+
+
+def load(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CommandError(f"Can't read {path}: {e}")
+    if data.get('version') != RESULTS_VERSION:
+        raise CommandError(f"{path} is not a version {RESULTS_VERSION} results file")
+    return data
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.retention import apply_retention, delete_orphaned_files, delete_stale_reports
+
+
+class Command(BaseCommand):
+    help = "Apply the history retention policy to all users, remove orphaned files and compact the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Only remove orphaned files older than this many seconds")
+        parser.add_argument('--no-vacuum', action='store_true', help="Skip VACUUM on SQLite")
+
+    def handle(self, *args, **options):
+        deleted = apply_retention()
+        self.stdout.write(f"Deleted {deleted} expired uploads")
+
+        removed = delete_orphaned_files(min_age=options['min_age'])
+        self.stdout.write(f"Removed {len(removed)} orphaned files from MEDIA_ROOT/uploads")
+
+        reports = delete_stale_reports()
+        self.stdout.write(f"Removed {len(reports)} stale cached reports")
+
+        if connection.vendor == 'sqlite' and not options['no_vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write("Vacuumed SQLite database")
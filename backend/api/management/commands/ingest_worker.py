@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.jobs import requeue_stale_jobs, run_job
+from api.models import IngestJob
+
+
+class Command(BaseCommand):
+    help = "Run queued ingest jobs from the database (e.g. ones left behind by a restarted web process)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit instead of polling")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls")
+        parser.add_argument('--stale-after', type=float, default=settings.INGEST_JOB_TIMEOUT,
+                            help="Seconds without progress after which a running job is queued again")
+
+    def handle(self, *args, **options):
+        while True:
+            # Jobs whose worker died with its web process
+            for job_id in requeue_stale_jobs(options['stale_after']):
+                self.stdout.write(f"Requeued job {job_id}")
+            job_ids = list(
+                IngestJob.objects.filter(state=IngestJob.QUEUED).order_by('created_at').values_list('id', flat=True)
+            )
+            for job_id in job_ids:
+                run_job(job_id)
+                self.stdout.write(f"Processed job {job_id}")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
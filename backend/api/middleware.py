@@ -0,0 +1,97 @@
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+from .instrumentation import add_stage, record, request_timings, save_profile, stage, start_profiler
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+re_accepts_brotli = re.compile(r"\bbr\b")
+
+
+def is_compressible(content_type):
+    content_type = content_type.split(';')[0].strip()
+    return content_type.startswith('text/') or content_type in settings.COMPRESS_CONTENT_TYPES \
+        or content_type.endswith('+json')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware limited to JSON/text responses of COMPRESS_MIN_SIZE bytes
+    or more, using brotli instead when it is installed and accepted.
+
+    PDFs and other already-compressed downloads pass through untouched.
+    """
+
+    def process_response(self, request, response):
+        with stage('compress'):
+            return self.compress(request, response)
+
+    def compress(self, request, response):
+        if not is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESS_MIN_SIZE:
+            return response
+        ae = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is None or response.streaming or response.has_header('Content-Encoding') \
+                or not re_accepts_brotli.search(ae):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Same ETag weakening as GZipMiddleware
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class TimingMiddleware:
+    """
+    Server-Timing header, latency histograms (see api.instrumentation) and
+    sampled profiles for every request. First in MIDDLEWARE, so the total
+    includes the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        profiler = start_profiler()
+        try:
+            with request_timings() as timings, connection.execute_wrapper(timings.execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            if profiler:
+                profiler.disable()
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        header = timings.server_timing(total)
+        if profiler:
+            name = save_profile(profiler, view, total)
+            if name:
+                header += f', profile;desc="{name}"'
+        response['Server-Timing'] = header
+        record(view, request.method, response.status_code, total, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that as its own stage
+        started = time.perf_counter()
+        response.add_post_render_callback(lambda r: add_stage('render', time.perf_counter() - started))
+        return response
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_equipment_upload_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSummary',
+            fields=[
+                ('upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='api.fileupload')),
+                ('distribution', models.JSONField(default=dict)),
+                ('stats', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_equipment_analytics_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='columnar_path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_fileupload_dedupe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsummary',
+            name='moments',
+            field=models.JSONField(default=list),
+        ),
+    ]
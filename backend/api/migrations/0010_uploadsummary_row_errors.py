@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_uploadsummary_moments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsummary',
+            name='row_errors',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_uploadsummary_row_errors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipment',
+            name='anomaly',
+            field=models.PositiveSmallIntegerField(db_default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadsummary',
+            name='anomalies',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(condition=models.Q(('anomaly__gt', 0)), fields=['upload', 'id'], name='equipment_anomaly_idx'),
+        ),
+    ]
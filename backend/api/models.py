@@ -9,10 +9,48 @@ class FileUpload(models.Model):
     avg_flowrate = models.FloatField(default=0.0)
     avg_pressure = models.FloatField(default=0.0)
     avg_temperature = models.FloatField(default=0.0)
+    # Parquet dataset dir under MEDIA_ROOT when stored columnar; empty -> rows are in Equipment
+    columnar_path = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the CSV
+    # Re-uploads of identical content share the file and rows of their source upload; deleting a
+    # source hands its rows to a copy first (api.signals), so the database never sees a dangling source
+    source = models.ForeignKey('self', on_delete=models.DO_NOTHING, null=True, blank=True, related_name='copies')
+    # Name of the file as uploaded; copies share their source's stored file
+    filename = models.CharField(max_length=255, blank=True)
 
     def __str__(self):
         return f"Upload {self.id} - {self.uploaded_at}"
 
+    @property
+    def data_id(self):
+        # Id the Equipment rows are stored under
+        return self.source_id or self.id
+
+class UploadSummary(models.Model):
+    # Computed once at ingest so history/report views never rescan Equipment
+    upload = models.OneToOneField(FileUpload, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    distribution = models.JSONField(default=dict)  # {type: count}
+    # {"overall": {column: {count, mean, std, min, max, p25, p50, p75}}, "by_type": {type: {column: {...}}}}
+    stats = models.JSONField(default=dict)
+    # [{type, column, n, mean, m2, min, max}]: running moments, so appended rows merge in exactly
+    moments = models.JSONField(default=list)
+    # {"rejected_rows", "errors": [{line, column, reason}], "truncated"}: CSV rows left out at ingest
+    row_errors = models.JSONField(default=dict)
+    # {"threshold", "count", "by_type": {type: {column: {median, mad, low, high}}}}: see api.anomalies
+    anomalies = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"Summary of upload {self.upload_id}"
+
+# CSV header -> Equipment field
+CSV_COLUMNS = {
+    'Equipment Name': 'name',
+    'Type': 'eq_type',
+    'Flowrate': 'flowrate',
+    'Pressure': 'pressure',
+    'Temperature': 'temperature',
+}
+
 class Equipment(models.Model):
     upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='equipment')
     name = models.CharField(max_length=100)
@@ -20,3 +58,42 @@ class Equipment(models.Model):
     flowrate = models.FloatField()
     pressure = models.FloatField()
     temperature = models.FloatField()
+    # Bitmask of the measurements outside their type's robust bounds (api.anomalies.FLAG_BITS);
+    # a database default, since the bulk INSERT/COPY in api.ingest leave the column out
+    anomaly = models.PositiveSmallIntegerField(db_default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination: WHERE upload_id = ? AND id > ? ORDER BY id
+            models.Index(fields=['upload', 'id'], name='equipment_upload_id_idx'),
+            # /api/analytics/: GROUP BY upload_id, eq_type and lookups by equipment name
+            models.Index(fields=['upload', 'eq_type'], name='equipment_upload_type_idx'),
+            models.Index(fields=['name'], name='equipment_name_idx'),
+            # /api/uploads/<id>/anomalies/: only flagged rows are indexed, so it stays small
+            models.Index(fields=['upload', 'id'], name='equipment_anomaly_idx', condition=models.Q(anomaly__gt=0)),
+        ]
+
+class IngestJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The FileUpload stays detached from the user (user=None) until the job is DONE
+    upload = models.ForeignKey(FileUpload, on_delete=models.SET_NULL, null=True, blank=True)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=QUEUED)
+    rows_processed = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Job {self.id} - {self.state}"
@@ -0,0 +1,73 @@
+from django.conf import settings
+
+from .anomalies import columnar_anomaly_page, flag_array
+from .columnar import read_page
+from .models import CSV_COLUMNS, Equipment
+
+# (Equipment field, CSV header) used in API rows
+ROW_FIELDS = [(field, header) for header, field in CSV_COLUMNS.items()]
+
+
+def equipment_page(upload, cursor=None, limit=None, columns=False):
+    """
+    One keyset page of an upload's Equipment rows, ordered by primary key.
+
+    `cursor` is the id of the last row already seen. The (upload_id, id) index
+    makes every page an index range scan, so deep pages cost the same as the
+    first one. Returns (rows, next_cursor, flags); next_cursor is None on the
+    last page and flags is each row's anomaly bitmask (see api.anomalies).
+    Columnar uploads page by row number instead.
+
+    Rows are a list of {header: value} records, or with columns=True one
+    {header: [values]} mapping, which skips building a dict per row.
+    """
+    limit = min(limit or settings.EQUIPMENT_PAGE_SIZE, settings.EQUIPMENT_PAGE_MAX)
+    if upload.columnar_path:
+        found, next_cursor = read_page(upload, cursor=cursor, limit=limit)
+        values = [found[field] for field, _ in ROW_FIELDS]
+        flags = flag_array(found['eq_type'], found, anomaly_bounds(upload)).tolist()
+    else:
+        qs = Equipment.objects.filter(upload_id=upload.data_id)
+        if cursor is not None:
+            qs = qs.filter(id__gt=cursor)
+        values, flags, next_cursor = keyset_page(qs, limit)
+    return shape(values, columns), next_cursor, flags
+
+
+def anomaly_page(upload, cursor=None, limit=None, columns=False):
+    """
+    Like equipment_page(), for the rows with at least one anomaly flag. The
+    partial index on (upload_id, id) WHERE anomaly > 0 holds only those rows.
+    """
+    limit = min(limit or settings.EQUIPMENT_PAGE_SIZE, settings.EQUIPMENT_PAGE_MAX)
+    if upload.columnar_path:
+        found, next_cursor, flags = columnar_anomaly_page(upload, anomaly_bounds(upload), cursor=cursor, limit=limit)
+        values = [found[field] for field, _ in ROW_FIELDS]
+    else:
+        qs = Equipment.objects.filter(upload_id=upload.data_id, anomaly__gt=0)
+        if cursor is not None:
+            qs = qs.filter(id__gt=cursor)
+        values, flags, next_cursor = keyset_page(qs, limit)
+    return shape(values, columns), next_cursor, flags
+
+
+def anomaly_bounds(upload):
+    summary = getattr(upload, 'summary', None)
+    return summary.anomalies.get('by_type', {}) if summary else {}
+
+
+def keyset_page(qs, limit):
+    fields = [f for f, _ in ROW_FIELDS]
+    # Fetch one extra row to know whether another page exists
+    found = list(qs.order_by('id').values_list('id', 'anomaly', *fields)[:limit + 1])
+    next_cursor = found[limit - 1][0] if len(found) > limit else None
+    # Transpose to one list per field; empty pages still get every column
+    values = [list(col) for col in zip(*found[:limit])] or [[] for _ in range(len(fields) + 2)]
+    return values[2:], values[1], next_cursor
+
+
+def shape(values, columns):
+    headers = [header for _, header in ROW_FIELDS]
+    if columns:
+        return dict(zip(headers, values))
+    return [dict(zip(headers, row)) for row in zip(*values)]
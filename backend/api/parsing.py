@@ -0,0 +1,208 @@
+"""
+Typed CSV parsing for uploads.
+
+The schema is declared up front instead of inferred from the data: only the
+CSV_COLUMNS are read, Equipment Name as text, Type as a categorical and the
+measurements as float64. With pyarrow installed (CSV_ENGINE = 'pyarrow') the
+file goes through Arrow's streaming CSV reader, which parses each
+CSV_BLOCK_SIZE block on several threads; otherwise pandas' C parser reads
+CSV_CHUNK_SIZE rows at a time.
+
+check_header() validates the header from the first block alone, so a file
+with missing columns is turned away before anything is stored or parsed.
+Rows that don't fit the schema (a blank name or type, a measurement that is
+missing, not a number or infinite, the wrong number of fields; pandas' C
+parser drops extra fields instead) are left out of the chunks and recorded in
+a RowErrors report rather than failing the file.
+Line numbers count the header as line 1 and one line per row.
+"""
+import bisect
+import csv
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .models import CSV_COLUMNS
+from .stats import NUMERIC_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # pandas' C parser is used instead
+    pa = pc = pa_csv = None
+
+TEXT_COLUMNS = ['Equipment Name', 'Type']
+HEADER_BLOCK_SIZE = 64 * 1024
+PARSE_ERRORS = (pd.errors.ParserError, UnicodeDecodeError) + ((pa.ArrowInvalid,) if pa else ())
+
+
+class CSVError(ValueError):
+    """A file that can't be ingested; `report` is its RowErrors.as_dict() when rows were the problem."""
+
+    def __init__(self, message, report=None):
+        super().__init__(message, report)  # both in args, so it pickles across worker processes
+        self.message = message
+        self.report = report
+
+    def __str__(self):
+        return self.message
+
+
+def check_header(file_obj):
+    """Validate the header line, reading only the first block of the file; raises CSVError."""
+    file_obj.seek(0)
+    block = file_obj.read(HEADER_BLOCK_SIZE)
+    file_obj.seek(0)
+    if isinstance(block, str):
+        block = block.encode()
+    line, newline, _ = block.partition(b'\n')
+    if not newline and len(block) == HEADER_BLOCK_SIZE:
+        raise CSVError("Header line is too long")
+    try:
+        text = line.decode('utf-8-sig').rstrip('\r')
+    except UnicodeDecodeError:
+        raise CSVError("File is not UTF-8 text")
+    header = next(csv.reader([text]), [])
+    if not any(header):
+        raise CSVError("Empty file")
+    missing = [col for col in CSV_COLUMNS if col not in header]
+    if missing:
+        raise CSVError(f"Missing columns: {', '.join(missing)}")
+    duplicated = [col for col in CSV_COLUMNS if header.count(col) > 1]
+    if duplicated:
+        raise CSVError(f"Duplicate columns: {', '.join(duplicated)}")
+    return header
+
+
+class RowErrors:
+    """Rows left out of one file: all are counted, the first CSV_MAX_ROW_ERRORS problems listed."""
+
+    def __init__(self):
+        self.limit = settings.CSV_MAX_ROW_ERRORS
+        self.rows = 0
+        self.problems = 0
+        self.errors = []
+        self.skipped_lines = []  # sorted; lines the parser dropped, which shift the ones after them
+
+    def add(self, line, column, reason):
+        self.problems += 1
+        if len(self.errors) < self.limit:
+            self.errors.append({"line": line, "column": column, "reason": reason})
+
+    def skip(self, line, reason):
+        # A line the parser couldn't split into the header's fields
+        self.rows += 1
+        if line is not None:
+            bisect.insort(self.skipped_lines, line)
+        self.add(line, None, reason)
+
+    def line(self, row):
+        """File line of the parser's `row`th row (0-based)."""
+        line = row + 2
+        while True:
+            shifted = row + 2 + bisect.bisect_right(self.skipped_lines, line)
+            if shifted == line:
+                return line
+            line = shifted
+
+    def as_dict(self):
+        order = {col: i for i, col in enumerate(CSV_COLUMNS)}
+        return {
+            "rejected_rows": self.rows,
+            "errors": sorted(self.errors, key=lambda e: (e['line'] or 0, order.get(e['column'], -1))),
+            "truncated": self.problems > len(self.errors),
+        }
+
+
+def validate(frame, first_row, errors):
+    """`frame` without the rows that don't fit the schema, recording why; measurements end up float64."""
+    bad = np.zeros(len(frame), dtype=bool)
+
+    def report(mask, column, reasons):
+        nonlocal bad
+        bad |= mask
+        positions = np.flatnonzero(mask)
+        listed = positions[:max(errors.limit - len(errors.errors), 0)]
+        errors.problems += len(positions) - len(listed)
+        for i in listed:
+            errors.add(errors.line(first_row + int(i)), column, reasons(i))
+
+    for col in TEXT_COLUMNS:
+        report(frame[col].isna().to_numpy(), col, lambda i: "missing value")
+    for col in NUMERIC_COLUMNS:
+        values = frame[col]
+        invalid = np.zeros(len(frame), dtype=bool)
+        if values.dtype != np.float64:
+            # Text left over because a value didn't parse as a number
+            numbers = pd.to_numeric(values, errors='coerce').astype(np.float64)
+            invalid = (numbers.isna() & values.notna()).to_numpy()
+            text = values.to_numpy()
+            report(invalid, col, lambda i: f"not a number: {str(text[i])[:40]!r}")
+            frame[col] = values = numbers
+        missing = values.isna().to_numpy()
+        report(missing & ~invalid, col, lambda i: "missing value")
+        # inf, -inf or out of float range (1e400): the stats can't hold it, nor can the JSON they are saved as
+        numbers = values.to_numpy()
+        report(~missing & ~np.isfinite(numbers), col, lambda i: f"not a finite number: {numbers[i]}")
+
+    rejected = int(bad.sum())
+    if rejected:
+        errors.rows += rejected
+        frame = frame[~bad].copy()
+        frame['Type'] = frame['Type'].cat.remove_unused_categories()
+    return frame
+
+
+def arrow_chunks(file_obj, errors):
+    def skip(row):
+        errors.skip(row.number, f"expected {row.expected_columns} fields, found {row.actual_columns}")
+        return 'skip'
+
+    types = {'Equipment Name': pa.string(), 'Type': pa.dictionary(pa.int32(), pa.string())}
+    # Measurements are read as text and cast per block, since one bad value would fail a whole float64 block
+    types.update((col, pa.string()) for col in NUMERIC_COLUMNS)
+    reader = pa_csv.open_csv(
+        file_obj,
+        read_options=pa_csv.ReadOptions(block_size=settings.CSV_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip),
+        convert_options=pa_csv.ConvertOptions(column_types=types, include_columns=list(CSV_COLUMNS),
+                                              strings_can_be_null=True),
+    )
+    for batch in reader:
+        columns = {}
+        for name in batch.schema.names:
+            array = batch.column(name)
+            if name in NUMERIC_COLUMNS:
+                try:
+                    array = pc.cast(array, pa.float64())
+                except pa.ArrowInvalid:
+                    pass  # validate() finds the bad values
+            columns[name] = array
+        yield pa.RecordBatch.from_pydict(columns).to_pandas()
+
+
+def pandas_chunks(file_obj, chunksize):
+    # The C parser converts measurements itself; a column holding a bad value comes back as text
+    return pd.read_csv(file_obj, chunksize=chunksize, usecols=list(CSV_COLUMNS),
+                       dtype={'Equipment Name': str, 'Type': 'category'})
+
+
+def iter_csv_chunks(file_obj, errors, chunksize=None):
+    """Yield the valid rows of a CSV as typed DataFrames, adding the others to `errors` (a RowErrors)."""
+    check_header(file_obj)
+    if pa is not None and settings.CSV_ENGINE == 'pyarrow':
+        chunks = arrow_chunks(file_obj, errors)
+    else:
+        chunks = pandas_chunks(file_obj, chunksize or settings.CSV_CHUNK_SIZE)
+    first_row = 0
+    try:
+        for frame in chunks:
+            parsed = len(frame)
+            frame = validate(frame, first_row, errors)
+            first_row += parsed
+            if len(frame):
+                yield frame
+    except PARSE_ERRORS as e:
+        raise CSVError(f"Unreadable CSV: {e}")
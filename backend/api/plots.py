@@ -0,0 +1,162 @@
+"""
+Chart data for one upload, sized for plotting rather than for the row count.
+
+Small uploads send their (flowrate, pressure, type) points as they are.
+Larger ones send a PLOT_BINS x PLOT_BINS grid of counts instead, so a
+million-row upload costs the client a few kilobytes and one image to draw.
+Temperature histograms per type come with either form.
+
+Bin edges span the min/max kept in UploadSummary.stats, and the counting is
+a GROUP BY on the bin number in the database (numpy over the Parquet parts
+for columnar uploads); the rows themselves never reach Python.
+"""
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import Floor
+
+from .columnar import iter_batches, read_table
+from .models import Equipment
+
+
+def bin_edges(lo, hi, bins):
+    if lo is None or hi is None:
+        return None
+    if lo == hi:
+        lo, hi = lo - 0.5, hi + 0.5
+    return np.linspace(lo, hi, bins + 1)
+
+
+def value_ranges(upload, fields):
+    summary = getattr(upload, 'summary', None)
+    overall = summary.stats.get('overall', {}) if summary else {}
+    ranges = {f: (overall[f]['min'], overall[f]['max']) for f in fields if f in overall}
+    missing = [f for f in fields if f not in ranges]
+    if missing and not upload.columnar_path:
+        # Uploads from before UploadSummary: one aggregate query instead
+        aggs = {}
+        for f in missing:
+            aggs[f'{f}_min'], aggs[f'{f}_max'] = Min(f), Max(f)
+        found = Equipment.objects.filter(upload_id=upload.data_id).aggregate(**aggs)
+        ranges.update({f: (found[f'{f}_min'], found[f'{f}_max']) for f in missing})
+    return {f: ranges.get(f, (None, None)) for f in fields}
+
+
+class BinNumber(Floor):
+    """
+    floor((field - lo) / width). Values are never below lo, so on SQLite a
+    CAST (truncation) gives the same bins and skips Django's Python FLOOR().
+    """
+    def __init__(self, field, edges):
+        width = float(edges[1] - edges[0])
+        super().__init__((F(field) - float(edges[0])) / width)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(%(expressions)s AS INTEGER)', **extra_context)
+
+
+def clamp(index, bins):
+    # The maximum lands on the upper edge of the last bin
+    return min(max(int(index), 0), bins - 1)
+
+
+def density_sql(qs, x_edges, y_edges, bins):
+    counts = np.zeros((bins, bins), dtype=np.int64)
+    grouped = (qs.filter(flowrate__isnull=False, pressure__isnull=False)
+               .values(x=BinNumber('flowrate', x_edges), y=BinNumber('pressure', y_edges))
+               .annotate(n=Count('id')).order_by())
+    for row in grouped:
+        counts[clamp(row['x'], bins), clamp(row['y'], bins)] += row['n']
+    return counts
+
+
+def temperature_sql(qs, edges, bins):
+    counts = {}
+    grouped = (qs.filter(temperature__isnull=False)
+               .values('eq_type', t=BinNumber('temperature', edges))
+               .annotate(n=Count('id')).order_by())
+    for row in grouped:
+        hist = counts.setdefault(row['eq_type'], np.zeros(bins, dtype=np.int64))
+        hist[clamp(row['t'], bins)] += row['n']
+    return counts
+
+
+def bin_numbers(values, edges, bins):
+    # The arithmetic of BinNumber + clamp(), so both storage kinds bin edge values alike
+    width = float(edges[1] - edges[0])
+    return np.clip(np.floor((values - float(edges[0])) / width), 0, bins - 1).astype(np.int64)
+
+
+def binned_columnar(upload, x_edges, y_edges, t_edges, bins):
+    """Same counts as the SQL path, one pass over the Parquet parts."""
+    density = np.zeros(bins * bins, dtype=np.int64)
+    temperature = {}
+    for batch in iter_batches(upload, ['eq_type', 'flowrate', 'pressure', 'temperature']):
+        columns = {name: batch.column(name) for name in batch.schema.names}
+        if x_edges is not None and y_edges is not None:
+            x = columns['flowrate'].to_numpy(zero_copy_only=False)
+            y = columns['pressure'].to_numpy(zero_copy_only=False)
+            ok = ~(np.isnan(x) | np.isnan(y))
+            cells = bin_numbers(x[ok], x_edges, bins) * bins + bin_numbers(y[ok], y_edges, bins)
+            density += np.bincount(cells, minlength=bins * bins)
+        if t_edges is not None:
+            t = columns['temperature'].to_numpy(zero_copy_only=False)
+            types = np.asarray(columns['eq_type'].to_pylist(), dtype=object)
+            ok = ~np.isnan(t)
+            numbers = bin_numbers(t[ok], t_edges, bins)
+            types = types[ok]
+            for eq_type in set(types):
+                hist = temperature.setdefault(eq_type, np.zeros(bins, dtype=np.int64))
+                hist += np.bincount(numbers[types == eq_type], minlength=bins)
+    return density.reshape(bins, bins), temperature
+
+
+def scatter_points(upload):
+    if upload.columnar_path:
+        table = read_table(upload, ['flowrate', 'pressure', 'eq_type']).to_pydict()
+        rows = zip(table['flowrate'], table['pressure'], table['eq_type'])
+    else:
+        rows = (Equipment.objects.filter(upload_id=upload.data_id)
+                .order_by('id').values_list('flowrate', 'pressure', 'eq_type'))
+    rows = [r for r in rows if r[0] is not None and r[1] is not None]
+    flowrate, pressure, types = (list(col) for col in zip(*rows)) if rows else ([], [], [])
+    return {"flowrate": flowrate, "pressure": pressure, "type": types}
+
+
+def plot_data(upload, bins=None):
+    """
+    {"total_count", "points", "density", "temperature"} for an upload:
+
+    - points: {"flowrate": [...], "pressure": [...], "type": [...]} when the
+      upload has at most PLOT_MAX_POINTS rows, else None
+    - density: {"flowrate": edges, "pressure": edges, "counts": [[...]]},
+      counts[i][j] being the rows in flowrate bin i and pressure bin j;
+      None when points are sent
+    - temperature: {"edges": [...], "counts": {type: [...]}}
+    """
+    bins = bins or settings.PLOT_BINS
+    ranges = value_ranges(upload, ['flowrate', 'pressure', 'temperature'])
+    x_edges, y_edges, t_edges = (bin_edges(*ranges[f], bins) for f in ('flowrate', 'pressure', 'temperature'))
+    small = upload.total_count <= settings.PLOT_MAX_POINTS
+
+    if upload.columnar_path:
+        density, temperature = binned_columnar(upload, None if small else x_edges, y_edges, t_edges, bins)
+    else:
+        qs = Equipment.objects.filter(upload_id=upload.data_id)
+        density = None if small or x_edges is None or y_edges is None else density_sql(qs, x_edges, y_edges, bins)
+        temperature = {} if t_edges is None else temperature_sql(qs, t_edges, bins)
+
+    data = {"total_count": upload.total_count, "points": None, "density": None}
+    if small:
+        data["points"] = scatter_points(upload)
+    elif x_edges is not None and y_edges is not None:
+        data["density"] = {
+            "flowrate": x_edges.tolist(),
+            "pressure": y_edges.tolist(),
+            "counts": density.tolist(),
+        }
+    data["temperature"] = {
+        "edges": t_edges.tolist() if t_edges is not None else [],
+        "counts": {str(k): v.tolist() for k, v in sorted(temperature.items())},
+    }
+    return data
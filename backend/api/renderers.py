@@ -0,0 +1,87 @@
+"""
+Compact alternatives to JSON for responses that carry equipment rows.
+
+Chosen with the `Accept` header (or `?format=`):
+
+- application/vnd.equipment.columns+json   JSON, rows as one array per column
+- application/msgpack                      MessagePack, rows as columns
+- application/vnd.apache.arrow.stream      Arrow IPC stream of the rows; the
+                                           other fields go in the schema
+                                           metadata under b"meta" as JSON
+
+Plain application/json keeps the list of row objects. Renderers with
+`columnar = True` tell the view to build the rows column by column.
+"""
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is offered only when installed
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # same for Arrow
+    pa = None
+
+# Response keys that hold the rows
+ROW_KEYS = ('data', 'results')
+
+
+def wants_columns(request):
+    return getattr(request.accepted_renderer, 'columnar', False)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.equipment.columns+json'
+    format = 'columns'
+    columnar = True
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        data = dict(data)
+        rows = {}
+        for key in ROW_KEYS:
+            if isinstance(data.get(key), dict):
+                rows = data.pop(key)
+                break
+        # Errors and row-less responses come through as an empty table
+        table = pa.table(rows).replace_schema_metadata({'meta': json.dumps(data)})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def row_renderers():
+    renderers = list(api_settings.DEFAULT_RENDERER_CLASSES) + [ColumnarJSONRenderer]
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    if pa is not None:
+        renderers.append(ArrowStreamRenderer)
+    return renderers
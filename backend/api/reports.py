@@ -0,0 +1,240 @@
+"""
+PDF reports for an upload, rendered once and cached on disk.
+
+Cached files are keyed by upload id, REPORT_TEMPLATE_VERSION and the row
+count the report was rendered from (as report_etag() is); bump the version
+whenever the layout below changes so stale reports are not served. A render
+that overlaps an append writes the file of the old count, which the grown
+upload never reads.
+"""
+import glob
+import os
+import tempfile
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from .columnar import iter_rows_by_type
+from .models import Equipment, FileUpload
+from .workers import submit
+
+REPORT_TEMPLATE_VERSION = 3
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+MARGIN = 45
+ROW_HEIGHT = 14
+# (header, width, numeric)
+COLUMNS = [
+    ('Equipment Name', 190, False),
+    ('Type', 110, False),
+    ('Flowrate', 70, True),
+    ('Pressure', 70, True),
+    ('Temperature', 82, True),
+]
+# Per-type lines printed in the first-page summary
+SUMMARY_MAX_TYPES = 20
+
+
+def report_path(upload_id, rows, version=REPORT_TEMPLATE_VERSION):
+    return os.path.join(settings.REPORT_CACHE_DIR, f"report_{upload_id}_v{version}_{rows}.pdf")
+
+
+def report_etag(upload):
+    # Appends only ever add rows, so the row count tells report versions apart
+    return f'"report-{upload.id}-v{REPORT_TEMPLATE_VERSION}-{upload.total_count}"'
+
+
+def get_report(upload):
+    """
+    Path of the cached report for `upload`, rendering it on a cache miss. If
+    rows were appended meanwhile the render describes them, and its path is
+    returned instead.
+    """
+    path = report_path(upload.id, upload.total_count)
+    if not os.path.exists(path):
+        # Render in a worker process so a large report doesn't hold this one's CPU/GIL
+        path = submit('reports', settings.REPORT_WORKERS, render_report, upload.id).result(
+            timeout=settings.REPORT_RENDER_TIMEOUT)
+    return path
+
+
+def render_report(upload_id):
+    upload = FileUpload.objects.select_related('summary').get(id=upload_id)
+    path = report_path(upload_id, upload.total_count)
+    os.makedirs(settings.REPORT_CACHE_DIR, exist_ok=True)
+    # Render to a temp file and rename, so concurrent readers never see a partial PDF
+    fd, tmp_path = tempfile.mkstemp(dir=settings.REPORT_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            build_report(upload, out)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def evict_reports(upload_id):
+    # Every template version and row count of this upload's report
+    for path in glob.glob(os.path.join(settings.REPORT_CACHE_DIR, f"report_{upload_id}_v*.pdf")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ReportCanvas:
+    """
+    Draws the equipment table straight onto a canvas, one page at a time.
+
+    Only the current page is laid out in Python; finished pages are written
+    into the compressed PDF stream, so memory does not grow with row count
+    the way a single platypus Table does.
+    """
+
+    def __init__(self, out, upload):
+        self.canvas = canvas.Canvas(out, pagesize=letter, pageCompression=1)
+        self.canvas.setTitle(f"Chemical Equipment Report - Upload #{upload.id}")
+        self.upload = upload
+        self.page = 0
+        self.y = 0
+        self.new_page()
+
+    def new_page(self):
+        if self.page:
+            self.draw_footer()
+            self.canvas.showPage()
+        self.page += 1
+        self.y = PAGE_HEIGHT - MARGIN
+        if self.page == 1:
+            self.draw_summary()
+        else:
+            self.canvas.setFont('Helvetica-Oblique', 9)
+            self.canvas.drawString(MARGIN, self.y, f"Upload #{self.upload.id} (continued)")
+            self.y -= ROW_HEIGHT
+        self.row([h for h, _, _ in COLUMNS], font='Helvetica-Bold', fill=colors.grey, text=colors.whitesmoke)
+
+    def draw_summary(self):
+        upload = self.upload
+        c = self.canvas
+        c.setFont('Helvetica-Bold', 16)
+        c.drawCentredString(PAGE_WIDTH / 2, self.y - 10, f"Chemical Equipment Report - Upload #{upload.id}")
+        self.y -= 40
+        lines = [
+            f"Date: {upload.uploaded_at.strftime('%Y-%m-%d %I:%M %p')}",
+            f"Total Equipment: {upload.total_count}",
+            f"Average Flowrate: {upload.avg_flowrate:.2f}",
+            f"Average Pressure: {upload.avg_pressure:.2f}",
+            f"Average Temperature: {upload.avg_temperature:.2f}",
+        ]
+        c.setFont('Helvetica-Bold', 10)
+        c.drawString(MARGIN, self.y, "Summary Statistics:")
+        c.setFont('Helvetica', 10)
+        for line in lines:
+            self.y -= ROW_HEIGHT
+            c.drawString(MARGIN, self.y, line)
+        self.y -= 2 * ROW_HEIGHT
+        self.draw_type_stats()
+
+    def draw_type_stats(self):
+        # Per-type figures come from the UploadSummary computed at ingest
+        summary = getattr(self.upload, 'summary', None)
+        if summary is None or not summary.stats.get('by_type'):
+            return
+        c = self.canvas
+        c.setFont('Helvetica-Bold', 10)
+        c.drawString(MARGIN, self.y, "By Type (mean / std / min-max):")
+        c.setFont('Helvetica', 8)
+        by_type = sorted(summary.stats['by_type'].items())
+        for eq_type, columns in by_type[:SUMMARY_MAX_TYPES]:
+            self.y -= ROW_HEIGHT - 2
+            parts = [f"{eq_type}: {summary.distribution.get(eq_type, 0)} items"]
+            for key in ('flowrate', 'pressure', 'temperature'):
+                col = columns.get(key, {})
+                if col.get('count'):
+                    parts.append(
+                        f"{key} {col['mean']:.2f} / {col['std'] or 0:.2f} / {col['min']:.2f}-{col['max']:.2f}"
+                    )
+            c.drawString(MARGIN, self.y, "   ".join(parts))
+        if len(by_type) > SUMMARY_MAX_TYPES:
+            self.y -= ROW_HEIGHT - 2
+            c.drawString(MARGIN, self.y, f"... and {len(by_type) - SUMMARY_MAX_TYPES} more types")
+        self.y -= 2 * ROW_HEIGHT
+
+    def draw_footer(self):
+        self.canvas.setFont('Helvetica', 8)
+        self.canvas.drawRightString(PAGE_WIDTH - MARGIN, MARGIN / 2, f"Page {self.page}")
+
+    def row(self, values, font='Helvetica', fill=None, text=colors.black):
+        if self.y - ROW_HEIGHT < MARGIN:
+            self.new_page()
+        c = self.canvas
+        top = self.y
+        bottom = top - ROW_HEIGHT
+        if fill is not None:
+            c.setFillColor(fill)
+            c.rect(MARGIN, bottom, sum(w for _, w, _ in COLUMNS), ROW_HEIGHT, stroke=0, fill=1)
+        c.setFillColor(text)
+        c.setFont(font, 8)
+        x = MARGIN
+        for value, (_, width, numeric) in zip(values, COLUMNS):
+            if numeric:
+                c.drawRightString(x + width - 3, bottom + 4, value)
+            else:
+                c.drawString(x + 3, bottom + 4, value[:int(width / 4.5)])
+            x += width
+        c.setStrokeColor(colors.lightgrey)
+        c.line(MARGIN, bottom, x, bottom)
+        self.y = bottom
+
+    def subtotal(self, label, count, sums):
+        values = [f"{label} ({count} rows, avg)", ""] + [f"{s / count:.2f}" for s in sums]
+        self.row(values, font='Helvetica-Bold', fill=colors.beige)
+
+    def finish(self):
+        self.draw_footer()
+        self.canvas.save()
+
+
+def build_report(upload, out):
+    """
+    Render the full report for `upload` into the binary file `out`.
+
+    Rows are streamed from the database (or the memory-mapped Parquet parts)
+    REPORT_FETCH_SIZE at a time, ordered by type so each type ends with a
+    subtotal row.
+    """
+    report = ReportCanvas(out, upload)
+    if upload.columnar_path:
+        types = sorted(upload.summary.distribution)
+        rows = iter_rows_by_type(upload, types, batch_size=settings.REPORT_FETCH_SIZE)
+    else:
+        rows = (
+            Equipment.objects.filter(upload_id=upload.data_id)
+            .order_by('eq_type', 'id')
+            .values_list('name', 'eq_type', 'flowrate', 'pressure', 'temperature')
+            .iterator(chunk_size=settings.REPORT_FETCH_SIZE)
+        )
+
+    current_type, count, sums = None, 0, [0.0, 0.0, 0.0]
+    for name, eq_type, flowrate, pressure, temperature in rows:
+        if eq_type != current_type:
+            if count:
+                report.subtotal(current_type, count, sums)
+            current_type, count, sums = eq_type, 0, [0.0, 0.0, 0.0]
+        count += 1
+        sums[0] += flowrate
+        sums[1] += pressure
+        sums[2] += temperature
+        report.row([str(name), str(eq_type), f"{flowrate:.2f}", f"{pressure:.2f}", f"{temperature:.2f}"])
+    if count:
+        report.subtotal(current_type, count, sums)
+
+    report.row(
+        [f"All types ({upload.total_count} rows, avg)", "",
+         f"{upload.avg_flowrate:.2f}", f"{upload.avg_pressure:.2f}", f"{upload.avg_temperature:.2f}"],
+        font='Helvetica-Bold', fill=colors.lightgrey
+    )
+    report.finish()
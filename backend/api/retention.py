@@ -0,0 +1,151 @@
+"""
+History retention: which uploads to keep, and cleanup of what they leave behind.
+
+Each user keeps their HISTORY_MAX_UPLOADS newest uploads, and anything older
+than HISTORY_MAX_AGE_DAYS (if set) expires as well. apply_retention() runs a
+fixed number of set-based queries however many uploads expire (plus a few
+per deduplicated source that still has live copies), then deletes stored
+CSVs and Parquet datasets that no remaining upload references. Deleting a
+single upload goes through the delete signals in api.signals instead.
+"""
+import os
+import re
+import shutil
+import time
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Equipment, FileUpload
+from .reports import REPORT_TEMPLATE_VERSION
+
+# True while apply_retention() deletes: it rehomes rows and removes datasets for the whole set,
+# so the per-upload delete signals (api.signals) leave that to it
+bulk_deleting = ContextVar('bulk_deleting', default=False)
+
+
+def expired_uploads(user=None):
+    """(id, file, columnar_path) of uploads past the retention policy."""
+    owned = FileUpload.objects.filter(user__isnull=False)  # in-flight job uploads have no user yet
+    if user is not None:
+        owned = owned.filter(user=user)
+
+    ranked = owned.annotate(rank=Window(
+        RowNumber(),
+        partition_by=[F('user_id')],
+        order_by=[F('uploaded_at').desc(), F('id').desc()],
+    ))
+    expired = set(
+        ranked.filter(rank__gt=settings.HISTORY_MAX_UPLOADS).values_list('id', 'file', 'columnar_path')
+    )
+    if settings.HISTORY_MAX_AGE_DAYS:
+        cutoff = timezone.now() - timedelta(days=settings.HISTORY_MAX_AGE_DAYS)
+        expired |= set(owned.filter(uploaded_at__lt=cutoff).values_list('id', 'file', 'columnar_path'))
+    return sorted(expired)
+
+
+def apply_retention(user=None):
+    """Delete expired uploads for `user` (or everyone) and their stored files."""
+    expired = expired_uploads(user)
+    if not expired:
+        return 0
+    ids = [upload_id for upload_id, _, _ in expired]
+
+    token = bulk_deleting.set(True)
+    try:
+        with transaction.atomic():
+            rehome_shared_rows(ids)
+            # The rows go with their uploads in one cascaded DELETE
+            FileUpload.objects.filter(id__in=ids).delete()
+    finally:
+        bulk_deleting.reset(token)
+    transaction.on_commit(lambda: delete_unreferenced_files(
+        [name for _, name, _ in expired], [path for _, _, path in expired]))
+    return len(ids)
+
+
+def rehome_shared_rows(ids):
+    """
+    Hand the rows of expiring source uploads to their newest surviving copy.
+
+    Deduplicated uploads read their rows through `source`; before a source is
+    deleted its rows are moved (one UPDATE) to a copy that is being kept.
+    """
+    survivors = (FileUpload.objects.filter(source_id__in=ids).exclude(id__in=ids)
+                 .order_by('source_id', '-uploaded_at', '-id').values_list('id', 'source_id'))
+    new_owner = {}
+    for upload_id, source_id in survivors:
+        new_owner.setdefault(source_id, upload_id)
+
+    for source_id, owner_id in new_owner.items():
+        Equipment.objects.filter(upload_id=source_id).update(upload_id=owner_id)
+        FileUpload.objects.filter(source_id=source_id).exclude(id=owner_id).update(source_id=owner_id)
+        FileUpload.objects.filter(id=owner_id).update(source=None)
+
+
+def delete_unreferenced_files(names, datasets=()):
+    """Stored CSVs (and Parquet datasets) of deleted uploads that no remaining upload shares."""
+    still_used = set(FileUpload.objects.filter(file__in=names).values_list('file', flat=True))
+    for name in set(names) - still_used:
+        if name:
+            default_storage.delete(name)
+    datasets = [path for path in datasets if path]
+    if datasets:
+        still_used = set(FileUpload.objects.filter(columnar_path__in=datasets).values_list('columnar_path', flat=True))
+        for path in set(datasets) - still_used:
+            shutil.rmtree(os.path.join(settings.MEDIA_ROOT, path), ignore_errors=True)
+
+
+def delete_orphaned_files(min_age=3600):
+    """
+    Remove files under MEDIA_ROOT/uploads/ that no FileUpload references.
+
+    Files younger than `min_age` seconds are left alone, since an upload being
+    saved right now has its file on disk a moment before its row exists.
+    """
+    upload_dir = os.path.join(settings.MEDIA_ROOT, 'uploads')
+    if not os.path.isdir(upload_dir):
+        return []
+    referenced = set()
+    for name, columnar_path in FileUpload.objects.values_list('file', 'columnar_path'):
+        referenced.add(os.path.normpath(name))
+        if columnar_path:
+            referenced.add(os.path.normpath(columnar_path))
+
+    removed = []
+    cutoff = time.time() - min_age
+    for entry in os.scandir(upload_dir):
+        name = os.path.normpath(os.path.join('uploads', entry.name))
+        if name in referenced or entry.stat().st_mtime > cutoff:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+        removed.append(name)
+    return removed
+
+
+def delete_stale_reports():
+    """Cached PDFs of deleted uploads, of older template versions or of an earlier row count."""
+    if not os.path.isdir(settings.REPORT_CACHE_DIR):
+        return []
+    live = dict(FileUpload.objects.values_list('id', 'total_count'))
+    removed = []
+    for entry in os.scandir(settings.REPORT_CACHE_DIR):
+        # Files from before the row count was part of the name have none, and never match
+        match = re.fullmatch(r'report_(\d+)_v(\d+)(?:_(\d+))?\.pdf', entry.name)
+        if not match:
+            continue
+        upload_id, version = int(match.group(1)), int(match.group(2))
+        rows = int(match.group(3)) if match.group(3) else None
+        if upload_id not in live or live[upload_id] != rows or version != REPORT_TEMPLATE_VERSION:
+            os.remove(entry.path)
+            removed.append(entry.name)
+    return removed
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .columnar import delete_dataset
+from .models import FileUpload
+from .reports import evict_reports
+from .retention import bulk_deleting, rehome_shared_rows
+
+
+@receiver(pre_delete, sender=FileUpload)
+def rehome_copies(sender, instance, **kwargs):
+    # Copies of this upload read its rows; the newest one takes them over
+    if not bulk_deleting.get():
+        rehome_shared_rows([instance.pk])
+
+
+@receiver(post_delete, sender=FileUpload)
+def delete_derived_files(sender, instance, **kwargs):
+    evict_reports(instance.pk)
+    if not bulk_deleting.get():
+        delete_dataset(instance)
@@ -0,0 +1,198 @@
+"""
+Upload statistics accumulated chunk by chunk.
+
+Per-type count/mean/variance/min/max are computed with one vectorized
+groupby per chunk and merged with the parallel-variance formula (Chan et
+al.), so they are exact without keeping the file in memory. Percentiles come
+from a bottom-k random sample of STATS_SAMPLE_ROWS rows and are exact for
+files no larger than that.
+"""
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+NUMERIC_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+STATE_COLUMNS = ['n', 'mean', 'm2', 'min', 'max']
+PERCENTILES = [0.25, 0.5, 0.75]
+
+
+def empty_state():
+    return pd.DataFrame(columns=STATE_COLUMNS, dtype=float)
+
+
+def chunk_state(values, keys):
+    """Per-key [n, mean, m2, min, max] of one column of one chunk."""
+    # dropna=False keeps rows with a blank Type in the overall figures
+    agg = values.groupby(keys, observed=True, dropna=False).agg(['count', 'mean', 'var', 'min', 'max'])
+    return pd.DataFrame({
+        'n': agg['count'].astype(float),
+        'mean': agg['mean'],
+        'm2': (agg['var'] * (agg['count'] - 1)).fillna(0.0),
+        'min': agg['min'],
+        'max': agg['max'],
+    })
+
+
+def merge_states(a, b):
+    """Combine two per-key moment frames as if their rows had been seen together."""
+    index = a.index.union(b.index)
+    fill = {'n': 0.0, 'mean': 0.0, 'm2': 0.0, 'min': np.inf, 'max': -np.inf}
+    a = a.reindex(index).fillna(fill)
+    b = b.reindex(index).fillna(fill)
+
+    n = a['n'] + b['n']
+    safe_n = n.where(n > 0, 1.0)
+    delta = b['mean'] - a['mean']
+    return pd.DataFrame({
+        'n': n,
+        'mean': a['mean'] + delta * b['n'] / safe_n,
+        'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / safe_n,
+        'min': np.minimum(a['min'], b['min']),
+        'max': np.maximum(a['max'], b['max']),
+    })
+
+
+def collapse_state(state):
+    """Fold a per-key frame into a single [n, mean, m2, min, max] row."""
+    n = state['n'].sum()
+    if not n:
+        return pd.Series({'n': 0.0, 'mean': 0.0, 'm2': 0.0, 'min': np.nan, 'max': np.nan})
+    mean = (state['n'] * state['mean']).sum() / n
+    m2 = state['m2'].sum() + (state['n'] * (state['mean'] - mean) ** 2).sum()
+    return pd.Series({'n': n, 'mean': mean, 'm2': m2, 'min': state['min'].min(), 'max': state['max'].max()})
+
+
+def describe(row, quantiles=None):
+    n = int(row['n'])
+    data = {
+        "count": n,
+        "mean": float(row['mean']) if n else None,
+        "std": float(np.sqrt(row['m2'] / (n - 1))) if n > 1 else None,
+        "min": float(row['min']) if n else None,
+        "max": float(row['max']) if n else None,
+    }
+    for q in PERCENTILES:
+        value = quantiles.get(q) if quantiles is not None else None
+        data[f"p{int(q * 100)}"] = None if value is None or pd.isna(value) else float(value)
+    return data
+
+
+def moments_from_stats(stats):
+    """Rebuild moment records from a summary stored before moments were kept."""
+    records = []
+    for eq_type, cols in stats.get('by_type', {}).items():
+        for key, d in cols.items():
+            n = d['count']
+            records.append({
+                "type": eq_type, "column": key, "n": n, "mean": d['mean'],
+                "m2": (d['std'] or 0.0) ** 2 * (n - 1) if n > 1 else 0.0,
+                "min": d['min'], "max": d['max'],
+            })
+    return records
+
+
+class RunningStats:
+    """Aggregates updated chunk by chunk, so the file never sits in memory."""
+
+    def __init__(self, sample_rows=None, seed=None, track_sample=True):
+        self.total_count = 0
+        self.distribution = Counter()
+        self.states = {col: empty_state() for col in NUMERIC_COLUMNS}
+        self.sample_rows = sample_rows or settings.STATS_SAMPLE_ROWS
+        self.track_sample = track_sample
+        self.sample = None
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_summary(cls, upload, summary):
+        """
+        Resume from what was stored at ingest, to fold in appended rows.
+
+        Only the moments are restored, not the percentile sample, so appends
+        cost time proportional to the new rows alone.
+        """
+        stats = cls(track_sample=False)
+        stats.total_count = upload.total_count
+        stats.distribution.update(summary.distribution)
+        records = pd.DataFrame(summary.moments or moments_from_stats(summary.stats),
+                               columns=['type', 'column'] + STATE_COLUMNS)
+        for col in NUMERIC_COLUMNS:
+            rows = records[records['column'] == col.lower()]
+            stats.states[col] = pd.DataFrame(
+                rows[STATE_COLUMNS].to_numpy(dtype=float),
+                index=pd.Index([np.nan if t is None else t for t in rows['type']], dtype=object),
+                columns=STATE_COLUMNS
+            )
+        return stats
+
+    def update(self, chunk):
+        self.total_count += len(chunk)
+        for eq_type, n in chunk['Type'].value_counts().items():
+            self.distribution[eq_type] += int(n)
+        for col in NUMERIC_COLUMNS:
+            self.states[col] = merge_states(self.states[col], chunk_state(chunk[col], chunk['Type']))
+        if self.track_sample:
+            self.update_sample(chunk)
+
+    def update_sample(self, chunk):
+        # Bottom-k sampling: every row gets a random key, keep the k smallest
+        part = chunk[['Type'] + NUMERIC_COLUMNS].assign(_key=self.rng.random(len(chunk)))
+        if self.sample is not None:
+            part = pd.concat([self.sample, part], ignore_index=True)
+        if len(part) > self.sample_rows:
+            part = part.nsmallest(self.sample_rows, '_key')
+        self.sample = part
+
+    def overall(self, col):
+        return collapse_state(self.states[col])
+
+    def mean(self, col):
+        return float(self.overall(col)['mean'])
+
+    def as_dict(self):
+        return {
+            "total_count": self.total_count,
+            "avg_flowrate": self.mean('Flowrate'),
+            "avg_pressure": self.mean('Pressure'),
+            "avg_temperature": self.mean('Temperature'),
+        }
+
+    def summary(self):
+        """Detailed stats for UploadSummary.stats: overall and per type."""
+        sample = self.sample if self.sample is not None else pd.DataFrame(columns=['Type'] + NUMERIC_COLUMNS)
+        overall_q = sample[NUMERIC_COLUMNS].quantile(PERCENTILES) if len(sample) else None
+        by_type_q = sample.groupby('Type', observed=True)[NUMERIC_COLUMNS].quantile(PERCENTILES) if len(sample) else None
+
+        overall = {}
+        by_type = {}
+        for col in NUMERIC_COLUMNS:
+            key = col.lower()
+            overall[key] = describe(self.overall(col), overall_q[col] if overall_q is not None else None)
+            for eq_type, row in self.states[col].iterrows():
+                if pd.isna(eq_type):
+                    continue
+                quantiles = None
+                if by_type_q is not None and eq_type in by_type_q.index.get_level_values(0):
+                    quantiles = by_type_q.loc[eq_type, col]
+                by_type.setdefault(str(eq_type), {})[key] = describe(row, quantiles)
+        return {
+            "overall": overall,
+            "by_type": by_type,
+            "percentile_sample": len(sample),
+            # rows the percentiles describe (appends update the moments, not the percentiles)
+            "percentile_rows": self.total_count,
+        }
+
+    def moments(self):
+        """Raw [n, mean, m2, min, max] per (type, column), stored so appends can merge exactly."""
+        records = []
+        for col in NUMERIC_COLUMNS:
+            for eq_type, row in self.states[col].iterrows():
+                records.append({
+                    "type": None if pd.isna(eq_type) else str(eq_type),
+                    "column": col.lower(),
+                    **{key: float(row[key]) if np.isfinite(row[key]) else None for key in STATE_COLUMNS},
+                })
+        return records
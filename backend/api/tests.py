@@ -1,3 +1,607 @@
-from django.test import TestCase
+import base64
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from .instrumentation import Histogram
+from .jobs import claim_job, requeue_stale_jobs, run_job, start_job
+from .models import Equipment, FileUpload, IngestJob, UploadSummary
+from .retention import apply_retention
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+TYPES = ['Pump', 'Valve', 'Reactor', 'Compressor']
+HEADER = 'Equipment Name,Type,Flowrate,Pressure,Temperature'
+
+
+def csv_rows(start, count):
+    return [f'Eq-{i},{TYPES[i % 4]},{100 + i % 7 + i / 100},{5 + i % 3},{50 + i % 11}'
+            for i in range(start, start + count)]
+
+
+def csv_file(rows, name='equipment.csv'):
+    return SimpleUploadedFile(name, '\n'.join([HEADER] + rows).encode(), content_type='text/csv')
+
+
+# Ingest in this process: the writer process could not see the in-memory test database.
+# Basic auth checks the password on every request, so it gets a cheap hasher.
+@override_settings(SQLITE_WRITER_QUEUE=False, HISTORY_MAX_UPLOADS=5, HISTORY_MAX_AGE_DAYS=None,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UploadTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        media = tempfile.mkdtemp(prefix='chemvis-tests-')
+        cls.addClassCleanup(shutil.rmtree, media, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media))
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client = self.client_for('alice', 'secret')
+
+    def client_for(self, username, password):
+        token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        return Client(HTTP_AUTHORIZATION=f'Basic {token}')
+
+    def upload(self, rows, client=None, name='equipment.csv'):
+        response = (client or self.client).post('/api/upload/', {'file': csv_file(rows, name)})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def append(self, upload_id, rows):
+        return self.client.post(f'/api/uploads/{upload_id}/append/', {'file': csv_file(rows)})
+
+    def page(self, upload_id, **params):
+        return self.client.get(f'/api/uploads/{upload_id}/equipment/', params)
+
+
+def run_inline(name, max_workers, fn, *args):
+    # Stands in for workers.submit(): runs the task here, since a pool process can't see the test database
+    future = Future()
+    future.set_result(fn(*args))
+    return future
+
+
+class JobTests(UploadTestCase):
+    def queued_job(self, rows):
+        upload = FileUpload.objects.create(file=csv_file(rows), filename='equipment.csv')
+        return IngestJob.objects.create(user=self.user, upload=upload)
+
+    def test_async_upload_finishes_in_the_background(self):
+        with mock.patch('api.jobs.submit', run_inline), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/upload/?async=1', {'file': csv_file(csv_rows(0, 9))})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['state'], IngestJob.QUEUED)
+
+        job = self.client.get(f"/api/jobs/{response.json()['job_id']}/").json()
+        self.assertEqual(job['state'], IngestJob.DONE)
+        self.assertEqual(job['rows_processed'], 9)
+        self.assertEqual(job['result']['stats']['total_count'], 9)
+        self.assertEqual(FileUpload.objects.get(id=job['upload_id']).user, self.user)
+
+    def test_job_is_claimed_once(self):
+        job = self.queued_job(csv_rows(0, 3))
+        self.assertTrue(claim_job(job.id))
+        self.assertFalse(claim_job(job.id))
+        # Already running: run_job() leaves it to whoever claimed it
+        run_job(job.id)
+        self.assertEqual(IngestJob.objects.get(id=job.id).state, IngestJob.RUNNING)
+        self.assertEqual(Equipment.objects.count(), 0)
+
+    def test_dead_worker_fails_the_job(self):
+        job = self.queued_job(csv_rows(0, 3))
+        died = Future()
+        died.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        with mock.patch('api.jobs.submit', return_value=died), self.assertLogs('api.jobs', 'ERROR'):
+            start_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestJob.FAILED)
+        self.assertIsNone(job.upload)
+        self.assertFalse(FileUpload.objects.exists())
+
+    def test_stale_running_job_is_requeued_without_its_rows(self):
+        job = self.queued_job(csv_rows(0, 6))
+        claim_job(job.id)
+        Equipment.objects.create(upload=job.upload, name='Eq-0', eq_type='Pump', flowrate=1, pressure=1, temperature=1)
+        fresh = self.queued_job(csv_rows(10, 6))
+        claim_job(fresh.id)
+        IngestJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(minutes=30))
+
+        self.assertEqual(requeue_stale_jobs(10 * 60), [job.id])
+        self.assertEqual(IngestJob.objects.get(id=job.id).state, IngestJob.QUEUED)
+        self.assertFalse(Equipment.objects.filter(upload=job.upload).exists())
+        self.assertEqual(IngestJob.objects.get(id=fresh.id).state, IngestJob.RUNNING)
+
+        run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestJob.DONE)
+        self.assertEqual(Equipment.objects.filter(upload=job.upload).count(), 6)
+
+
+class TokenTests(UploadTestCase):
+    def login(self):
+        response = self.client.post('/api/login/')
+        self.assertEqual(response.status_code, 200)
+        return Client(HTTP_AUTHORIZATION=f"Token {response.json()['token']}")
+
+    def test_token_authenticates(self):
+        self.assertEqual(self.login().get('/api/history/').status_code, 200)
+
+    def test_login_needs_the_password(self):
+        self.assertEqual(self.client_for('alice', 'wrong').post('/api/login/').status_code, 401)
+
+    def test_tampered_token_is_rejected(self):
+        token = self.client.post('/api/login/').json()['token']
+        client = Client(HTTP_AUTHORIZATION=f'Token {token[:-2]}xx')
+        self.assertEqual(client.get('/api/history/').status_code, 401)
+
+    def test_expired_token_is_rejected(self):
+        client = self.login()
+        later = time.time() + self.client.post('/api/login/').json()['expires_in'] + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(client.get('/api/history/').status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        client = self.login()
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(client.get('/api/history/').status_code, 401)
+
+
+class ReportTests(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        cache = tempfile.mkdtemp(prefix='chemvis-reports-')
+        self.addCleanup(shutil.rmtree, cache, ignore_errors=True)
+        self.enterContext(override_settings(REPORT_CACHE_DIR=cache))
+        self.submit = self.enterContext(mock.patch('api.reports.submit', side_effect=run_inline))
+
+    def test_report_is_rendered_once_and_revalidated(self):
+        upload_id = self.upload(csv_rows(0, 12))['id']
+        response = self.client.get(f'/api/pdf/{upload_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content)[:5], b'%PDF-')
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(f'/api/pdf/{upload_id}/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        again = self.client.get(f'/api/pdf/{upload_id}/')
+        self.assertEqual(again['ETag'], etag)
+        again.close()
+        self.assertEqual(self.submit.call_count, 1)
+
+    def test_append_changes_the_report(self):
+        upload_id = self.upload(csv_rows(0, 12))['id']
+        response = self.client.get(f'/api/pdf/{upload_id}/')
+        response.close()
+        self.append(upload_id, csv_rows(12, 3))
+
+        fresh = self.client.get(f'/api/pdf/{upload_id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+        fresh.close()
+        self.assertEqual(self.submit.call_count, 2)
+
+
+    def test_render_that_does_not_finish_is_retried_later(self):
+        upload_id = self.upload(csv_rows(0, 12))['id']
+        for error, retry_after in ((FutureTimeout(), '30'), (BrokenProcessPool(), '5')):
+            with self.subTest(error=type(error).__name__):
+                failed = Future()
+                failed.set_exception(error)
+                self.submit.side_effect = None
+                self.submit.return_value = failed
+                response = self.client.get(f'/api/pdf/{upload_id}/')
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], retry_after)
+
+class PaginationTests(UploadTestCase):
+    def test_pages_cover_every_row_once(self):
+        upload_id = self.upload(csv_rows(0, 23))['id']
+        names, cursor = [], None
+        while True:
+            params = {'limit': 5} if cursor is None else {'limit': 5, 'cursor': cursor}
+            data = self.page(upload_id, **params).json()
+            self.assertLessEqual(len(data['results']), 5)
+            self.assertEqual(len(data['anomaly_flags']), len(data['results']))
+            names += [row['Equipment Name'] for row in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, [f'Eq-{i}' for i in range(23)])
+
+    def test_exact_multiple_of_limit_ends_without_empty_page(self):
+        upload_id = self.upload(csv_rows(0, 10))['id']
+        first = self.page(upload_id, limit=5).json()
+        second = self.page(upload_id, limit=5, cursor=first['next_cursor']).json()
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next_cursor'])
+
+    def test_invalid_limit_or_cursor_is_rejected(self):
+        upload_id = self.upload(csv_rows(0, 3))['id']
+        for params in ({'limit': -5}, {'limit': 0}, {'limit': 'x'}, {'limit': '1.5'}, {'cursor': -1},
+                       {'cursor': 'x'}):
+            with self.subTest(**params):
+                self.assertEqual(self.page(upload_id, **params).status_code, 400)
+
+    @override_settings(EQUIPMENT_PAGE_MAX=7)
+    def test_limit_is_capped(self):
+        upload_id = self.upload(csv_rows(0, 20))['id']
+        data = self.page(upload_id, limit=1000).json()
+        self.assertEqual(len(data['results']), 7)
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_other_users_upload_is_not_found(self):
+        upload_id = self.upload(csv_rows(0, 3))['id']
+        User.objects.create_user('bob', password='secret')
+        response = self.client_for('bob', 'secret').get(f'/api/uploads/{upload_id}/equipment/')
+        self.assertEqual(response.status_code, 404)
+
+
+class InstrumentationTests(UploadTestCase):
+    def test_upload_reports_its_stages(self):
+        response = self.client.post('/api/upload/', {'file': csv_file(csv_rows(0, 5))})
+        stages = {part.split(';')[0] for part in response['Server-Timing'].split(', ')}
+        self.assertTrue({'store', 'parse', 'stats', 'insert', 'summary', 'db', 'total'} <= stages, stages)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="[1-9][0-9]* queries"')
+
+    def test_metrics_count_requests_per_view(self):
+        self.client.get('/api/history/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response.content.decode(),
+                         r'_request_duration_seconds_count\{view="history",method="GET",status="200"\} [1-9]')
+
+    def test_metrics_only_for_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=None):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 200)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test', ('view',), (0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, 'v')
+        lines = histogram.exposition().splitlines()
+        self.assertIn('test_seconds_bucket{view="v",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="v",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="v",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{view="v"} 3', lines)
+
+class RowFormatTests(UploadTestCase):
+    COLUMNS = 'application/vnd.equipment.columns+json'
+
+    def setUp(self):
+        super().setUp()
+        self.upload_id = self.upload(csv_rows(0, 7))['id']
+        self.rows = self.page(self.upload_id, limit=5).json()
+
+    def get(self, accept):
+        return self.client.get(f'/api/uploads/{self.upload_id}/equipment/', {'limit': 5}, HTTP_ACCEPT=accept)
+
+    def as_columns(self):
+        return {header: [row[header] for row in self.rows['results']] for header in self.rows['results'][0]}
+
+    def test_columnar_json(self):
+        response = self.get(self.COLUMNS)
+        self.assertEqual(response['Content-Type'], self.COLUMNS)
+        data = json.loads(response.content)
+        self.assertEqual(data['results'], self.as_columns())
+        self.assertEqual(data['next_cursor'], self.rows['next_cursor'])
+
+    def test_upload_response_in_columns(self):
+        response = self.client.post('/api/upload/', {'file': csv_file(csv_rows(20, 3))}, HTTP_ACCEPT=self.COLUMNS)
+        self.assertEqual(json.loads(response.content)['data']['Equipment Name'], ['Eq-20', 'Eq-21', 'Eq-22'])
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        response = self.get('application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'], self.as_columns())
+
+    @skipUnless(pa, "pyarrow is not installed")
+    def test_arrow_stream(self):
+        table = pa.ipc.open_stream(self.get('application/vnd.apache.arrow.stream').content).read_all()
+        self.assertEqual(table.to_pydict(), self.as_columns())
+        meta = json.loads(table.schema.metadata[b'meta'])
+        self.assertEqual(meta['next_cursor'], self.rows['next_cursor'])
+        self.assertEqual(meta['anomaly_flags'], self.rows['anomaly_flags'])
+
+    def test_each_format_has_its_own_etag(self):
+        self.assertNotEqual(self.get('application/json')['ETag'], self.get(self.COLUMNS)['ETag'])
+
+    def test_unknown_format_is_not_acceptable(self):
+        self.assertEqual(self.get('text/csv').status_code, 406)
+
+class HistoryCachingTests(UploadTestCase):
+    def setUp(self):
+        super().setUp()
+        self.upload_id = self.upload(csv_rows(0, 8))['id']
+
+    def history(self, **headers):
+        return self.client.get('/api/history/', **headers)
+
+    def test_unchanged_history_is_not_sent_again(self):
+        etag = self.history()['ETag']
+        response = self.history(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_append_and_delete_change_the_etag(self):
+        etag = self.history()['ETag']
+        self.append(self.upload_id, csv_rows(8, 2))
+        response = self.history(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['count'], 10)
+
+        etag = response['ETag']
+        FileUpload.objects.filter(id=self.upload_id).delete()
+        self.assertEqual(self.history(HTTP_IF_NONE_MATCH=etag).json(), [])
+
+    def test_if_modified_since_does_not_hide_an_append(self):
+        since = self.history().get('Last-Modified') or 'Fri, 01 Jan 2100 00:00:00 GMT'
+        self.append(self.upload_id, csv_rows(8, 2))
+        response = self.history(HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['count'], 10)
+
+    def test_compressed_history_revalidates(self):
+        response = self.history(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn(response['Content-Encoding'], ('gzip', 'br'))
+        self.assertEqual(self.history(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+class DeduplicationTests(UploadTestCase):
+    def test_same_content_reuses_the_upload(self):
+        rows = csv_rows(0, 12)
+        first = self.upload(rows, name='first.csv')
+        second = self.upload(rows, name='second.csv')
+
+        self.assertNotEqual(first['id'], second['id'])
+        self.assertEqual(second['stats'], first['stats'])
+        self.assertEqual(second['distribution'], first['distribution'])
+        self.assertEqual(second['data'], first['data'])
+        copy = FileUpload.objects.get(id=second['id'])
+        self.assertEqual(copy.source_id, first['id'])
+        self.assertEqual(copy.filename, 'second.csv')
+        # The rows are stored once
+        self.assertEqual(Equipment.objects.count(), 12)
+
+    def test_other_users_content_is_not_shared(self):
+        rows = csv_rows(0, 12)
+        first = self.upload(rows)
+        User.objects.create_user('bob', password='secret')
+        other = self.upload(rows, client=self.client_for('bob', 'secret'))
+
+        self.assertIsNone(FileUpload.objects.get(id=other['id']).source_id)
+        self.assertEqual(Equipment.objects.filter(upload_id=first['id']).count(), 12)
+        self.assertEqual(Equipment.objects.filter(upload_id=other['id']).count(), 12)
+
+    def test_shared_upload_cannot_be_appended(self):
+        rows = csv_rows(0, 12)
+        first = self.upload(rows)
+        second = self.upload(rows)
+        for upload_id in (first['id'], second['id']):
+            self.assertEqual(self.append(upload_id, csv_rows(12, 3)).status_code, 409)
+
+    def test_deleting_the_source_hands_rows_to_a_copy(self):
+        rows = csv_rows(0, 12)
+        first = self.upload(rows)
+        second = self.upload(rows)
+        FileUpload.objects.get(id=first['id']).delete()
+
+        self.assertIsNone(FileUpload.objects.get(id=second['id']).source_id)
+        self.assertEqual(Equipment.objects.filter(upload_id=second['id']).count(), 12)
+        self.assertEqual(len(self.page(second['id']).json()['results']), 12)
+
+
+class AnalyticsTests(UploadTestCase):
+    def test_aggregates_per_upload_and_type(self):
+        first = self.upload(csv_rows(0, 8))['id']
+        second = self.upload(csv_rows(8, 12))['id']
+        data = self.client.get('/api/analytics/').json()
+
+        self.assertNotIn('by_name', data)
+        self.assertEqual([row['upload_id'] for row in data['by_type']], [first] * 4 + [second] * 4)
+        pumps = [row for row in data['by_type'] if row['eq_type'] == 'Pump']
+        self.assertEqual([row['count'] for row in pumps], [2, 3])
+        # Pumps of the second upload: Eq-8, Eq-12 and Eq-16
+        self.assertAlmostEqual(pumps[1]['avg_temperature'], (58 + 51 + 55) / 3)
+        self.assertEqual(pumps[1]['min_pressure'], 5)
+        self.assertEqual(pumps[1]['max_pressure'], 7)
+
+    def test_filters_by_type_and_name(self):
+        self.upload(csv_rows(0, 8))
+        data = self.client.get('/api/analytics/', {'type': 'Valve', 'name': ['Eq-1', 'Eq-2']}).json()
+        self.assertEqual({row['eq_type'] for row in data['by_type']}, {'Valve'})
+        self.assertEqual([(row['name'], row['count']) for row in data['by_name']], [('Eq-1', 1)])
+
+    def test_deduplicated_uploads_each_get_their_rows(self):
+        rows = csv_rows(0, 8)
+        ids = [self.upload(rows)['id'], self.upload(rows)['id']]
+        User.objects.create_user('bob', password='secret')
+        self.upload(csv_rows(100, 8), client=self.client_for('bob', 'secret'))
+
+        data = self.client.get('/api/analytics/', {'type': 'Pump'}).json()
+        self.assertEqual([(row['upload_id'], row['count']) for row in data['by_type']], [(ids[0], 2), (ids[1], 2)])
+
+@override_settings(HISTORY_MAX_UPLOADS=2)
+class RetentionTests(UploadTestCase):
+    def test_keeps_newest_uploads(self):
+        ids = [self.upload(csv_rows(start, 4))['id'] for start in (0, 10, 20, 30)]
+
+        self.assertEqual(sorted(FileUpload.objects.values_list('id', flat=True)), ids[2:])
+        self.assertEqual(set(Equipment.objects.values_list('upload_id', flat=True)), set(ids[2:]))
+        history = self.client.get('/api/history/').json()
+        self.assertEqual([entry['id'] for entry in history], ids[:1:-1])
+
+    def test_rows_of_expired_source_move_to_kept_copy(self):
+        rows = csv_rows(0, 8)
+        source = self.upload(rows)['id']
+        self.upload(csv_rows(100, 4))
+        copy = self.upload(rows)['id']
+
+        self.assertFalse(FileUpload.objects.filter(id=source).exists())
+        kept = FileUpload.objects.get(id=copy)
+        self.assertIsNone(kept.source_id)
+        self.assertEqual(Equipment.objects.filter(upload_id=copy).count(), 8)
+        data = self.page(copy).json()
+        self.assertEqual([row['Equipment Name'] for row in data['results']], [f'Eq-{i}' for i in range(8)])
+
+    def expire(self, count):
+        # `count` stored uploads past the limit, one of them with a copy that is past it as well
+        uploads = []
+        for i in range(count + 2):
+            upload = FileUpload.objects.create(user=self.user, file=f'uploads/{i}.csv', total_count=2)
+            UploadSummary.objects.create(upload=upload)
+            Equipment.objects.bulk_create([
+                Equipment(upload=upload, name=f'Eq-{j}', eq_type='Pump', flowrate=1, pressure=1, temperature=1)
+                for j in range(2)
+            ])
+            uploads.append(upload)
+        copy = FileUpload.objects.create(user=self.user, file=uploads[0].file.name, source=uploads[0])
+        FileUpload.objects.filter(id=copy.id).update(uploaded_at=uploads[0].uploaded_at)
+        return uploads[-2:]
+
+    def test_query_count_does_not_grow_with_expired_uploads(self):
+        for count in (5, 50):
+            with self.subTest(expired=count):
+                FileUpload.objects.all().delete()
+                kept = self.expire(count)
+                with self.assertNumQueries(9):
+                    self.assertEqual(apply_retention(self.user), count + 1)
+                self.assertEqual(list(FileUpload.objects.order_by('id')), kept)
+                self.assertEqual(Equipment.objects.count(), 4)
+
+    def test_other_users_uploads_are_kept(self):
+        User.objects.create_user('bob', password='secret')
+        bob = self.client_for('bob', 'secret')
+        theirs = self.upload(csv_rows(0, 4), client=bob)['id']
+        for start in (10, 20, 30):
+            self.upload(csv_rows(start, 4))
+        self.assertTrue(FileUpload.objects.filter(id=theirs).exists())
+        self.assertEqual(FileUpload.objects.filter(user=self.user).count(), 2)
+
+
+class AppendTests(UploadTestCase):
+    def test_append_matches_one_shot_ingest(self):
+        appended = self.upload(csv_rows(0, 30))['id']
+        response = self.append(appended, csv_rows(30, 21))
+        self.assertEqual(response.status_code, 200, response.content)
+        merged = response.json()
+        self.assertEqual(merged['appended'], 21)
+
+        User.objects.create_user('bob', password='secret')
+        whole = self.upload(csv_rows(0, 51), client=self.client_for('bob', 'secret'))
+
+        self.assertEqual(merged['distribution'], whole['distribution'])
+        self.assertEqual(merged['stats']['total_count'], 51)
+        for key, value in whole['stats'].items():
+            self.assertAlmostEqual(merged['stats'][key], value, places=9, msg=key)
+        sections = [(merged['details']['overall'], whole['details']['overall'])]
+        sections += [(merged['details']['by_type'][t], whole['details']['by_type'][t]) for t in TYPES]
+        for got, expected in sections:
+            for column, described in expected.items():
+                for name in ('count', 'mean', 'std', 'min', 'max'):
+                    self.assertAlmostEqual(got[column][name], described[name], places=9, msg=(column, name))
+
+    def test_appended_rows_are_paged_after_the_old_ones(self):
+        upload_id = self.upload(csv_rows(0, 6))['id']
+        self.append(upload_id, csv_rows(6, 4))
+        names = [row['Equipment Name'] for row in self.page(upload_id).json()['results']]
+        self.assertEqual(names, [f'Eq-{i}' for i in range(10)])
+
+    def test_upload_without_summary_is_refused(self):
+        upload_id = self.upload(csv_rows(0, 6))['id']
+        UploadSummary.objects.filter(upload_id=upload_id).delete()
+        self.assertEqual(self.append(upload_id, csv_rows(6, 4)).status_code, 409)
+        self.assertEqual(FileUpload.objects.get(id=upload_id).total_count, 6)
+
+
+class ParsingTests(UploadTestCase):
+    def post(self, text):
+        file_obj = SimpleUploadedFile('equipment.csv', text.encode(), content_type='text/csv')
+        return self.client.post('/api/upload/', {'file': file_obj})
+
+    def test_bad_header_is_turned_away_before_storing(self):
+        for text, error in (('Equipment Name,Type,Flowrate,Pressure\nA,Pump,1,2\n', 'Missing columns: Temperature'),
+                            (HEADER + ',Type\nA,Pump,1,2,3,Valve\n', 'Duplicate columns: Type'),
+                            ('', 'Empty file')):
+            with self.subTest(error=error):
+                response = self.post(text)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['error'], error)
+        self.assertFalse(FileUpload.objects.exists())
+
+    def test_invalid_rows_are_reported_and_left_out(self):
+        rows = csv_rows(0, 6)
+        rows[1] = 'Eq-1,Valve,fast,6,51'
+        rows[3] = ',Compressor,103,5,53'
+        rows[4] = 'Eq-4,Pump,104,6'
+        for engine in ('pyarrow', 'pandas'):
+            with self.subTest(engine=engine), self.settings(CSV_ENGINE=engine):
+                response = self.post('\n'.join([HEADER] + rows))
+                self.assertEqual(response.status_code, 200)
+                report = response.json()['row_errors']
+                self.assertEqual(report['rejected_rows'], 3)
+                self.assertEqual([(e['line'], e['column']) for e in report['errors']],
+                                 [(3, 'Flowrate'), (5, 'Equipment Name'), (6, None)])
+                self.assertEqual(response.json()['stats']['total_count'], 3)
+
+    def test_infinite_measurements_are_rejected(self):
+        rows = csv_rows(0, 4) + ['Eq-4,Pump,inf,6,51', 'Eq-5,Valve,100,-Infinity,1e400']
+        for engine in ('pyarrow', 'pandas'):
+            with self.subTest(engine=engine), self.settings(CSV_ENGINE=engine):
+                response = self.post('\n'.join([HEADER] + rows))
+                self.assertEqual(response.status_code, 200)
+                report = response.json()['row_errors']
+                self.assertEqual(report['rejected_rows'], 2)
+                self.assertEqual([(e['line'], e['column']) for e in report['errors']],
+                                 [(6, 'Flowrate'), (7, 'Pressure'), (7, 'Temperature')])
+                self.assertEqual(response.json()['stats']['total_count'], 4)
+
+    def test_file_without_valid_rows_fails(self):
+        response = self.post('\n'.join([HEADER, 'Eq-0,Pump,inf,6,51', 'Eq-1,Pump,x,6,51']))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['row_errors']['rejected_rows'], 2)
+        self.assertFalse(FileUpload.objects.exists())
+
+class AnomalyTests(UploadTestCase):
+    def test_outliers_are_flagged_per_column(self):
+        rows = csv_rows(0, 40)
+        # Pumps otherwise have flowrate 100-107, pressure 5-7 and temperature 50-60
+        rows[0] = 'Eq-0,Pump,900,6,55'
+        rows[4] = 'Eq-4,Pump,103,70,900'
+        upload = self.upload(rows)
+        self.assertEqual(upload['anomalies']['count'], 2)
+        self.assertEqual(upload['anomaly_flags'][0], 1)
+        self.assertEqual(upload['anomaly_flags'][4], 2 | 4)
+        self.assertEqual(sum(1 for flags in upload['anomaly_flags'] if flags), 2)
+
+        data = self.client.get(f"/api/uploads/{upload['id']}/anomalies/").json()
+        self.assertEqual([row['Equipment Name'] for row in data['results']], ['Eq-0', 'Eq-4'])
+        self.assertEqual(data['anomaly_flags'], [1, 6])
+        self.assertIn('Pump', data['bounds'])
+
+    def test_appended_rows_are_flagged_against_stored_bounds(self):
+        upload_id = self.upload(csv_rows(0, 40))['id']
+        self.assertEqual(self.append(upload_id, ['Eq-40,Valve,104,6,900']).status_code, 200)
+        data = self.client.get(f'/api/uploads/{upload_id}/anomalies/').json()
+        self.assertEqual([row['Equipment Name'] for row in data['results']], ['Eq-40'])
+        self.assertEqual(data['anomaly_flags'], [4])
+        self.assertEqual(data['count'], 1)
@@ -0,0 +1,59 @@
+"""
+Local process pools shared by the web process.
+
+Each pool is created lazily on first use. Children get a fresh Django setup
+and never reuse the parent's database connections. A pool whose process died
+(killed, out of memory) is broken for good, so submit() replaces it.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_pools = {}
+# Database connections a forked child inherited from the parent: kept referenced, never used
+_inherited = []
+
+
+def _init_worker():
+    import django
+    django.setup()
+    from django.db import connections
+    # The inherited connections share their sockets with the parent, so closing one here would
+    # end the parent's session too (PostgreSQL gets a Terminate). Keep them alive but unused,
+    # and give this process fresh wrappers that connect on first use. SQLite has no session to
+    # end, but its locks and WAL index are tracked per process and file: a copied handle left
+    # open would confuse the new connection's view of the file, so those are closed.
+    for conn in connections.all(initialized_only=True):
+        if conn.vendor == 'sqlite':
+            conn.close()
+        else:
+            _inherited.append(conn)
+        connections[conn.alias] = connections.create_connection(conn.alias)
+
+
+def get_pool(name, max_workers):
+    if name not in _pools:
+        _pools[name] = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+    return _pools[name]
+
+
+def submit(name, max_workers, fn, *args):
+    """
+    fn(*args) on the `name` pool. If a child died during an earlier task the
+    pool refuses new work; it is dropped and the task goes to a fresh one.
+    Tasks that were running when the child died fail with BrokenProcessPool.
+    """
+    pool = get_pool(name, max_workers)
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        if _pools.get(name) is pool:  # another thread may have replaced it already
+            del _pools[name]
+        pool.shutdown(wait=False)
+        return get_pool(name, max_workers).submit(fn, *args)
+
+
+def shutdown_pools():
+    """Stop every pool; the next get_pool() starts a fresh one."""
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.shutdown()
@@ -0,0 +1,55 @@
+"""
+Single writer for large writes on SQLite.
+
+SQLite lets one connection write at a time; others wait for the lock (up to
+the `timeout` database option) and then fail with "database is locked". With
+SQLITE_WRITER_QUEUE on, CSV ingests (sync uploads and ?async=1 jobs alike)
+and appends that arrived as temporary files are handed to one 'writer'
+worker process and run in arrival order, so concurrent uploads queue instead
+of competing, and only short writes are left to the lock's timeout. Other
+databases write in place.
+
+The queue is per web process: with several server processes (or the
+ingest_worker command running beside them) each has its own writer, and
+those fall back on the timeout.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .ingest import append_csv, ingest_csv
+from .instrumentation import merge_timings, timed_call
+from .models import FileUpload
+from .workers import submit
+
+
+def use_writer_queue():
+    return settings.SQLITE_WRITER_QUEUE and connection.vendor == 'sqlite'
+
+
+def submit_write(fn, *args):
+    return submit('writer', 1, fn, *args)
+
+
+def run_write(fn, *args):
+    """
+    fn(*args) in the writer process on SQLite, in this one otherwise; stage
+    timings come back with it. Raises BrokenProcessPool if the writer died
+    during the call; the next call starts a new one.
+    """
+    if not use_writer_queue():
+        return fn(*args)
+    submitted = time.time()
+    result, timings = submit_write(timed_call, fn, *args).result()
+    merge_timings(timings, submitted)
+    return result
+
+
+def ingest_upload(upload_id):
+    return ingest_csv(FileUpload.objects.get(id=upload_id))
+
+
+def append_file(upload_id, path):
+    with open(path, 'rb') as f:
+        return append_csv(FileUpload.objects.get(id=upload_id), f)
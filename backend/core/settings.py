@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,8 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.TimingMiddleware',  # Server-Timing + /metrics histograms; first so it times everything else
     'corsheaders.middleware.CorsMiddleware', # Add this at the top
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',  # gzip/brotli for JSON; must wrap everything that writes the body
 
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,8 +87,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Concurrent uploads: WAL lets readers run alongside the one writer, IMMEDIATE takes the
+        # write lock at BEGIN (a deferred transaction can't wait to upgrade its lock, it fails with
+        # "database is locked"), and writers queue for up to `timeout` seconds
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 30,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA cache_size=-65536; '
+                            'PRAGMA temp_store=MEMORY',
+        },
     }
 }
+# PostgreSQL instead: set POSTGRES_DB (and POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST,
+# POSTGRES_PORT) and pip install "psycopg[binary]"; Equipment rows are then loaded with COPY
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['POSTGRES_DB'],
+            'USER': os.environ.get('POSTGRES_USER', ''),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', ''),
+            'PORT': os.environ.get('POSTGRES_PORT', ''),
+            'CONN_MAX_AGE': 60,
+        }
+    }
+# SQLite: large writes (CSV ingests, big appends) run one at a time in a single writer process
+# instead of competing for the database lock (see api/writer.py)
+SQLITE_WRITER_QUEUE = True
 
 
 # Password validation
@@ -128,8 +159,75 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Conditional GETs from the web client (/api/history/ answers 304 when nothing changed)
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match')
+CORS_EXPOSE_HEADERS = ['ETag', 'Server-Timing']
 
 # Media settings for file uploads
-import os
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# CSV ingestion
+# Uploads are streamed CSV_CHUNK_SIZE rows (CSV_BLOCK_SIZE bytes with pyarrow) at a time so peak memory stays flat
+CSV_CHUNK_SIZE = 50000
+CSV_BLOCK_SIZE = 2 * 1024 * 1024
+# 'pyarrow' parses with Arrow's multithreaded CSV reader when pyarrow is installed, 'c' with pandas' C parser
+CSV_ENGINE = 'pyarrow'
+# Bad rows are left out of an upload and reported; this many problems are listed (all are counted)
+CSV_MAX_ROW_ERRORS = 100
+EQUIPMENT_BATCH_SIZE = 5000
+# PostgreSQL: load Equipment rows with COPY instead of batched INSERTs
+POSTGRES_COPY = True
+# Store measurements as Parquet next to the CSV instead of Equipment rows (needs pyarrow)
+COLUMNAR_STORAGE = False
+# Rows kept in the random sample used for percentiles (exact up to this many rows)
+STATS_SAMPLE_ROWS = 100000
+# Measurements whose modified z-score within their type (from median and MAD) is above this are
+# flagged as anomalies at ingest; see api.anomalies
+ANOMALY_THRESHOLD = 3.5
+# Keyset pages of /api/uploads/<id>/equipment/ (the upload response carries the first one)
+EQUIPMENT_PAGE_SIZE = 500
+EQUIPMENT_PAGE_MAX = 5000
+# /api/uploads/<id>/plots/: uploads up to PLOT_MAX_POINTS rows send their points, larger ones a
+# PLOT_BINS x PLOT_BINS grid of counts; temperature histograms use PLOT_BINS bins
+PLOT_BINS = 64
+PLOT_MAX_POINTS = 20000
+# History retention per user (run 'manage.py compact_history' to apply to existing data)
+HISTORY_MAX_UPLOADS = 5
+HISTORY_MAX_AGE_DAYS = None  # e.g. 90; None keeps uploads regardless of age
+# Worker processes for background (?async=1) uploads (on SQLite they use the single writer instead)
+INGEST_WORKERS = 2
+# Seconds a running job may go without progress before ingest_worker queues it again (its worker died)
+INGEST_JOB_TIMEOUT = 10 * 60
+
+# Lifetime (seconds) of the signed tokens issued by /api/login/
+AUTH_TOKEN_MAX_AGE = 12 * 60 * 60
+
+# Rendered PDF reports (kept outside MEDIA_ROOT so they are never served publicly)
+REPORT_CACHE_DIR = os.path.join(BASE_DIR, 'report_cache')
+# Full-dataset reports: rendered in REPORT_WORKERS processes, rows fetched in chunks
+REPORT_WORKERS = 2
+REPORT_FETCH_SIZE = 2000
+REPORT_RENDER_TIMEOUT = 600
+
+# The hashing handler only observes chunks; the default handlers still store the file
+FILE_UPLOAD_HANDLERS = [
+    'api.uploadhandlers.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Response compression (api.middleware.CompressionMiddleware): brotli if installed, else gzip
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_CONTENT_TYPES = ['application/json', 'application/msgpack']
+BROTLI_QUALITY = 5
+
+# Request instrumentation (api.middleware.TimingMiddleware): Server-Timing headers and /metrics
+# (Prometheus text format), served only to these client addresses; None serves everyone
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# Sampled profiling: PROFILE_SAMPLE_RATE of requests run under cProfile and those slower than
+# PROFILE_SLOW_MS are saved to PROFILE_DIR (newest PROFILE_KEEP kept; open with pstats or snakeviz)
+PROFILE_SLOW_MS = None  # e.g. 1000; None disables profiling
+PROFILE_SAMPLE_RATE = 0.1
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_KEEP = 50
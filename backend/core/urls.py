@@ -2,14 +2,24 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from api.views import UploadCSVView, HistoryView, GeneratePDFView, RegisterView
+from api.views import (UploadCSVView, HistoryView, GeneratePDFView, RegisterView, JobStatusView,
+                       EquipmentListView, LoginView, AnalyticsView, AppendCSVView, PlotDataView, AnomaliesView,
+                       metrics)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/register/', RegisterView.as_view(), name='register'), # NEW
+    path('api/login/', LoginView.as_view(), name='login'),
     path('api/upload/', UploadCSVView.as_view(), name='upload'),
+    path('api/uploads/<int:upload_id>/append/', AppendCSVView.as_view(), name='append_csv'),
+    path('api/uploads/<int:upload_id>/equipment/', EquipmentListView.as_view(), name='equipment_list'),
+    path('api/uploads/<int:upload_id>/anomalies/', AnomaliesView.as_view(), name='anomalies'),
+    path('api/uploads/<int:upload_id>/plots/', PlotDataView.as_view(), name='plot_data'),
+    path('api/jobs/<int:job_id>/', JobStatusView.as_view(), name='job_status'),
+    path('api/analytics/', AnalyticsView.as_view(), name='analytics'),
     path('api/history/', HistoryView.as_view(), name='history'),
     path('api/pdf/<int:upload_id>/', GeneratePDFView.as_view(), name='generate_pdf'),
+    path('metrics', metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
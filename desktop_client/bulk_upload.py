@@ -0,0 +1,317 @@
+"""
+Headless bulk uploader: sends every CSV in a directory or glob to the server.
+
+    python bulk_upload.py exports/ "archive/2023-*.csv" -u alice -j 4
+
+Files go up over one pooled Session, `--jobs` at a time, streamed from disk
+like the desktop client's uploads, and are ingested as background jobs on
+the server. Connection errors, timeouts, 429 and 5xx responses are retried
+with exponential backoff. Finished files are recorded in a manifest
+(`.bulk_upload.json` next to the first input by default), so a rerun after
+an interruption skips them; a file that changed since (size or mtime) is
+sent again. A per-file and aggregate throughput summary is printed at the end.
+
+Note that the server keeps only the newest HISTORY_MAX_UPLOADS uploads per
+user; raise it before importing a large archive.
+"""
+import argparse
+import getpass
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from network import POOL_SIZE, TIMEOUT, Cancelled, MultipartFile, TokenAuth, make_session
+
+API_URL = "http://127.0.0.1:8000"
+MANIFEST_NAME = '.bulk_upload.json'
+JOB_POLL_SECONDS = 1.0
+# Give up on an ingest job that reports no progress for this long (the server requeues it after 10 minutes)
+JOB_STALL_SECONDS = 15 * 60
+RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds; doubled per attempt, with jitter
+BACKOFF_MAX = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UploadFailed(Exception):
+    """The server rejected the file; retrying won't help."""
+
+
+def error_message(res):
+    try:
+        return res.json().get('error') or f'HTTP {res.status_code}'
+    except ValueError:
+        return f'HTTP {res.status_code}'
+
+
+class FileTask:
+    """The check()/report()/wait() interface MultipartFile expects from a network.Task, without Qt."""
+
+    def __init__(self, stop):
+        self.stop = stop
+
+    def check(self):
+        if self.stop.is_set():
+            raise Cancelled()
+
+    def wait(self, seconds):
+        if self.stop.wait(seconds):
+            raise Cancelled()
+
+    def report(self, done, total=0):
+        pass
+
+
+class Manifest:
+    """{path: record} kept in a JSON file, rewritten atomically after every change."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get('files', {})
+
+    def is_done(self, path):
+        record = self.files.get(path)
+        if not record or record.get('status') != 'done':
+            return False
+        stat = os.stat(path)
+        return record['size'] == stat.st_size and record['mtime'] == stat.st_mtime
+
+    def record(self, path, **fields):
+        stat = os.stat(path)
+        with self.lock:
+            self.files[path] = dict(fields, size=stat.st_size, mtime=stat.st_mtime)
+            partial = f'{self.path}.part'
+            with open(partial, 'w') as f:
+                json.dump({"files": self.files}, f, indent=1)
+            os.replace(partial, self.path)
+
+
+class Uploader:
+    def __init__(self, base_url, username, password, jobs, retries):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.retries = retries
+        self.session = make_session(jobs)
+        self.stop = threading.Event()
+        self.login_lock = threading.Lock()
+
+    def log_in(self):
+        res = self.session.post(f'{self.base_url}/api/login/', auth=(self.username, self.password), timeout=TIMEOUT)
+        if res.status_code != 200:
+            raise UploadFailed('Invalid credentials')
+        self.session.auth = TokenAuth(res.json()['token'])
+
+    def refresh_token(self, stale):
+        # Tokens expire (AUTH_TOKEN_MAX_AGE); the first thread to notice logs in again
+        with self.login_lock:
+            if self.session.auth is stale:
+                self.log_in()
+
+    def request(self, method, path, **kwargs):
+        """One attempt; raises RetryableError for failures worth another try."""
+        auth = self.session.auth
+        try:
+            res = self.session.request(method, f'{self.base_url}{path}', timeout=TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(type(e).__name__)
+        if res.status_code == 401:
+            self.refresh_token(auth)
+            raise RetryableError('token expired', retry_after=0)
+        if res.status_code in RETRY_STATUSES:
+            retry_after = res.headers.get('Retry-After')
+            raise RetryableError(f'HTTP {res.status_code}',
+                                 retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return res
+
+    def with_retries(self, task, fn):
+        attempt = 0
+        while True:
+            task.check()
+            try:
+                return fn()
+            except RetryableError as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise UploadFailed(f'{e} (gave up after {self.retries} retries)')
+                delay = e.retry_after
+                if delay is None:
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                task.wait(delay)
+
+    def upload(self, path):
+        """Send one file and wait for its ingest job; returns the manifest fields."""
+        task = FileTask(self.stop)
+        started = time.perf_counter()
+
+        def send():
+            body = MultipartFile(path, 'file', task)
+            try:
+                res = self.request('POST', '/api/upload/?async=1', data=body,
+                                   headers={'Content-Type': body.content_type})
+            finally:
+                body.close()
+            if res.status_code != 202:
+                raise UploadFailed(error_message(res))
+            return res.json()['job_id']
+
+        job_id = self.with_retries(task, send)
+        sent = time.perf_counter()
+
+        rows, deadline = -1, 0
+        while True:
+            res = self.with_retries(task, lambda: self.request('GET', f'/api/jobs/{job_id}/'))
+            if res.status_code != 200:
+                raise UploadFailed(error_message(res))
+            job = res.json()
+            if job['state'] == 'done':
+                break
+            if job['state'] == 'failed':
+                raise UploadFailed(job['error'] or 'ingest failed')
+            if job['rows_processed'] != rows:
+                rows, deadline = job['rows_processed'], time.monotonic() + JOB_STALL_SECONDS
+            elif time.monotonic() > deadline:
+                raise UploadFailed(f'job {job_id} stopped reporting progress')
+            task.wait(JOB_POLL_SECONDS)
+
+        finished = time.perf_counter()
+        return {
+            "status": "done",
+            "upload_id": job['upload_id'],
+            "rows": job['result']['stats']['total_count'],
+            # rows the server left out as invalid (see the job result's row_errors)
+            "invalid_rows": (job['result'].get('row_errors') or {}).get('rejected_rows', 0),
+            "upload_seconds": round(sent - started, 3),
+            "seconds": round(finished - started, 3),
+        }
+
+
+def find_files(patterns):
+    """CSV paths for directories and glob patterns, in order and without duplicates."""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '**', '*.csv'), recursive=True))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+        found += [os.path.abspath(p) for p in matches if os.path.isfile(p)]
+    return list(dict.fromkeys(found))
+
+
+def default_manifest(patterns):
+    first = patterns[0]
+    base = first if os.path.isdir(first) else os.path.dirname(os.path.abspath(first))
+    return os.path.join(base, MANIFEST_NAME)
+
+
+def rate(amount, seconds):
+    return amount / seconds if seconds else 0.0
+
+
+def print_summary(files, results, wall):
+    print()
+    print(f'{"file":40} {"status":8} {"MB":>9} {"rows":>11} {"sec":>8} {"MB/s":>8} {"rows/s":>10}')
+    total_bytes = total_rows = 0
+    counts = {}
+    for path in files:
+        r = results[path]
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+        mb = r['size'] / 1e6
+        name = os.path.basename(path)
+        name = name if len(name) <= 40 else '...' + name[-37:]
+        if r['status'] == 'done':
+            total_bytes += r['size']
+            total_rows += r['rows']
+            print(f'{name:40} {"done":8} {mb:9.1f} {r["rows"]:11,} {r["seconds"]:8.1f} '
+                  f'{rate(mb, r["upload_seconds"]):8.1f} {rate(r["rows"], r["seconds"]):10,.0f}')
+        elif r['status'] == 'skipped':
+            print(f'{name:40} {"skipped":8} {mb:9.1f} {r["rows"]:11,}')
+        else:
+            print(f'{name:40} {r["status"]:8} {mb:9.1f} {r.get("error", "")}')
+    print()
+    print(', '.join(f'{n} {status}' for status, n in sorted(counts.items())))
+    # Aggregate rates are over the wall time, so they include the overlap between uploads
+    print(f'Sent {total_bytes / 1e6:,.1f} MB / {total_rows:,} rows in {wall:.1f} s: '
+          f'{rate(total_bytes / 1e6, wall):.1f} MB/s, {rate(total_rows, wall):,.0f} rows/s')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Upload a directory or glob of CSV files.')
+    parser.add_argument('paths', nargs='+', help='directories (searched recursively for *.csv) or glob patterns')
+    parser.add_argument('-u', '--user', required=True)
+    parser.add_argument('--password', default=os.environ.get('CHEMVIS_PASSWORD'),
+                        help='defaults to $CHEMVIS_PASSWORD, else prompted')
+    parser.add_argument('--url', default=API_URL)
+    parser.add_argument('-j', '--jobs', type=int, default=POOL_SIZE, help='concurrent uploads')
+    parser.add_argument('--retries', type=int, default=RETRIES)
+    parser.add_argument('--manifest', help=f'defaults to {MANIFEST_NAME} next to the first path')
+    parser.add_argument('--force', action='store_true', help='upload files the manifest lists as done')
+    args = parser.parse_args(argv)
+
+    files = find_files(args.paths)
+    if not files:
+        parser.error('no CSV files found')
+    manifest = Manifest(args.manifest or default_manifest(args.paths))
+    todo = [p for p in files if args.force or not manifest.is_done(p)]
+    print(f'{len(files)} files, {len(files) - len(todo)} already uploaded ({manifest.path})')
+
+    password = args.password or getpass.getpass(f'Password for {args.user}: ')
+    uploader = Uploader(args.url, args.user, password, args.jobs, args.retries)
+    try:
+        uploader.log_in()
+    except (requests.RequestException, UploadFailed) as e:
+        print(f'Login failed: {e}', file=sys.stderr)
+        return 1
+
+    results = {p: dict(manifest.files[p], status='skipped') for p in files if p not in todo}
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=args.jobs)
+    futures = {pool.submit(uploader.upload, path): path for path in todo}
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            try:
+                fields = future.result()
+            except Cancelled:
+                continue
+            except (UploadFailed, requests.RequestException, OSError) as e:
+                fields = {"status": "failed", "error": str(e)}
+            manifest.record(path, **fields)
+            results[path] = dict(fields, size=os.path.getsize(path))
+            if fields['status'] == 'done':
+                invalid = f", {fields['invalid_rows']:,} invalid rows left out" if fields.get('invalid_rows') else ''
+                detail = f' ({fields["rows"]:,} rows{invalid}, {fields["seconds"]:.1f} s)'
+            else:
+                detail = f': {fields["error"]}'
+            print(f'[{done}/{len(todo)}] {fields["status"]:6} {os.path.basename(path)}{detail}')
+    except KeyboardInterrupt:
+        # Unstarted files are dropped, running ones stop at their next chunk; the manifest keeps the rest
+        print('Interrupted, stopping uploads...', file=sys.stderr)
+        uploader.stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        return 130
+    pool.shutdown()
+
+    print_summary(files, results, time.perf_counter() - started)
+    return 1 if any(r['status'] == 'failed' for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+On-disk cache for the desktop client: one SQLite file in the user's config dir.
+
+Holds API responses (history, equipment pages, PDF reports) together with
+their ETags so they can be revalidated with If-None-Match, plus a password
+verifier per user so the app can start without the server. Entries are
+scoped to the logged-in user, and once the stored bodies exceed `max_bytes`
+the least recently used ones are evicted.
+"""
+import hashlib
+import hmac
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+APP_DIR = 'chemical-visualizer'
+MAX_BYTES = 256 * 1024 * 1024
+PASSWORD_ITERATIONS = 200_000
+
+Entry = namedtuple('Entry', 'body content_type etag')
+
+
+def config_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    return os.path.join(base, APP_DIR)
+
+
+def password_hash(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_ITERATIONS)
+
+
+class LocalCache:
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        path = path or os.path.join(config_dir(), 'cache.sqlite3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # One connection shared by the worker threads; the lock serializes them
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.user = ''
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, etag TEXT, content_type TEXT,
+                body BLOB, size INTEGER, accessed REAL)''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS logins (
+                username TEXT PRIMARY KEY, salt BLOB, hash BLOB)''')
+
+    def scoped(self, key):
+        return f'{self.user}/{key}'
+
+    def get(self, key):
+        key = self.scoped(key)
+        with self.lock, self.db:
+            row = self.db.execute('SELECT body, content_type, etag FROM entries WHERE key = ?', (key,)).fetchone()
+            if row:
+                self.db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+        return Entry(*row) if row else None
+
+    def put(self, key, body, content_type='', etag=None):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO entries (key, etag, content_type, body, size, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                (self.scoped(key), etag, content_type, body, len(body), time.time())
+            )
+            self.evict()
+
+    def evict(self):
+        # Least recently used first, until the bodies fit in max_bytes again
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    # Offline start: the password is checked against a salted PBKDF2 hash, never stored
+
+    def remember_login(self, username, password):
+        salt = os.urandom(16)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO logins (username, salt, hash) VALUES (?, ?, ?)',
+                            (username, salt, password_hash(password, salt)))
+
+    def check_login(self, username, password):
+        with self.lock:
+            row = self.db.execute('SELECT salt, hash FROM logins WHERE username = ?', (username,)).fetchone()
+        return bool(row) and hmac.compare_digest(password_hash(password, row[0]), row[1])
@@ -0,0 +1,251 @@
+"""
+Charts for one upload: type distribution, flowrate vs pressure and
+temperature histograms per type.
+
+Each chart has its own small canvas, so an update redraws only the chart
+whose data changed, and its axes and artists are created once and updated
+in place (set_height, set_data), so switching uploads never clears a figure
+or re-runs the layout. The flowrate/pressure chart takes the points of
+small uploads and the server's 2D bin counts (drawn as one image) for large
+ones, so its cost doesn't grow with the row count. Types keep one colour
+across the three charts; the coloured distribution bars double as the key,
+which saves drawing a legend.
+
+Charts waiting for a redraw are drawn one per event loop turn, so input is
+handled in between. The hover readout and the marker for the selected table
+row are animated artists, blitted over a cached background instead of
+redrawing the chart.
+"""
+import numpy as np
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QHBoxLayout, QWidget
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+BACKGROUND = '#f4f6f9'
+AXES_BACKGROUND = '#f8fafc'
+TYPE_COLORS = ['#667eea', '#ed8936', '#48bb78', '#e53e3e', '#9f7aea',
+               '#38b2ac', '#d69e2e', '#ed64a6', '#4a5568', '#4299e1']
+
+
+def type_color(i):
+    return TYPE_COLORS[i % len(TYPE_COLORS)]
+
+
+def chart(title):
+    figure = Figure(figsize=(4, 3.2), facecolor=BACKGROUND)
+    # Fixed margins: tight_layout on every update costs more than the drawing
+    figure.subplots_adjust(left=0.15, right=0.96, bottom=0.16, top=0.9)
+    ax = figure.add_subplot(111)
+    ax.set_facecolor(AXES_BACKGROUND)
+    # A fixed title position skips the tick label measuring done on every draw otherwise
+    ax.set_title(title, fontsize=10, color='#2d3748', y=1.0, pad=6)
+    ax.tick_params(labelsize=8)
+    ax.locator_params(nbins=5)
+    return FigureCanvas(figure), ax
+
+
+class ChartPanel(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.dist_canvas, self.ax_dist = chart('Type distribution')
+        self.scatter_canvas, self.ax_scatter = chart('Flowrate vs pressure')
+        self.temp_canvas, self.ax_temp = chart('Temperature by type')
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+        for canvas in (self.dist_canvas, self.scatter_canvas, self.temp_canvas):
+            layout.addWidget(canvas)
+        self.ax_scatter.set_xlabel('Flowrate', fontsize=8)
+        self.ax_scatter.set_ylabel('Pressure', fontsize=8)
+
+        self.bars = []
+        self.bar_labels = []
+        # One marker line per type: Agg stamps a cached marker, much cheaper than a scatter collection
+        self.point_lines = []
+        self.point_xy = np.empty((0, 2))
+        self.point_types = np.empty(0, dtype=object)
+        self.density = self.ax_scatter.imshow(np.zeros((1, 1)), origin='lower', aspect='auto',
+                                              cmap='Blues', interpolation='nearest', visible=False)
+        self.cells = None  # (x_edges, y_edges, counts) of the image, for the readout
+        self.steps = []
+        self.codes = {}  # type -> colour index, shared by the three charts
+
+        # Overlay: excluded from normal draws, blitted by draw_overlay()
+        self.marker, = self.ax_scatter.plot([], [], 'o', ms=10, mfc='none', mec='#e53e3e', mew=2, animated=True)
+        self.readout = self.ax_scatter.annotate(
+            '', xy=(0, 0), xytext=(8, 8), textcoords='offset points', fontsize=8, animated=True,
+            bbox=dict(boxstyle='round', fc='white', ec='#cbd5e0'))
+        self.background = None
+        self.stale = []
+        self.draw_timer = QTimer(self)
+        self.draw_timer.setSingleShot(True)
+        self.draw_timer.timeout.connect(self.draw_next)
+        self.scatter_canvas.mpl_connect('draw_event', self.on_draw)
+        self.scatter_canvas.mpl_connect('motion_notify_event', self.on_motion)
+
+    def type_codes(self, types):
+        for eq_type in sorted(set(types) - set(self.codes)):
+            self.codes[eq_type] = len(self.codes)
+        return self.codes
+
+    def set_distribution(self, dist):
+        names = list(dist)
+        counts = [dist[n] for n in names]
+        self.codes = {}
+        codes = self.type_codes(names)
+        if len(names) != len(self.bars):
+            for artist in self.bars + self.bar_labels:
+                artist.remove()
+            self.bars = list(self.ax_dist.bar(range(len(names)), [0] * len(names), width=0.6))
+            self.bar_labels = [self.ax_dist.text(i, 0, '', ha='center', va='bottom', fontsize=8, color='#2d3748')
+                               for i in range(len(names))]
+        for bar, label, name, count in zip(self.bars, self.bar_labels, names, counts):
+            bar.set_height(count)
+            bar.set_color(type_color(codes[name]))
+            label.set_y(count)
+            label.set_text(f'{count:,}')
+        self.ax_dist.set_xticks(range(len(names)))
+        self.ax_dist.set_xticklabels(names)
+        self.ax_dist.set_xlim(-0.5, max(len(names), 1) - 0.5)
+        self.ax_dist.set_ylim(0, max(counts, default=1) * 1.15 or 1)
+        self.redraw(self.dist_canvas)
+
+    def set_plot_data(self, data):
+        """Data from /api/uploads/<id>/plots/ (see api.plots on the server)."""
+        types = sorted(set(data['temperature']['counts']) | set((data['points'] or {}).get('type', [])))
+        codes = self.type_codes(types)
+        self.set_scatter(data['points'], data['density'], types, codes)
+        self.set_temperature(data['temperature'], codes)
+
+    def set_scatter(self, points, density, types, codes):
+        self.marker.set_data([], [])
+        self.readout.set_visible(False)
+        self.cells = None
+        if points is not None:
+            self.point_xy = np.column_stack([np.asarray(points['flowrate'], dtype=float),
+                                             np.asarray(points['pressure'], dtype=float)])
+            self.point_types = np.asarray(points['type'], dtype=object)
+        else:
+            self.point_xy = np.empty((0, 2))
+            self.point_types = np.empty(0, dtype=object)
+
+        shown = types if points is not None else []
+        while len(self.point_lines) < len(shown):
+            line, = self.ax_scatter.plot([], [], 'o', ms=2, mew=0, linestyle='none')
+            self.point_lines.append(line)
+        for line, eq_type in zip(self.point_lines, shown):
+            mine = self.point_types == eq_type
+            line.set_data(self.point_xy[mine, 0], self.point_xy[mine, 1])
+            line.set_color(type_color(codes[eq_type]))
+            line.set_visible(True)
+        for line in self.point_lines[len(shown):]:
+            line.set_visible(False)
+        if len(self.point_xy):
+            for setter, values in ((self.ax_scatter.set_xlim, self.point_xy[:, 0]),
+                                   (self.ax_scatter.set_ylim, self.point_xy[:, 1])):
+                lo, hi = float(values.min()), float(values.max())
+                pad = (hi - lo) * 0.05 or 0.5
+                setter(lo - pad, hi + pad)
+
+        self.density.set_visible(density is not None)
+        if density is not None:
+            x_edges, y_edges = np.asarray(density['flowrate']), np.asarray(density['pressure'])
+            counts = np.asarray(density['counts'])
+            # Rows are pressure in the image; empty cells stay transparent
+            self.density.set_data(np.ma.masked_equal(counts.T, 0))
+            self.density.set_extent((x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]))
+            self.density.set_norm(LogNorm(vmin=1, vmax=max(int(counts.max()), 2)))
+            self.cells = (x_edges, y_edges, counts)
+            self.ax_scatter.set_xlim(x_edges[0], x_edges[-1])
+            self.ax_scatter.set_ylim(y_edges[0], y_edges[-1])
+        self.redraw(self.scatter_canvas)
+
+    def set_temperature(self, temperature, codes):
+        # One step outline per type, reused across uploads
+        edges = np.asarray(temperature['edges'], dtype=float)
+        histograms = temperature['counts']
+        while len(self.steps) < len(histograms):
+            self.steps.append(self.ax_temp.stairs([0], [0, 1], baseline=None, linewidth=1.5))
+        top = 0
+        for step, (eq_type, values) in zip(self.steps, histograms.items()):
+            step.set_data(values, edges)
+            step.set_edgecolor(type_color(codes[eq_type]))
+            step.set_visible(True)
+            top = max(top, max(values, default=0))
+        for step in self.steps[len(histograms):]:
+            step.set_visible(False)
+        if len(edges):
+            self.ax_temp.set_xlim(edges[0], edges[-1])
+        self.ax_temp.set_ylim(0, top * 1.1 or 1)
+        self.redraw(self.temp_canvas)
+
+    def clear_plots(self):
+        self.set_plot_data({"points": None, "density": None, "temperature": {"edges": [], "counts": {}}})
+
+    def redraw(self, canvas):
+        if canvas not in self.stale:
+            self.stale.append(canvas)
+        self.draw_timer.start(0)
+
+    def draw_next(self):
+        if self.stale:
+            self.stale.pop(0).draw()
+        if self.stale:
+            self.draw_timer.start(0)
+
+    # Overlay: restore the cached background and redraw only the animated artists
+
+    def on_draw(self, event):
+        self.background = self.scatter_canvas.copy_from_bbox(self.scatter_canvas.figure.bbox)
+        self.draw_overlay(blit=False)
+
+    def draw_overlay(self, blit=True):
+        # A queued redraw would blit over a stale background; on_draw adds the overlay then
+        if self.background is None or (blit and self.scatter_canvas in self.stale):
+            return
+        canvas = self.scatter_canvas
+        if blit:
+            canvas.restore_region(self.background)
+        self.ax_scatter.draw_artist(self.marker)
+        self.ax_scatter.draw_artist(self.readout)
+        if blit:
+            canvas.blit(canvas.figure.bbox)
+
+    def highlight(self, flowrate, pressure):
+        """Mark a table row in the flowrate/pressure chart."""
+        if flowrate is None or pressure is None:
+            self.marker.set_data([], [])
+        else:
+            self.marker.set_data([flowrate], [pressure])
+        self.draw_overlay()
+
+    def on_motion(self, event):
+        text = self.readout_text(event) if event.inaxes is self.ax_scatter else None
+        if text is None and not self.readout.get_visible():
+            return
+        self.readout.set_visible(text is not None)
+        if text is not None:
+            self.readout.xy = (event.xdata, event.ydata)
+            self.readout.set_text(text)
+        self.draw_overlay()
+
+    def readout_text(self, event):
+        if self.cells is not None:
+            x_edges, y_edges, counts = self.cells
+            i = np.searchsorted(x_edges, event.xdata, side='right') - 1
+            j = np.searchsorted(y_edges, event.ydata, side='right') - 1
+            if 0 <= i < counts.shape[0] and 0 <= j < counts.shape[1]:
+                return f'{counts[i, j]:,} rows\n{x_edges[i]:.4g}–{x_edges[i + 1]:.4g}, {y_edges[j]:.4g}–{y_edges[j + 1]:.4g}'
+            return None
+        if not len(self.point_xy):
+            return None
+        # Nearest point in screen space, within a few pixels of the cursor
+        screen = self.ax_scatter.transData.transform(self.point_xy)
+        distance = np.hypot(screen[:, 0] - event.x, screen[:, 1] - event.y)
+        nearest = int(distance.argmin())
+        if distance[nearest] > 6:
+            return None
+        x, y = self.point_xy[nearest]
+        return f'{self.point_types[nearest]}: {x:.4g}, {y:.4g}'
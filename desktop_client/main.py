@@ -1,16 +1,42 @@
+import os
 import sys
-import requests
+import time
 import webbrowser
+import json
+import requests
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                             QPushButton, QFileDialog, QLabel, QTableWidget, QTableWidgetItem, 
+                             QPushButton, QFileDialog, QLabel, QTableView, 
                              QHBoxLayout, QLineEdit, QDialog, QFormLayout, QMessageBox, 
-                             QHeaderView, QListWidget, QListWidgetItem, QFrame)
+                             QHeaderView, QListWidget, QListWidgetItem, QFrame, QProgressBar,
+                             QProgressDialog)
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-import matplotlib.pyplot as plt
+
+from cache import Entry, LocalCache
+from charts import ChartPanel
+from network import ApiClient
+from table_model import EquipmentTableModel
+
+try:
+    import msgpack
+except ImportError:  # column-oriented JSON is nearly as small, just slower to decode
+    msgpack = None
 
 API_URL = "http://127.0.0.1:8000"
+JOB_POLL_MS = 1000
+# Give up on an ingest job that reports no progress for this long (the server requeues it after 10 minutes)
+JOB_STALL_SECONDS = 15 * 60
+# Equipment rows as one array per column instead of one object per row
+ROWS_ACCEPT = 'application/msgpack' if msgpack else 'application/vnd.equipment.columns+json'
+# Rows per request when the table scrolls past what it has (the server caps this at 5000)
+PAGE_ROWS = 5000
+# Timeouts when a cached copy exists: a slow or unreachable server falls back to the cache
+REVALIDATE_TIMEOUT = (2, 5)
+LOGIN_TIMEOUT = (5, 15)
+# Progress bars run 0..PROGRESS_STEPS so multi-GB byte counts fit in an int
+PROGRESS_STEPS = 1000
+# Problems listed when the server skipped rows of an upload (it reports up to 100)
+ROW_ERRORS_SHOWN = 10
 
 STYLESHEET = """
     QMainWindow, QDialog { background-color: #f4f6f9; }
@@ -25,19 +51,46 @@ STYLESHEET = """
     QListWidget { background-color: white; border: 1px solid #e2e8f0; border-radius: 8px; color: #2d3748; }
     QListWidget::item { padding: 10px; border-bottom: 1px solid #edf2f7; }
     QListWidget::item:selected { background-color: #ebf4ff; color: #2d3748; }
-    QTableWidget { border: 1px solid #e2e8f0; background-color: white; color: #2d3748; gridline-color: #e2e8f0; selection-background-color: #ebf4ff; selection-color: #2d3748; }
+    QTableView { border: 1px solid #e2e8f0; background-color: white; color: #2d3748; gridline-color: #e2e8f0; selection-background-color: #ebf4ff; selection-color: #2d3748; }
     QHeaderView::section { background-color: #edf2f7; padding: 5px; border: 1px solid #e2e8f0; font-weight: bold; color: #4a5568; }
     QFrame#StatCard { background-color: white; border: 1px solid #e2e8f0; border-radius: 8px; }
     QLabel#StatValue { font-size: 18px; font-weight: bold; color: #667eea; }
     QLabel#StatLabel { font-size: 12px; color: #718096; font-weight: bold; text-transform: uppercase; }
 """
 
+# Every request goes through here: worker threads + one keep-alive Session
+api = ApiClient(API_URL)
+# Responses kept on disk (~/.config/chemical-visualizer/cache.sqlite3 on Linux)
+cache = LocalCache()
+
+def decode_rows(entry):
+    """Cached body of a response requested with ROWS_ACCEPT."""
+    if entry.content_type.startswith('application/msgpack'):
+        return msgpack.unpackb(entry.body)
+    return json.loads(entry.body)
+
+def as_columns(rows):
+    # Job results still hold JSON row objects; listings come back as columns
+    if isinstance(rows, dict):
+        return rows
+    return {key: [row[key] for row in rows] for key in (rows[0] if rows else {})}
+
+def progress_step(done, total):
+    return int(done * PROGRESS_STEPS / total) if total else 0
+
+def row_errors_text(report):
+    # {"rejected_rows", "errors": [{line, column, reason}], "truncated"} from the server
+    lines = [f"Line {e['line']}: " + (f"{e['column']}: " if e['column'] else '') + e['reason']
+             for e in report['errors'][:ROW_ERRORS_SHOWN]]
+    if report['truncated'] or len(report['errors']) > ROW_ERRORS_SHOWN:
+        lines.append("...")
+    return f"{report['rejected_rows']:,} rows were skipped:\n" + "\n".join(lines)
+
 class HistoryDialog(QDialog):
-    def __init__(self, history_data, auth, parent=None):
+    def __init__(self, history_data, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Recent Uploads")
         self.resize(500, 400)
-        self.auth = auth
         self.setStyleSheet(STYLESHEET)
         
         layout = QVBoxLayout(self)
@@ -65,6 +118,13 @@ class HistoryDialog(QDialog):
             
             h_layout.addStretch()
             
+            btn_view = QPushButton("View")
+            btn_view.setObjectName("Secondary")
+            btn_view.setFixedSize(60, 30)
+            btn_view.setStyleSheet("font-size: 11px; padding: 5px;")
+            btn_view.clicked.connect(lambda checked, entry=h: self.view_upload(entry))
+            h_layout.addWidget(btn_view)
+
             btn_pdf = QPushButton("Download PDF")
             btn_pdf.setFixedSize(100, 30)
             btn_pdf.setStyleSheet("font-size: 11px; padding: 5px;")
@@ -80,19 +140,42 @@ class HistoryDialog(QDialog):
         btn_close.clicked.connect(self.accept)
         layout.addWidget(btn_close)
 
+    def view_upload(self, entry):
+        self.parent().show_upload(entry)
+        self.accept()
+
     def download_pdf(self, upload_id):
         path, _ = QFileDialog.getSaveFileName(self, "Save PDF", f"report_{upload_id}.pdf", "PDF Files (*.pdf)")
-        if path:
-            try:
-                res = requests.get(f"{API_URL}/api/pdf/{upload_id}/", auth=self.auth)
-                if res.status_code == 200:
-                    with open(path, 'wb') as f:
-                        f.write(res.content)
-                    QMessageBox.information(self, "Success", "PDF Saved Successfully")
-                else:
-                    QMessageBox.warning(self, "Error", "Failed to download PDF")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", str(e))
+        if not path: return
+        # Streamed to disk on a worker thread; the dialog shows progress and can cancel it
+        progress = QProgressDialog("Downloading report...", "Cancel", 0, 0, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        task = api.submit(
+            lambda task: download_report(task, upload_id, path),
+            on_done=lambda status: self.pdf_saved(progress, status),
+            on_error=lambda message: self.pdf_failed(progress, message),
+            on_progress=lambda done, total: self.pdf_progress(progress, done, total),
+            on_cancel=progress.reset
+        )
+        progress.canceled.connect(task.cancel)
+
+    def pdf_progress(self, progress, done, total):
+        if total:
+            progress.setRange(0, PROGRESS_STEPS)
+            progress.setValue(progress_step(done, total))
+        progress.setLabelText(f"Downloading report... {done / 1e6:.1f} MB")
+
+    def pdf_saved(self, progress, status):
+        progress.reset()
+        if status == 200:
+            QMessageBox.information(self, "Success", "PDF Saved Successfully")
+        else:
+            QMessageBox.warning(self, "Error", "Failed to download PDF")
+
+    def pdf_failed(self, progress, message):
+        progress.reset()
+        QMessageBox.critical(self, "Error", message)
 
 class SignupDialog(QDialog):
     def __init__(self):
@@ -118,15 +201,20 @@ class SignupDialog(QDialog):
         username = self.user_in.text()
         password = self.pass_in.text()
         if not username or not password: return
-        try:
-            response = requests.post(f"{API_URL}/api/register/", 
-                                   data={"username": username, "password": password})
-            if response.status_code == 201:
-                QMessageBox.information(self, "Success", "Account Created")
-                self.accept()
-            else:
-                QMessageBox.critical(self, "Error", "Username exists.")
-        except: pass
+        self.btn_create.setEnabled(False)
+        api.submit(
+            lambda task: api.post(task, '/api/register/', data={"username": username, "password": password}),
+            on_done=self.registered,
+            on_error=lambda message: self.btn_create.setEnabled(True)
+        )
+
+    def registered(self, response):
+        if response.status_code == 201:
+            QMessageBox.information(self, "Success", "Account Created")
+            self.accept()
+        else:
+            QMessageBox.critical(self, "Error", "Username exists.")
+            self.btn_create.setEnabled(True)
 
 class LoginDialog(QDialog):
     def __init__(self):
@@ -165,7 +253,9 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle("Chemical Equipment Visualizer")
         self.resize(1200, 850)
-        self.auth = None
+        # Upload or job wait the Cancel button applies to
+        self.active_task = None
+        self.upload_id = None  # upload shown in the table and charts
         self.setStyleSheet(STYLESHEET)
         self.login()
         
@@ -174,12 +264,32 @@ class MainWindow(QMainWindow):
         if dialog.exec_() == QDialog.Accepted:
             username, password = dialog.get_credentials()
             if not username or not password: sys.exit()
-            try:
-                self.auth = (username, password)
-                requests.get(f"{API_URL}/api/history/", auth=self.auth)
-                self.setup_ui()
-            except: sys.exit()
+            # The window shows up once the server (or, offline, the local cache) has answered
+            api.submit(
+                lambda task: log_in(task, username, password),
+                on_done=lambda result: self.logged_in(username, result),
+                on_error=lambda message: self.login_failed("Could not reach the server")
+            )
         else: sys.exit()
+
+    def logged_in(self, username, result):
+        if not result['offline'] and not result['token']:
+            self.login_failed("Invalid Credentials")
+            return
+        cache.user = username
+        if result['offline']:
+            api.offline = True
+        else:
+            api.set_token(result['token'])
+        self.setup_ui()
+        self.show()
+        if api.offline:
+            self.lbl_status.setText("Offline: showing cached uploads")
+            self.btn_upload.setEnabled(False)
+
+    def login_failed(self, message):
+        QMessageBox.critical(None, "Error", message)
+        QApplication.quit()
     
     def setup_ui(self):
         central_widget = QWidget()
@@ -192,9 +302,19 @@ class MainWindow(QMainWindow):
         title = QLabel("Chemical Equipment Visualizer")
         title.setStyleSheet("font-size: 20px; font-weight: bold;")
         self.lbl_status = QLabel("System Ready")
+        self.progress = QProgressBar()
+        self.progress.setFixedWidth(200)
+        self.progress.setTextVisible(False)
+        self.progress.hide()
+        self.btn_cancel = QPushButton("Cancel")
+        self.btn_cancel.setObjectName("Secondary")
+        self.btn_cancel.clicked.connect(self.cancel_transfer)
+        self.btn_cancel.hide()
         header.addWidget(title)
         header.addStretch()
         header.addWidget(self.lbl_status)
+        header.addWidget(self.progress)
+        header.addWidget(self.btn_cancel)
         layout.addLayout(header)
         
         btns = QHBoxLayout()
@@ -217,7 +337,7 @@ class MainWindow(QMainWindow):
 
         self.stats_layout = QHBoxLayout()
         self.stats_labels = {}
-        for key in ["Total Count", "Avg Flowrate", "Avg Pressure", "Avg Temperature"]:
+        for key in ["Total Count", "Avg Flowrate", "Avg Pressure", "Avg Temperature", "Anomalies"]:
             card = QFrame()
             card.setObjectName("StatCard")
             card_layout = QVBoxLayout(card)
@@ -238,27 +358,84 @@ class MainWindow(QMainWindow):
             
         layout.addLayout(self.stats_layout)
 
-        self.figure = plt.figure(figsize=(6, 3))
-        self.figure.patch.set_facecolor('#f4f6f9')
-        self.canvas = FigureCanvas(self.figure)
-        layout.addWidget(self.canvas)
+        # Created once; uploads update its artists in place
+        self.charts = ChartPanel()
+        layout.addWidget(self.charts)
 
-        self.table = QTableWidget()
+        # Model/view: only visible cells are ever rendered, further pages load on scroll
+        self.table = QTableView()
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(24)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setSortingEnabled(True)
         layout.addWidget(self.table)
 
     def upload_file(self):
         fname, _ = QFileDialog.getOpenFileName(self, 'Open CSV', '', 'CSV Files (*.csv)')
         if fname:
             self.lbl_status.setText("Uploading...")
+            # Streamed from disk on a worker thread, so the window stays responsive
+            self.start_transfer(lambda task: api.upload(task, '/api/upload/?async=1', fname),
+                                self.uploaded, self.upload_progress)
+
+    def start_transfer(self, fn, on_done, on_progress):
+        self.btn_upload.setEnabled(False)
+        self.progress.setRange(0, 0)
+        self.progress.show()
+        self.btn_cancel.show()
+        self.active_task = api.submit(fn, on_done=on_done, on_progress=on_progress,
+                                      on_error=lambda message: self.end_transfer("Error"),
+                                      on_cancel=lambda: self.end_transfer("Cancelled"))
+
+    def end_transfer(self, status):
+        self.active_task = None
+        self.progress.hide()
+        self.btn_cancel.hide()
+        self.btn_upload.setEnabled(True)
+        self.lbl_status.setText(status)
+
+    def cancel_transfer(self):
+        if self.active_task:
+            self.active_task.cancel()
+
+    def upload_progress(self, sent, total):
+        self.progress.setRange(0, PROGRESS_STEPS)
+        self.progress.setValue(progress_step(sent, total))
+        self.lbl_status.setText(f"Uploading... {sent / 1e6:.1f} / {total / 1e6:.1f} MB")
+
+    def uploaded(self, res):
+        if res.status_code != 202:
+            self.end_transfer("Failed")
             try:
-                with open(fname, 'rb') as f:
-                    res = requests.post(f'{API_URL}/api/upload/', files={'file': f}, auth=self.auth)
-                    if res.status_code == 200:
-                        self.update_ui(res.json())
-                        self.lbl_status.setText("Upload Complete")
-                    else: self.lbl_status.setText("Failed")
-            except: self.lbl_status.setText("Error")
+                error = res.json()['error']
+            except (ValueError, KeyError):
+                error = f"HTTP {res.status_code}"
+            QMessageBox.warning(self, "Upload Failed", error)
+            return
+        job_id = res.json()['job_id']
+        self.lbl_status.setText("Processing...")
+        self.start_transfer(lambda task: wait_for_job(task, job_id), self.job_finished, self.job_progress)
+
+    def job_progress(self, rows, _):
+        self.progress.setRange(0, 0)
+        self.lbl_status.setText(f"Processing... {rows:,} rows")
+
+    def job_finished(self, job):
+        if job['state'] == 'done':
+            self.update_ui(job['result'])
+            report = job['result'].get('row_errors') or {}
+            if report.get('rejected_rows'):
+                self.end_transfer(f"Upload Complete ({report['rejected_rows']:,} rows skipped)")
+                QMessageBox.warning(self, "Rows Skipped", row_errors_text(report))
+            else:
+                self.end_transfer("Upload Complete")
+        else:
+            self.end_transfer("Failed")
+            message = job['error'] or "Upload failed"
+            if job.get('row_errors'):
+                message += "\n\n" + row_errors_text(job['row_errors'])
+            QMessageBox.warning(self, "Upload Failed", message)
 
     def update_ui(self, data):
         stats = data['stats']
@@ -266,44 +443,192 @@ class MainWindow(QMainWindow):
         self.stats_labels["Avg Flowrate"].setText(f"{stats['avg_flowrate']:.2f}")
         self.stats_labels["Avg Pressure"].setText(f"{stats['avg_pressure']:.2f}")
         self.stats_labels["Avg Temperature"].setText(f"{stats['avg_temperature']:.2f}")
+        # Rows with a measurement outside their type's usual range (highlighted in the table)
+        self.stats_labels["Anomalies"].setText(str(data.get('anomalies', {}).get('count', '-')))
 
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
-        ax.set_facecolor('#f8fafc')
-        dist = data['distribution']
-        bars = ax.bar(dist.keys(), dist.values(), color='#667eea', width=0.6)
-        for bar in bars:
-            ax.text(bar.get_x() + bar.get_width()/2., bar.get_height(),
-                    f'{int(bar.get_height())}', ha='center', va='bottom', color='#2d3748')
-        self.figure.tight_layout()
-        self.canvas.draw()
-        
-        rows = data['data']
-        if not rows: return
-        self.table.setColumnCount(len(rows[0]))
-        self.table.setRowCount(len(rows))
-        self.table.setHorizontalHeaderLabels(rows[0].keys())
-        for i, row in enumerate(rows):
-            for j, val in enumerate(row.values()):
-                self.table.setItem(i, j, QTableWidgetItem(str(val)))
+        self.charts.set_distribution(data['distribution'])
+        upload_id = data['id']
+        self.upload_id = upload_id
+        # Points or 2D bins, whichever the server sends for this upload's size
+        self.charts.clear_plots()
+        api.submit(lambda task: fetch_plots(task, upload_id),
+                   on_done=lambda plots: self.plots_loaded(upload_id, plots))
+
+        model = EquipmentTableModel(
+            as_columns(data['data']), data.get('next_cursor'),
+            lambda cursor, on_done, on_error: api.submit(
+                lambda task: fetch_rows(task, upload_id, cursor),
+                on_done=lambda page: on_done(page['results'], page['next_cursor'], page.get('anomaly_flags')),
+                on_error=on_error
+            ),
+            flags=data.get('anomaly_flags')
+        )
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.table.setModel(model)
+        self.table_model = model  # the view doesn't own it; the previous model is freed here
+        self.table.selectionModel().currentRowChanged.connect(self.row_selected)
+
+    def plots_loaded(self, upload_id, plots):
+        # A slow response for an upload that is no longer shown is dropped
+        if upload_id == self.upload_id:
+            self.charts.set_plot_data(plots)
+
+    def row_selected(self, current, previous):
+        if not current.isValid():
+            self.charts.highlight(None, None)
+            return
+        row = self.table_model.row_values(current.row())
+        self.charts.highlight(row.get('Flowrate'), row.get('Pressure'))
+
+    def show_upload(self, h):
+        # History entries carry the stats/distribution computed at ingest; only rows are fetched
+        api.submit(lambda task: fetch_rows(task, h['id']),
+                   on_done=lambda page: self.show_rows(h, page),
+                   on_error=lambda message: self.show_rows(h, {}))
+
+    def show_rows(self, h, page):
+        self.update_ui({
+            "id": h['id'],
+            "stats": {
+                "total_count": h['count'],
+                "avg_flowrate": h['avg_flowrate'],
+                "avg_pressure": h['avg_pressure'],
+                "avg_temperature": h['avg_temperature']
+            },
+            "distribution": h.get('distribution', {}),
+            "anomalies": h.get('anomalies', {}),
+            "data": page.get('results', {}),
+            "anomaly_flags": page.get('anomaly_flags'),
+            "next_cursor": page.get('next_cursor')
+        })
+        self.lbl_status.setText(f"Viewing {h.get('filename', 'upload')}")
 
     def show_history(self):
+        # Revalidated against the cached copy: 304 when nothing changed, cache when offline
+        api.submit(lambda task: json.loads(cached_get(task, 'history', '/api/history/').body),
+                   on_done=self.history_loaded,
+                   on_error=lambda message: QMessageBox.critical(self, "Error", "Failed to fetch history"))
+
+    def history_loaded(self, history):
+        if not history:
+            QMessageBox.information(self, "History", "No uploads found.")
+            return
+
+        dlg = HistoryDialog(history, self)
+        dlg.exec_()
+
+    def closeEvent(self, event):
+        # Stop in-flight transfers so the pool's threads can finish
+        api.cancel_all()
+        api.pool.waitForDone(2000)
+        super().closeEvent(event)
+
+# Task functions: run on the pool, never touch widgets
+
+def log_in(task, username, password):
+    try:
+        res = api.post(task, '/api/login/', auth=(username, password), timeout=LOGIN_TIMEOUT)
+    except requests.RequestException:
+        # Server unreachable: fall back to the cache if this user has logged in here before
+        if cache.check_login(username, password):
+            return {"offline": True, "token": None}
+        raise
+    if res.status_code != 200:
+        return {"offline": False, "token": None}
+    # Slow on purpose (PBKDF2), hence done here rather than on the GUI thread
+    cache.remember_login(username, password)
+    return {"offline": False, "token": res.json()['token']}
+
+def cached_get(task, key, path, **kwargs):
+    """
+    GET through the local cache: a cached copy is revalidated with
+    If-None-Match (a short timeout, so a slow server falls back to it) and
+    served as is when offline. Returns a cache Entry.
+    """
+    entry = cache.get(key)
+    if api.offline:
+        if entry is None:
+            raise RuntimeError("Not available offline")
+        return entry
+    headers = dict(kwargs.pop('headers', {}))
+    if entry is not None:
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        kwargs['timeout'] = REVALIDATE_TIMEOUT
+    try:
+        res = api.get(task, path, headers=headers, **kwargs)
+    except requests.RequestException:
+        if entry is None:
+            raise
+        return entry
+    if res.status_code == 304 and entry is not None:
+        return entry
+    if res.status_code != 200:
+        raise RuntimeError(f"HTTP {res.status_code}")
+    entry = Entry(res.content, res.headers.get('Content-Type', ''), res.headers.get('ETag'))
+    cache.put(key, *entry)
+    return entry
+
+def download_report(task, upload_id, dest):
+    """
+    Save the PDF report to `dest`, reusing the cached copy while the server
+    answers 304 (or can't be reached). Returns the HTTP status.
+    """
+    key = f'pdf/{upload_id}'
+    entry = cache.get(key)
+    res = None
+    if not api.offline:
+        headers = {'If-None-Match': entry.etag} if entry and entry.etag else {}
         try:
-            res = requests.get(f'{API_URL}/api/history/', auth=self.auth)
-            history = res.json()
-            if not history:
-                QMessageBox.information(self, "History", "No uploads found.")
-                return
-            
-            dlg = HistoryDialog(history, self.auth, self)
-            dlg.exec_()
-            
-        except:
-            QMessageBox.critical(self, "Error", "Failed to fetch history")
+            # Normal timeout: after an append the server re-renders before answering
+            res = api.download(task, f'/api/pdf/{upload_id}/', dest, headers=headers)
+        except requests.RequestException:
+            if entry is None:
+                raise
+    if res is None or res.status_code == 304:
+        if entry is None:
+            raise RuntimeError("Report not available offline")
+        write_file(dest, entry.body)
+        return 200
+    if res.status_code == 200:
+        with open(dest, 'rb') as f:
+            cache.put(key, f.read(), 'application/pdf', res.headers.get('ETag'))
+    return res.status_code
+
+def write_file(path, data):
+    partial = f'{path}.part'
+    with open(partial, 'wb') as f:
+        f.write(data)
+    os.replace(partial, path)
+
+def wait_for_job(task, job_id):
+    # Poll until the ingest worker finishes, reporting rows processed
+    rows, deadline = -1, 0
+    while True:
+        job = api.get(task, f'/api/jobs/{job_id}/').json()
+        if job['state'] in ('done', 'failed'):
+            return job
+        if job['rows_processed'] != rows:
+            rows, deadline = job['rows_processed'], time.monotonic() + JOB_STALL_SECONDS
+        elif time.monotonic() > deadline:
+            return {'state': 'failed', 'error': "The server stopped reporting progress on this upload"}
+        task.report(rows)
+        task.wait(JOB_POLL_MS / 1000)
+
+def fetch_rows(task, upload_id, cursor=None):
+    # One page as {results, next_cursor}; decoded here so MessagePack/JSON parsing stays off the GUI thread
+    params = {'limit': PAGE_ROWS}
+    if cursor is not None:
+        params['cursor'] = cursor
+    entry = cached_get(task, f'rows/{upload_id}/{cursor}/{PAGE_ROWS}/{ROWS_ACCEPT}',
+                       f'/api/uploads/{upload_id}/equipment/', params=params, headers={'Accept': ROWS_ACCEPT})
+    return decode_rows(entry)
+
+def fetch_plots(task, upload_id):
+    return json.loads(cached_get(task, f'plots/{upload_id}', f'/api/uploads/{upload_id}/plots/').body)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     app.setFont(QFont("Segoe UI", 10))
-    window = MainWindow()
-    window.show()
+    window = MainWindow()  # shows itself after login
     sys.exit(app.exec_())
@@ -0,0 +1,220 @@
+"""
+Background networking for the desktop client.
+
+Every call runs as a QRunnable on one QThreadPool, so the GUI thread never
+waits on the network. All calls share one requests.Session, which keeps
+connections to the server alive between them. Results, errors and transfer
+progress come back as Qt signals, which are delivered on the GUI thread.
+"""
+import io
+import os
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+POOL_SIZE = 4
+CHUNK_SIZE = 256 * 1024
+# (connect, read) seconds; the read timeout covers the wait before the first byte,
+# so it has to outlast the server's REPORT_RENDER_TIMEOUT for large PDF reports
+TIMEOUT = (10, 900)
+# Seconds between progress signals, so large transfers don't flood the event loop
+PROGRESS_INTERVAL = 1 / 30
+
+
+class Cancelled(Exception):
+    pass
+
+
+class TokenAuth(requests.auth.AuthBase):
+    """Sends the signed token from /api/login/ instead of the password on every call."""
+    def __init__(self, token):
+        self.token = token
+
+    def __call__(self, r):
+        r.headers['Authorization'] = f'Token {self.token}'
+        return r
+
+
+class TaskSignals(QObject):
+    finished = pyqtSignal(object)  # whatever the task function returned
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    progress = pyqtSignal('qint64', 'qint64')  # done, total (0 when unknown)
+
+
+class Task(QRunnable):
+    """Runs `fn(task)` on the pool; `fn` calls task.check() / task.report() as it goes."""
+
+    def __init__(self, fn):
+        super().__init__()
+        self.setAutoDelete(False)  # ApiClient keeps the reference until a signal fires
+        self.fn = fn
+        self.signals = TaskSignals()
+        self.cancel_event = threading.Event()
+        self.last_report = 0.0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise Cancelled()
+
+    def wait(self, seconds):
+        # Sleep that wakes up as soon as the task is cancelled
+        if self.cancel_event.wait(seconds):
+            raise Cancelled()
+
+    def report(self, done, total=0):
+        now = time.monotonic()
+        if (total and done >= total) or now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.signals.progress.emit(done, total)
+
+    def run(self):
+        try:
+            result = self.fn(self)
+        except Cancelled:
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            # A cancelled upload surfaces as a broken connection; report it as a cancel
+            if self.is_cancelled():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(str(e) or type(e).__name__)
+            return
+        if self.is_cancelled():
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(result)
+
+
+class MultipartFile:
+    """A multipart/form-data body streamed from disk, reporting progress as it is sent."""
+
+    def __init__(self, path, field, task):
+        boundary = uuid.uuid4().hex
+        filename = os.path.basename(path).replace('"', '%22')
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = (f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                'Content-Type: text/csv\r\n\r\n').encode()
+        tail = f'\r\n--{boundary}--\r\n'.encode()
+        self.file = open(path, 'rb')
+        self.parts = [io.BytesIO(head), self.file, io.BytesIO(tail)]
+        # Known length, so requests sends Content-Length instead of a chunked body
+        self.length = len(head) + os.fstat(self.file.fileno()).st_size + len(tail)
+        self.sent = 0
+        self.task = task
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        self.task.check()
+        size = CHUNK_SIZE if size is None or size < 0 else size
+        data = b''
+        while self.parts and len(data) < size:
+            block = self.parts[0].read(size - len(data))
+            if not block:
+                self.parts.pop(0)
+            data += block
+        self.sent += len(data)
+        self.task.report(self.sent, self.length)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def make_session(pool_size=POOL_SIZE):
+    """A Session keeping up to `pool_size` connections alive, one per concurrent request."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ApiClient:
+    """One Session and one thread pool for every request the client makes."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = make_session()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(POOL_SIZE)
+        self.tasks = set()
+        # Set when the app started without the server; requests are then answered from the local cache
+        self.offline = False
+
+    def set_token(self, token):
+        self.session.auth = TokenAuth(token)
+
+    def submit(self, fn, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """Run `fn(task)` on the pool; the callbacks run on the GUI thread."""
+        task = Task(fn)
+        signals = task.signals
+        for signal, slot in ((signals.finished, on_done), (signals.failed, on_error),
+                             (signals.progress, on_progress), (signals.cancelled, on_cancel)):
+            if slot:
+                signal.connect(slot)
+        for signal in (signals.finished, signals.failed, signals.cancelled):
+            signal.connect(lambda *_, t=task: self.tasks.discard(t))
+        self.tasks.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    # Called from inside task functions, i.e. on a pool thread
+
+    def request(self, task, method, path, **kwargs):
+        task.check()
+        kwargs.setdefault('timeout', TIMEOUT)
+        return self.session.request(method, f'{self.base_url}{path}', **kwargs)
+
+    def get(self, task, path, **kwargs):
+        return self.request(task, 'GET', path, **kwargs)
+
+    def post(self, task, path, **kwargs):
+        return self.request(task, 'POST', path, **kwargs)
+
+    def upload(self, task, path, file_path, field='file'):
+        body = MultipartFile(file_path, field, task)
+        try:
+            return self.post(task, path, data=body, headers={'Content-Type': body.content_type})
+        finally:
+            body.close()
+
+    def download(self, task, path, dest, **kwargs):
+        """Stream a 200 response to `dest` (written to a temporary name first); returns the response."""
+        with self.get(task, path, stream=True, **kwargs) as res:
+            if res.status_code != 200:
+                return res
+            total = int(res.headers.get('Content-Length') or 0)
+            partial = f'{dest}.part'
+            done = 0
+            try:
+                with open(partial, 'wb') as f:
+                    for chunk in res.iter_content(CHUNK_SIZE):
+                        task.check()
+                        f.write(chunk)
+                        done += len(chunk)
+                        task.report(done, total)
+                os.replace(partial, dest)
+            except BaseException:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                raise
+            return res
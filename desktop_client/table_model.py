@@ -0,0 +1,160 @@
+"""
+Table model for equipment rows, backed by one array per column.
+
+QTableView only asks for the cells it is drawing, so nothing is created per
+cell: a 200k-row upload costs its column arrays and nothing more. Further
+pages are fetched when the view scrolls to the end (canFetchMore/fetchMore),
+and sorting reorders an index array, never the data.
+
+Each row may come with the server's anomaly bitmask (`anomaly_flags`); the
+measurements it flags as outside their type's usual range are highlighted.
+"""
+import numpy as np
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QBrush, QColor
+
+NUMERIC_COLUMNS = {'Flowrate', 'Pressure', 'Temperature'}
+# Bits of the server's anomaly flags (api.anomalies.FLAG_BITS)
+ANOMALY_BITS = {'Flowrate': 1, 'Pressure': 2, 'Temperature': 4}
+ANOMALY_BRUSH = QBrush(QColor('#f8d7da'))
+
+
+def to_array(header, values):
+    if header in NUMERIC_COLUMNS:
+        try:
+            return np.asarray(values, dtype=float)  # None -> nan
+        except (TypeError, ValueError):
+            pass
+    return np.asarray(values, dtype=object)
+
+
+def flag_array(flags, count):
+    # Pages from servers without anomaly flags highlight nothing
+    return np.asarray(flags if flags is not None and len(flags) == count else np.zeros(count), dtype=np.int64)
+
+
+class EquipmentTableModel(QAbstractTableModel):
+    """
+    `columns` is {header: [values]} (the columnar API format) and `flags`
+    the rows' anomaly bitmasks. With `fetch_page(cursor, on_done, on_error)`
+    the model loads the page after `next_cursor` on demand;
+    `on_done(columns, next_cursor, flags)` appends it.
+    """
+
+    def __init__(self, columns, next_cursor=None, fetch_page=None, flags=None, parent=None):
+        super().__init__(parent)
+        self.headers = list(columns)
+        self.columns = [to_array(h, columns[h]) for h in self.headers]
+        self.flags = flag_array(flags, self.rowCount())
+        self.next_cursor = next_cursor
+        self.fetch_page = fetch_page
+        self.loading = False
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.order = None  # view row -> stored row; None while unsorted
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        column = self.columns[index.column()]
+        if role == Qt.TextAlignmentRole and column.dtype.kind == 'f':
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        row = index.row() if self.order is None else self.order[index.row()]
+        if role in (Qt.BackgroundRole, Qt.ToolTipRole):
+            bit = ANOMALY_BITS.get(self.headers[index.column()], 0)
+            if not self.flags[row] & bit:
+                return None
+            return ANOMALY_BRUSH if role == Qt.BackgroundRole else "Outside the usual range for this type"
+        if role != Qt.DisplayRole:
+            return None
+        value = column[row]
+        if value is None or (column.dtype.kind == 'f' and np.isnan(value)):
+            return ''
+        return str(value)
+
+    def row_values(self, row):
+        """{header: value} of the row shown at view row `row`."""
+        stored = row if self.order is None else self.order[row]
+        return {h: col[stored] for h, col in zip(self.headers, self.columns)}
+
+    # Lazy paging: the view calls these when it scrolls to the last row
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return (not parent.isValid() and self.fetch_page is not None
+                and self.next_cursor is not None and not self.loading)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        self.fetch_page(self.next_cursor, self.append_page, self.page_failed)
+
+    def append_page(self, columns, next_cursor, flags=None):
+        self.loading = False
+        self.next_cursor = next_cursor
+        count = len(next(iter(columns.values()), []))
+        if not count:
+            return
+        start = self.rowCount()
+        self.beginInsertRows(QModelIndex(), start, start + count - 1)
+        self.extend(columns)
+        self.flags = np.concatenate([self.flags, flag_array(flags, count)])
+        if self.order is not None:
+            self.order = np.concatenate([self.order, np.arange(start, start + count)])
+        self.endInsertRows()
+        if self.order is not None:
+            # Merge the new rows into the current sort
+            self.reorder(self.sorted_order(self.sort_column, self.sort_order))
+
+    def page_failed(self, message):
+        # Leave next_cursor as is, so scrolling to the end retries
+        self.loading = False
+
+    def extend(self, columns):
+        if not self.headers:
+            self.headers = list(columns)
+            self.columns = [to_array(h, []) for h in self.headers]
+        self.columns = [np.concatenate([col, to_array(h, columns[h]).astype(col.dtype)])
+                        for h, col in zip(self.headers, self.columns)]
+
+    # Sorting covers the rows loaded so far; later pages are merged into the order
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        self.reorder(self.sorted_order(column, order))
+
+    def sorted_order(self, column, order):
+        if column < 0 or column >= len(self.columns):
+            return None
+        values = self.columns[column]
+        keys = values if values.dtype.kind == 'f' else values.astype(str)
+        indices = np.argsort(keys, kind='stable')
+        return indices[::-1] if order == Qt.DescendingOrder else indices
+
+    def reorder(self, order):
+        self.layoutAboutToBeChanged.emit()
+        # Keep selection/current index on the same stored rows
+        old = self.persistentIndexList()
+        stored = [i.row() if self.order is None else int(self.order[i.row()]) for i in old]
+        self.order = order
+        if order is not None:
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            stored = [int(position[row]) for row in stored]
+        self.changePersistentIndexList(old, [self.index(row, i.column()) for row, i in zip(stored, old)])
+        self.layoutChanged.emit()
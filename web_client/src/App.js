@@ -1,32 +1,47 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { Bar } from 'react-chartjs-2';
 import 'bootstrap/dist/css/bootstrap.min.css';
 import './index.css';
 import { Chart as ChartJS } from 'chart.js/auto';
 
+// Give up on an ingest job that reports no progress for this long (the server requeues it after 10 minutes)
+const JOB_STALL_MS = 15 * 60 * 1000;
+
 function App() {
   // Auth State
   const [isLoginMode, setIsLoginMode] = useState(true);
   const [username, setUsername] = useState('');
   const [password, setPassword] = useState('');
   const [isLoggedIn, setIsLoggedIn] = useState(false);
+  const [token, setToken] = useState('');
   const [error, setError] = useState('');
 
   // Data State
   const [file, setFile] = useState(null);
   const [data, setData] = useState(null);
   const [history, setHistory] = useState([]);
+  const [uploadStatus, setUploadStatus] = useState('');
+  // ETag of the history we already have; the server answers 304 while it still matches
+  const historyEtag = useRef(null);
 
   // --- HELPER: Get Auth Headers ---
+  // Signed token from /api/login/, so the server skips the password hash on every call
   const getAuthHeader = useCallback(() => {
-    return { auth: { username, password } };
-  }, [username, password]);
+    return { headers: { Authorization: `Token ${token}` } };
+  }, [token]);
 
   // --- ACTION: Fetch History ---
   const fetchHistory = useCallback(async () => {
     try {
-      const res = await axios.get('http://127.0.0.1:8000/api/history/', getAuthHeader());
+      const config = getAuthHeader();
+      if (historyEtag.current) config.headers['If-None-Match'] = historyEtag.current;
+      const res = await axios.get('http://127.0.0.1:8000/api/history/', {
+        ...config,
+        validateStatus: status => (status >= 200 && status < 300) || status === 304
+      });
+      if (res.status === 304) return;
+      historyEtag.current = res.headers.etag || null;
       setHistory(res.data);
     } catch (err) { 
       console.error(err); 
@@ -52,7 +67,8 @@ function App() {
     if (isLoginMode) {
       // LOGIN
       try {
-        await axios.get('http://127.0.0.1:8000/api/history/', getAuthHeader());
+        const res = await axios.post('http://127.0.0.1:8000/api/login/', null, { auth: { username, password } });
+        setToken(res.data.token);
         setIsLoggedIn(true);
       } catch (err) {
         setError('Invalid Credentials');
@@ -71,26 +87,78 @@ function App() {
 
   const handleLogout = () => {
     setIsLoggedIn(false);
+    setToken('');
     setUsername('');
     setPassword('');
     setData(null);
     setHistory([]);
+    historyEtag.current = null;
   };
 
   // --- DATA ACTIONS ---
+  const pollJob = async (jobId) => {
+    // Poll the ingest job until the worker finishes, giving up once it stops making progress
+    let rows = -1;
+    let deadline = 0;
+    while (true) {
+      const res = await axios.get(`http://127.0.0.1:8000/api/jobs/${jobId}/`, getAuthHeader());
+      const job = res.data;
+      if (job.state === 'done') return job.result;
+      if (job.state === 'failed') throw Object.assign(new Error(job.error), { rowErrors: job.row_errors });
+      if (job.rows_processed !== rows) {
+        rows = job.rows_processed;
+        deadline = Date.now() + JOB_STALL_MS;
+      } else if (Date.now() > deadline) {
+        throw new Error('The server stopped reporting progress on this upload');
+      }
+      setUploadStatus(`Processing... ${job.rows_processed.toLocaleString()} rows`);
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
+  // Rows the server left out of an upload: {rejected_rows, errors: [{line, column, reason}], truncated}
+  const describeRowErrors = (report) => {
+    const lines = report.errors.slice(0, 10).map(e => `Line ${e.line}: ${e.column ? e.column + ': ' : ''}${e.reason}`);
+    if (report.truncated || report.errors.length > 10) lines.push('...');
+    return `${report.rejected_rows.toLocaleString()} rows were skipped:\n${lines.join('\n')}`;
+  };
+
   const handleUpload = async () => {
     if (!file) return;
     const formData = new FormData();
     formData.append('file', file);
 
     try {
-      const res = await axios.post('http://127.0.0.1:8000/api/upload/', formData, {
-        headers: { 'Content-Type': 'multipart/form-data' },
-        ...getAuthHeader()
+      setUploadStatus('Uploading...');
+      const res = await axios.post('http://127.0.0.1:8000/api/upload/?async=1', formData, {
+        headers: { 'Content-Type': 'multipart/form-data', ...getAuthHeader().headers }
       });
-      setData(res.data);
+      const result = await pollJob(res.data.job_id);
+      setData(result);
       fetchHistory();
-    } catch (err) { alert("Upload Failed"); }
+      if (result.row_errors?.rejected_rows) alert(describeRowErrors(result.row_errors));
+    } catch (err) {
+      // Header problems are answered with a 400 straight away, files without valid rows fail the job
+      const message = err.response?.data?.error || err.message;
+      const report = err.rowErrors || err.response?.data?.row_errors;
+      alert(`Upload Failed: ${message}` + (report ? `\n\n${describeRowErrors(report)}` : ''));
+    }
+    setUploadStatus('');
+  };
+
+  // Past uploads carry their precomputed stats, so viewing one needs no extra request
+  const viewUpload = (h) => {
+    setData({
+      id: h.id,
+      stats: {
+        total_count: h.count,
+        avg_flowrate: h.avg_flowrate,
+        avg_pressure: h.avg_pressure,
+        avg_temperature: h.avg_temperature
+      },
+      distribution: h.distribution,
+      details: h.details
+    });
   };
 
   const downloadPDF = (id) => {
@@ -161,8 +229,8 @@ function App() {
               <input type="file" className="form-control" onChange={(e) => setFile(e.target.files[0])} />
             </div>
             <div className="col-md-4">
-              <button onClick={handleUpload} className="btn btn-primary w-100" style={{background: '#667eea', border: 'none'}}>
-                Upload & Analyze
+              <button onClick={handleUpload} disabled={!!uploadStatus} className="btn btn-primary w-100" style={{background: '#667eea', border: 'none'}}>
+                {uploadStatus || 'Upload & Analyze'}
               </button>
             </div>
           </div>
@@ -184,7 +252,13 @@ function App() {
                     </div>
                   ))}
                 </div>
-                
+                {data.anomalies?.count > 0 && (
+                  <div className="alert alert-warning py-2">
+                    {data.anomalies.count} rows have a measurement outside their type's usual range
+                    (robust z-score above {data.anomalies.threshold}).
+                  </div>
+                )}
+
                 {/* Chart */}
                 <div className="card border-0 shadow-sm p-4 mb-4" style={{borderRadius: '12px'}}>
                   <h5 className="mb-3">Distribution</h5>
@@ -201,6 +275,38 @@ function App() {
                   </div>
                 </div>
                 
+                {/* Per-type stats */}
+                {data.details?.by_type && (
+                  <div className="card border-0 shadow-sm p-4 mb-4" style={{borderRadius: '12px'}}>
+                    <h5 className="mb-3">Statistics by Type</h5>
+                    <table className="table table-sm mb-0">
+                      <thead>
+                        <tr>
+                          <th>Type</th>
+                          {['flowrate', 'pressure', 'temperature'].map(col => (
+                            <th key={col} className="text-capitalize">{col} (mean / std / min-max)</th>
+                          ))}
+                        </tr>
+                      </thead>
+                      <tbody>
+                        {Object.entries(data.details.by_type).map(([type, cols]) => (
+                          <tr key={type}>
+                            <td>{type} <small className="text-muted">({data.distribution[type] || 0})</small></td>
+                            {['flowrate', 'pressure', 'temperature'].map(col => {
+                              const c = cols[col];
+                              return (
+                                <td key={col}>
+                                  {c && c.count ? `${c.mean.toFixed(2)} / ${(c.std || 0).toFixed(2)} / ${c.min.toFixed(2)}-${c.max.toFixed(2)}` : '-'}
+                                </td>
+                              );
+                            })}
+                          </tr>
+                        ))}
+                      </tbody>
+                    </table>
+                  </div>
+                )}
+
                 <button onClick={() => downloadPDF(data.id)} className="btn btn-dark mb-4">Download Full Report PDF</button>
               </>
             )}
@@ -259,21 +365,38 @@ function App() {
                         </div>
                       </div>
 
-                      <button 
-                        onClick={() => downloadPDF(h.id)} 
-                        className="btn btn-sm"
-                        style={{
-                          color: '#667eea', 
-                          background: '#ebf4ff', 
-                          border: 'none',
-                          fontWeight: '600',
-                          padding: '6px 12px',
-                          borderRadius: '6px',
-                          fontSize: '0.8rem'
-                        }}
-                      >
-                        PDF
-                      </button>
+                      <div className="d-flex flex-shrink-0">
+                        <button
+                          onClick={() => viewUpload(h)}
+                          className="btn btn-sm me-1"
+                          style={{
+                            color: '#4a5568',
+                            background: '#edf2f7',
+                            border: 'none',
+                            fontWeight: '600',
+                            padding: '6px 12px',
+                            borderRadius: '6px',
+                            fontSize: '0.8rem'
+                          }}
+                        >
+                          View
+                        </button>
+                        <button 
+                          onClick={() => downloadPDF(h.id)} 
+                          className="btn btn-sm"
+                          style={{
+                            color: '#667eea', 
+                            background: '#ebf4ff', 
+                            border: 'none',
+                            fontWeight: '600',
+                            padding: '6px 12px',
+                            borderRadius: '6px',
+                            fontSize: '0.8rem'
+                          }}
+                        >
+                          PDF
+                        </button>
+                      </div>
                     </div>
                   ))}
                 </div>